@@ -0,0 +1,85 @@
+"""
+Benchmark: response compression
+
+Measures the CPU time and the bytes saved by each encoding on
+recommendation lists of realistic sizes.
+
+Usage:
+    python -m benchmarks.bench_compression
+"""
+import json
+import random
+import time
+import zlib
+from datetime import date, timedelta
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TYPES = ["UPSELL", "CROSS_SELL", "FREQUENTLY_BOUGHT_TOGETHER", "RECOMMENDED_FOR_YOU", "TRENDING", "UNKNOWN"]
+SIZES = (10, 100, 1000, 10000)
+LEVEL = 6
+
+
+def make_payload(count: int) -> bytes:
+    """Builds a JSON list shaped like GET /api/recommendations"""
+    rng = random.Random(count)
+    start = date(2023, 1, 1)
+    items = [
+        {
+            "id": index + 1,
+            "user_id": rng.randint(1, 100000),
+            "product_id": rng.randint(1, 500000),
+            "recommendation_type": rng.choice(TYPES),
+            "create_date": (start + timedelta(days=rng.randint(0, 300))).isoformat(),
+            "update_date": (start + timedelta(days=rng.randint(300, 600))).isoformat(),
+            "bought_in_last_30_days": rng.random() < 0.3,
+            "rating": rng.randint(0, 5),
+        }
+        for index in range(count)
+    ]
+    return (json.dumps(items) + "\n").encode()
+
+
+def encoders():
+    """The encodings to compare"""
+    def gzip(data):
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    result = {
+        "gzip": gzip,
+        "deflate": lambda data: zlib.compress(data, LEVEL),
+    }
+    if brotli is not None:
+        result["br"] = lambda data: brotli.compress(data, quality=LEVEL)
+    return result
+
+
+def measure(encode, data: bytes, repeat: int):
+    """Returns the compressed size and the average CPU seconds per call"""
+    size = len(encode(data))
+    started = time.process_time()
+    for _ in range(repeat):
+        encode(data)
+    return size, (time.process_time() - started) / repeat
+
+
+def main():
+    """Prints one row per list size and encoding"""
+    print(f"{'items':>6} {'encoding':>8} {'raw bytes':>10} {'compressed':>10} {'saved':>6} {'cpu ms':>8} {'MB/s':>7}")
+    for count in SIZES:
+        data = make_payload(count)
+        repeat = max(3, 20000 // count)
+        for name, encode in encoders().items():
+            size, seconds = measure(encode, data, repeat)
+            print(
+                f"{count:>6} {name:>8} {len(data):>10} {size:>10} {1 - size / len(data):>6.1%} "
+                f"{seconds * 1000:>8.3f} {len(data) / seconds / 1e6 if seconds else 0:>7.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: request logging
+
+Measures requests per second through the Flask test client with logging
+off, written synchronously in text and JSON, written by the queue
+listener thread, and written by the listener for 10% of the requests.
+Records go to a file, which flushes after every record like the stream
+handlers of gunicorn.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_logging
+"""
+import logging
+import os
+import tempfile
+import time
+from unittest.mock import patch
+from service import app
+from service.common import log_handlers
+from service.models import Recommendation, RecommendationType, db
+
+REQUESTS = 1000
+USERS = 50
+
+UNSAMPLED = {"LOG_SAMPLE_RATES": "", "LOG_REQUEST_SAMPLE_RATE": 1.0}
+MODES = (
+    ("off", None),
+    ("sync text", {**UNSAMPLED, "LOG_FORMAT": "text", "LOG_ASYNC": False}),
+    ("sync json", {**UNSAMPLED, "LOG_FORMAT": "json", "LOG_ASYNC": False}),
+    ("async json", {**UNSAMPLED, "LOG_FORMAT": "json", "LOG_ASYNC": True}),
+    ("async json, requests=0.1", {**UNSAMPLED, "LOG_FORMAT": "json", "LOG_ASYNC": True, "LOG_REQUEST_SAMPLE_RATE": 0.1}),
+)
+
+
+def seed():
+    """Creates a few recommendations for each user"""
+    db.create_all()
+    db.session.query(Recommendation).delete()
+    for user_id in range(1, USERS + 1):
+        for product_id in range(1, 6):
+            Recommendation(
+                user_id=user_id,
+                product_id=product_id,
+                recommendation_type=RecommendationType.UPSELL,
+                bought_in_last_30_days=False,
+            ).create()
+    return [row.id for row in Recommendation.all()]
+
+
+def configure(settings, path: str):
+    """Routes the app logs to path with settings, or turns them off"""
+    source = logging.getLogger("bench.gunicorn")
+    source.handlers = [logging.FileHandler(path)]
+    source.setLevel(logging.WARNING if settings is None else logging.INFO)
+    with patch.dict(app.config, settings or {**UNSAMPLED, "LOG_ASYNC": False}):
+        log_handlers.init_logging(app, "bench.gunicorn")
+    return source.handlers[0]
+
+
+def requests_per_second(client, ids) -> float:
+    """Returns the best requests per second of three runs of item and list reads"""
+    best = 0.0
+    for _ in range(3):
+        started = time.perf_counter()
+        for number in range(REQUESTS):
+            if number % 2:
+                client.get(f"/api/recommendations/{ids[number % len(ids)]}")
+            else:
+                client.get(f"/api/recommendations?user_id={number % USERS + 1}")
+        best = max(best, REQUESTS / (time.perf_counter() - started))
+    log_handlers.stop_logging(app)  # the listener finishes writing
+    return best
+
+
+def main():
+    """Prints requests per second and log lines written for each mode"""
+    ids = seed()
+    client = app.test_client()
+    print(f"{'logging':<24} {'requests/s':>12} {'vs off':>8} {'lines':>8}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for name, settings in MODES:
+            path = os.path.join(directory, name.replace(" ", "_"))
+            handler = configure(settings, path)
+            rate = requests_per_second(client, ids)
+            handler.close()
+            with open(path, encoding="utf-8") as log_file:
+                lines = sum(1 for _ in log_file)
+            baseline = baseline or rate
+            print(f"{name:<24} {rate:>12,.0f} {rate / baseline:>7.2f}x {lines:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: payload validation
+
+Measures validated payloads per second for a single payload and for a
+10,000 item batch, comparing the compiled validator with the previous
+field by field deserialize logic (reproduced below as the baseline),
+which ran on a new Recommendation instance for every payload, including
+in the bulk import path.
+
+Usage:
+    python -m benchmarks.bench_validation
+"""
+import random
+import time
+from service.models import RECOMMENDATION_VALIDATOR, Recommendation, RecommendationType, DataValidationError
+
+BATCH_SIZE = 10000
+
+
+def legacy_deserialize(data):
+    """The isinstance / getattr / exception driven deserialize used before"""
+    recommendation = Recommendation()
+    try:
+        if not isinstance(data["user_id"], int):
+            raise DataValidationError("Invalid type for int [user_id]")
+        recommendation.user_id = data["user_id"]
+        if not isinstance(data["product_id"], int):
+            raise DataValidationError("Invalid type for int [product_id]")
+        recommendation.product_id = data["product_id"]
+        if isinstance(data["recommendation_type"], str):
+            recommendation.recommendation_type = getattr(RecommendationType, data["recommendation_type"])
+        else:
+            raise DataValidationError("Invalid type for string [recommendation_type]")
+        if isinstance(data["bought_in_last_30_days"], bool):
+            recommendation.bought_in_last_30_days = data["bought_in_last_30_days"]
+        else:
+            raise DataValidationError("Invalid type for bool [bought_in_last_30_days]")
+        if data.get("rating"):
+            if not isinstance(data["rating"], int):
+                raise DataValidationError("Invalid type for int [rating]")
+            recommendation.rating = data["rating"]
+    except (KeyError, TypeError, AttributeError) as error:
+        raise DataValidationError(str(error)) from error
+    return recommendation
+
+
+def make_payloads(count: int, invalid_ratio: float = 0.0):
+    """Builds create payloads, a share of them with a bad recommendation_type"""
+    rng = random.Random(count)
+    names = list(RecommendationType.__members__)
+    return [
+        {
+            "user_id": rng.randint(1, 100000),
+            "product_id": rng.randint(1, 500000),
+            "recommendation_type": "BAD" if rng.random() < invalid_ratio else rng.choice(names),
+            "bought_in_last_30_days": rng.random() < 0.3,
+            "rating": rng.randint(0, 5),
+        }
+        for _ in range(count)
+    ]
+
+
+def per_second(func, payloads, repeat: int) -> float:
+    """Returns the best payloads per second of three runs of repeat calls"""
+    best = 0.0
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(payloads)
+        best = max(best, len(payloads) * repeat / (time.perf_counter() - started))
+    return best
+
+
+def legacy_batch(payloads):
+    """Validates a batch one payload at a time, catching each failure"""
+    for data in payloads:
+        try:
+            legacy_deserialize(data)
+        except DataValidationError:
+            pass
+
+
+def compiled_single(payloads):
+    """Validates payloads one at a time with the compiled validator"""
+    for data in payloads:
+        try:
+            RECOMMENDATION_VALIDATOR.validate(data)
+        except DataValidationError:
+            pass
+
+
+def compiled_batch(payloads):
+    """Validates payloads as one batch with the compiled validator"""
+    RECOMMENDATION_VALIDATOR.validate_many(payloads)
+
+
+def main():
+    """Prints payloads per second for each case"""
+    print(f"{'case':<32} {'legacy/s':>12} {'compiled/s':>12} {'speedup':>8}")
+    cases = (
+        ("single payload", make_payloads(1), 50000, compiled_single),
+        (f"{BATCH_SIZE} batch, all valid", make_payloads(BATCH_SIZE), 5, compiled_batch),
+        (f"{BATCH_SIZE} batch, 10% invalid", make_payloads(BATCH_SIZE, 0.1), 5, compiled_batch),
+    )
+    for name, payloads, repeat, compiled in cases:
+        legacy = per_second(legacy_batch, payloads, repeat)
+        fast = per_second(compiled, payloads, repeat)
+        print(f"{name:<32} {legacy:>12,.0f} {fast:>12,.0f} {fast / legacy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
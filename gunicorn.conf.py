@@ -0,0 +1,12 @@
+"""
+gunicorn settings, read from the working directory
+"""
+
+
+def post_worker_init(_worker):
+    """Starts the background threads of a worker once it loaded the service"""
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.common import lifecycle
+
+    lifecycle.start(app)
@@ -8,7 +8,10 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import (
+    admission, assets, compression, counts, deadlines, invalidation, lifecycle, log_handlers, replicas, scoring,
+    shared_cache, singleflight, tracing, warmup, write_behind,
+)
 
 # Create Flask application
 app = Flask(__name__)
@@ -38,7 +41,7 @@ from service import routes, models  # noqa: E402, E261
 from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
 # Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+log_handlers.init_logging(app, "gunicorn.error", start=False)
 
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
@@ -51,4 +54,20 @@ except Exception as error:  # pylint: disable=broad-except
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+admission.init_app(app)
+deadlines.init_app(app)
+tracing.init_app(app)
+compression.init_app(app)
+assets.init_app(app)
+replicas.init_app(app)
+singleflight.init_app(app)
+shared_cache.init_app(app)
+counts.init_app(app)
+scoring.init_app(app)
+invalidation.init_app(app, start=False)
+write_behind.init_app(app, start=False)
+warmup.init_app(app, start=False)
+# background threads are started by gunicorn or the first request
+lifecycle.init_app(app)
+
 app.logger.info("Service initialized!")
@@ -0,0 +1,163 @@
+"""
+Admission Control
+
+This module sheds load before it reaches an exhausted database pool.
+Requests beyond ADMISSION_MAX_IN_FLIGHT concurrent requests in a
+worker, and requests arriving while the pool is saturated and its
+checkouts wait longer than ADMISSION_POOL_WAIT seconds, are rejected at
+once with 503 Service Unavailable and a Retry-After header instead of
+queuing until gunicorn times them out.
+
+Write requests are also rate limited per client with a token bucket of
+WRITE_RATE_LIMIT requests per second and bursts of WRITE_BURST, and are
+rejected with 429 Too Many Requests when the bucket is empty. Clients
+are identified by the X-Client-Id header, or their address.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from service.common.metrics import metrics
+from service.common.views import view_attribute
+from service.models import db
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def no_admission(func):
+    """Marks a view function, or a Resource method, as never shed nor throttled"""
+    func.no_admission = True
+    return func
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """Allows rate requests per second on average and bursts of burst"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returning 0 or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Decides which requests a worker accepts
+
+    Args:
+        max_in_flight (int): concurrent requests accepted, 0 for no limit
+        pool_wait (float): pool wait in seconds above which a saturated
+            pool sheds requests, 0 to never shed on the pool
+        write_rate (float): writes per second per client, 0 for no limit
+        write_burst (int): writes a client may send at once
+        retry_after (int): seconds suggested to shed clients
+        max_clients (int): token buckets kept, least recently used first out
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, max_in_flight=0, pool_wait=0.0, write_rate=0.0, write_burst=20, retry_after=1, max_clients=10000
+    ):
+        self.max_in_flight = max_in_flight
+        self.pool_wait = pool_wait
+        self.write_rate = write_rate
+        self.write_burst = write_burst
+        self.retry_after = retry_after
+        self.max_clients = max_clients
+        self.in_flight = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, client: str, write: bool):
+        """Accepts a request or raises ServiceUnavailable or TooManyRequests"""
+        if write and self.write_rate:
+            wait = self._throttle(client)
+            if wait:
+                metrics.increment("requests_throttled")
+                raise TooManyRequests("Too many writes, slow down.", retry_after=math.ceil(wait))
+        if self.pool_wait and self._pool_overloaded():
+            metrics.increment("requests_shed")
+            metrics.increment("requests_shed_pool")
+            raise ServiceUnavailable("The database is overloaded, retry later.", retry_after=self.retry_after)
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                shed = True
+            else:
+                shed = False
+                self.in_flight += 1
+            in_flight = self.in_flight
+        metrics.gauge("requests_in_flight", in_flight)
+        if shed:
+            metrics.increment("requests_shed")
+            metrics.increment("requests_shed_in_flight")
+            raise ServiceUnavailable("Too many requests in progress, retry later.", retry_after=self.retry_after)
+
+    def release(self):
+        """Ends an admitted request"""
+        with self._lock:
+            self.in_flight -= 1
+            in_flight = self.in_flight
+        metrics.gauge("requests_in_flight", in_flight)
+
+    def _throttle(self, client: str) -> float:
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                bucket = TokenBucket(self.write_rate, self.write_burst)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return bucket.take()
+
+    def _pool_overloaded(self) -> bool:
+        pool = db.engine.pool
+        saturated = getattr(pool, "saturated", None)
+        wait_time = getattr(pool, "wait_time", 0.0)
+        metrics.gauge("db_pool_wait_seconds", round(wait_time, 4))
+        return saturated is not None and wait_time > self.pool_wait and saturated()
+
+
+def client_id() -> str:
+    """Identifies the client sending this request"""
+    return request.headers.get("X-Client-Id") or request.remote_addr or "unknown"
+
+
+def init_app(app):
+    """Registers the admission hooks on app"""
+    controller = AdmissionController(
+        max_in_flight=app.config["ADMISSION_MAX_IN_FLIGHT"],
+        pool_wait=app.config["ADMISSION_POOL_WAIT"],
+        write_rate=app.config["WRITE_RATE_LIMIT"],
+        write_burst=app.config["WRITE_BURST"],
+        retry_after=app.config["ADMISSION_RETRY_AFTER"],
+    )
+    if "admission" not in app.extensions:
+
+        @app.before_request
+        def admit_request():  # pylint: disable=unused-variable
+            current = app.extensions["admission"]
+            if view_attribute(app, "no_admission", False):
+                return
+            write = request.method in WRITE_METHODS and not view_attribute(app, "read_only", False)
+            current.admit(client_id(), write)
+            g.admitted = current
+
+        @app.teardown_request
+        def release_request(_error):  # pylint: disable=unused-variable
+            admitted = g.pop("admitted", None)
+            if admitted is not None:
+                admitted.release()
+
+    app.extensions["admission"] = controller
+    return controller
@@ -0,0 +1,163 @@
+"""
+Static Assets
+
+This module builds and serves fingerprinted static assets. The
+build-assets command copies every static file to static/dist under a
+name holding a hash of its content, e.g. js/rest_api.3f2a1b9c8d7e.js,
+writes gzip (and brotli, when installed) versions of the text files
+next to it, and rewrites the references of index.html to the new
+names. The mapping is kept in static/dist/manifest.json.
+
+Once built, fingerprinted files are served with an immutable
+Cache-Control header and the precompressed version the client accepts.
+index.html keeps its name and is revalidated on every load, so a new
+build is picked up at once. Without a build the static files are
+served as they are.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+INDEX = "index.html"
+# a year, the longest max-age browsers honor
+IMMUTABLE_MAX_AGE = 31536000
+# characters of the content hash kept in file names
+HASH_LENGTH = 12
+# types worth precompressing, images are compressed already
+COMPRESSIBLE = (".css", ".js", ".html", ".svg", ".json", ".txt")
+# static/... references in href and src attributes
+REFERENCE = re.compile(r'((?:href|src)=")/?static/([^"?#]+)(")')
+
+
+def fingerprint(path: str, content: bytes) -> str:
+    """Returns path with a hash of content inserted before the extension"""
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{digest}{extension}"
+
+
+def _precompress(target: str, content: bytes) -> list:
+    """Writes the compressed versions of target smaller than content"""
+    encodings = []
+    variants = [("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ("br", ".br", lambda data: brotli.compress(data, quality=11)))
+    for encoding, suffix, compress in variants:
+        compressed = compress(content)
+        if len(compressed) < len(content):
+            with open(target + suffix, "wb") as output:
+                output.write(compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def _write(dist: str, name: str, content: bytes, encodings: dict):
+    """Writes one file of the build with its compressed versions"""
+    target = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as output:
+        output.write(content)
+    if name.endswith(COMPRESSIBLE):
+        encodings[f"{DIST}/{name}"] = _precompress(target, content)
+
+
+def build(static_folder: str) -> dict:
+    """
+    Builds the fingerprinted assets of static_folder into its dist folder
+
+    Returns:
+        the manifest, mapping each static file to its fingerprinted name
+    """
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    files, encodings = {}, {}
+    for directory, folders, names in os.walk(static_folder):
+        folders[:] = sorted(folder for folder in folders if os.path.join(directory, folder) != dist)
+        for name in sorted(names):
+            path = os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, "/")
+            if path == INDEX:
+                continue
+            with open(os.path.join(directory, name), "rb") as source:
+                content = source.read()
+            hashed = fingerprint(path, content)
+            _write(dist, hashed, content, encodings)
+            files[path] = f"{DIST}/{hashed}"
+
+    with open(os.path.join(static_folder, INDEX), encoding="utf-8") as source:
+        index = REFERENCE.sub(
+            lambda match: match.group(1) + "static/" + files.get(match.group(2), match.group(2)) + match.group(3),
+            source.read(),
+        )
+    _write(dist, INDEX, index.encode("utf-8"), encodings)
+
+    manifest = {"files": files, "encodings": encodings}
+    with open(os.path.join(dist, MANIFEST), "w", encoding="utf-8") as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets:
+    """
+    Serves the assets built by build
+
+    Args:
+        static_folder (str): the static folder of the application
+        manifest (dict): the manifest returned by build
+    """
+
+    def __init__(self, static_folder: str, manifest: dict):
+        self.static_folder = static_folder
+        self.immutable = frozenset(manifest["files"].values())
+        self.encodings = manifest["encodings"]
+
+    def send(self, filename: str):
+        """Sends filename, or the precompressed version the client accepts"""
+        encoding = request.accept_encodings.best_match(self.encodings.get(filename, ()))
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        suffix = {"br": ".br", "gzip": ".gz"}.get(encoding, "")
+        response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if filename in self.encodings:
+            response.vary.add("Accept-Encoding")
+        if filename in self.immutable:
+            response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def init_app(app):
+    """Serves the built assets of app, when build-assets was run"""
+    app.extensions.pop("assets", None)
+    path = os.path.join(app.static_folder, DIST, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as manifest_file:
+        assets = Assets(app.static_folder, json.load(manifest_file))
+    app.extensions["assets"] = assets
+    if not app.extensions.get("assets_view"):
+        app.extensions["assets_view"] = True
+        serve_static = app.view_functions["static"]
+
+        def static(filename):
+            current = app.extensions.get("assets")
+            if current is not None and filename in current.immutable:
+                return current.send(filename)
+            return serve_static(filename=filename)
+
+        app.view_functions["static"] = static
+    app.logger.info("Serving %d fingerprinted assets", len(assets.immutable))
+    return assets
@@ -0,0 +1,197 @@
+"""
+Bulk I/O
+
+This module contains the streaming readers and writers used by the
+bulk import and export commands. Records are handled one at a time
+and grouped into bounded chunks so memory use does not depend on the
+file size.
+"""
+import csv
+import gzip
+import json
+from datetime import date
+from itertools import islice
+from service.models import RECOMMENDATION_VALIDATOR, DataValidationError
+
+FORMATS = ("csv", "ndjson")
+
+INT_FIELDS = ("user_id", "product_id", "rating")
+BOOL_VALUES = {
+    "true": True,
+    "t": True,
+    "1": True,
+    "yes": True,
+    "false": False,
+    "f": False,
+    "0": False,
+    "no": False,
+}
+
+
+def detect_format(path: str) -> str:
+    """Guesses the file format from the file name"""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    raise ValueError(f"Cannot detect the format of '{path}', use --format")
+
+
+def open_text(path: str, mode: str = "rt", compress: bool = False):
+    """Opens a text file, transparently handling gzip compression"""
+    if path == "-":
+        raise ValueError("Reading from stdin is not supported")
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")  # pylint: disable=consider-using-with
+
+
+######################################################################
+# Readers
+######################################################################
+def coerce_csv_record(record: dict) -> dict:
+    """Converts the string values of a CSV row into their JSON types"""
+    data = {}
+    for key, value in record.items():
+        if key is None:
+            raise DataValidationError("Invalid Recommendation: too many columns")
+        if value is None or value == "":
+            continue
+        if key in INT_FIELDS:
+            try:
+                value = int(value)
+            except ValueError as error:
+                raise DataValidationError(f"Invalid type for int [{key}]") from error
+        elif key == "bought_in_last_30_days":
+            if value.lower() not in BOOL_VALUES:
+                raise DataValidationError(f"Invalid type for bool [{key}]: {value}")
+            value = BOOL_VALUES[value.lower()]
+        data[key] = value
+    return data
+
+
+def read_records(stream, fmt: str):
+    """
+    Yields (line_number, raw_record, data) tuples from a CSV or NDJSON stream
+
+    data is a DataValidationError when the line could not be parsed
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            try:
+                yield reader.line_num, record, coerce_csv_record(record)
+            except DataValidationError as error:
+                yield reader.line_num, record, error
+    elif fmt == "ndjson":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, line.rstrip("\n"), json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, line.rstrip("\n"), DataValidationError(
+                    f"Invalid JSON: {error.msg}"
+                )
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+
+
+def validate_record(data, keep_dates: bool = False) -> dict:
+    """
+    Validates a record with the same rules as Recommendation.deserialize
+
+    Returns the column values ready to be inserted. When keep_dates is
+    set, ISO create_date and update_date values in the record are kept.
+    """
+    return _to_row(RECOMMENDATION_VALIDATOR.validate(data), data if keep_dates else {})
+
+
+def validate_records(items):
+    """
+    Validates a batch of records, collecting the errors of every record
+
+    Returns:
+        (rows, errors) where errors maps the position of every invalid
+        record to its list of errors
+    """
+    values, errors = RECOMMENDATION_VALIDATOR.validate_many(items)
+    return [_to_row(item) for item in values], errors
+
+
+def _to_row(values: dict, data: dict = None) -> dict:
+    """Completes validated values with the defaults of a new row"""
+    today = date.today()
+    return {
+        "user_id": values["user_id"],
+        "product_id": values["product_id"],
+        "recommendation_type": values["recommendation_type"],
+        "bought_in_last_30_days": values["bought_in_last_30_days"],
+        "rating": values.get("rating", 0),
+        "create_date": _parse_date(data, "create_date", today) if data else today,
+        "update_date": _parse_date(data, "update_date", today) if data else today,
+    }
+
+
+def _parse_date(data: dict, key: str, default: date) -> date:
+    """Parses an optional ISO date so migrated rows keep their history"""
+    value = data.get(key)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid date for [{key}]: {value}") from error
+
+
+def chunked(iterable, size: int):
+    """Yields lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def error_line(line_number: int, raw, error) -> str:
+    """Formats a rejected record as a line of NDJSON"""
+    return json.dumps({"line": line_number, "error": str(error), "record": raw}) + "\n"
+
+
+######################################################################
+# Writers
+######################################################################
+EXPORT_FIELDS = (
+    "id",
+    "user_id",
+    "product_id",
+    "recommendation_type",
+    "create_date",
+    "update_date",
+    "bought_in_last_30_days",
+    "rating",
+)
+
+
+def write_records(stream, fmt: str, records):
+    """
+    Writes serialized records to stream as they are produced
+
+    Yields the running count after every record so callers can
+    report progress without buffering the output.
+    """
+    if fmt == "csv":
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        write = writer.writerow
+    elif fmt == "ndjson":
+        def write(record):
+            stream.write(json.dumps(record))
+            stream.write("\n")
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+    for count, record in enumerate(records, start=1):
+        write(record)
+        yield count
@@ -1,8 +1,20 @@
 """
 Flask CLI Command Extensions
 """
+import gzip
+import io
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+import click
+from sqlalchemy.exc import IntegrityError
 from service import app
-from service.models import db
+from service.models import (
+    NATURAL_KEY_CONFLICT, DataConflictError, DataValidationError, Recommendation, RecommendationChange,
+    RecommendationType, db,
+)
+from service.common import assets, bulk_io, outbox
 
 
 ######################################################################
@@ -19,3 +31,326 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to bulk load recommendations from a file
+# Usage:
+#   flask import-recommendations data.csv --errors rejected.ndjson
+######################################################################
+@app.cli.command("import-recommendations")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(bulk_io.FORMATS), help="Defaults to the file extension")
+@click.option("--batch-size", default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option("--errors", "errors_path", type=click.Path(dir_okay=False, writable=True),
+              help="Write rejected records to this NDJSON file")
+def import_recommendations(path, fmt, batch_size, errors_path):
+    """
+    Streams recommendations from a CSV or NDJSON file into the database
+
+    Each batch is committed on its own so memory use stays constant
+    regardless of the size of the file.
+    """
+    try:
+        fmt = fmt or bulk_io.detect_format(path)
+    except ValueError as error:
+        raise click.UsageError(str(error)) from error
+
+    # pylint: disable=consider-using-with
+    errors_file = open(errors_path, "w", encoding="utf-8") if errors_path else None
+    imported = rejected = 0
+    started = time.monotonic()
+    try:
+        with bulk_io.open_text(path) as stream:
+            for chunk in bulk_io.chunked(bulk_io.read_records(stream, fmt), batch_size):
+                count, errors = _import_chunk(chunk, errors_file)
+                imported += count
+                rejected += errors
+                _report_rate(f"Rejected {rejected}, imported", imported, started)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    click.echo(f"Import complete: {imported} imported, {rejected} rejected")
+    if rejected:
+        sys.exit(1)
+
+
+######################################################################
+# Command to stream recommendations out of the database
+# Usage:
+#   flask export-recommendations --output recos.ndjson.gz --min-id 1 --max-id 500000
+######################################################################
+@app.cli.command("export-recommendations")
+@click.option("--output", "output_path", default="-", show_default=True,
+              type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(bulk_io.FORMATS), default="ndjson", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="gzip the output (implied by a .gz file name)")
+@click.option("--batch-size", default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option("--user-id", type=int, help="Only export this user's recommendations")
+@click.option("--type", "recommendation_type", type=click.Choice(RecommendationType._member_names_))
+@click.option("--min-id", type=int, help="Lowest id to export (inclusive), for sharded exports")
+@click.option("--max-id", type=int, help="Highest id to export (inclusive), for sharded exports")
+@click.option("--updated-since", type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="Only export rows updated on or after this date")
+def export_recommendations(output_path, fmt, compress, batch_size, **filters):  # pylint: disable=too-many-arguments
+    """
+    Streams recommendations to a CSV or NDJSON file
+
+    Rows are read through a server side cursor and written as they
+    arrive, so the export runs in constant memory.
+    """
+    if filters["recommendation_type"]:
+        filters["recommendation_type"] = RecommendationType[filters["recommendation_type"]]
+    if filters["updated_since"]:
+        filters["updated_since"] = filters["updated_since"].date()
+
+    exported = 0
+    started = time.monotonic()
+    with _open_output(output_path, compress) as stream:
+        records = (reco.serialize() for reco in Recommendation.stream(batch_size, **filters))
+        for exported in bulk_io.write_records(stream, fmt, records):
+            if exported % batch_size == 0:
+                _report_rate("Exported", exported, started)
+    db.session.rollback()
+    _report_rate("Export complete:", exported, started)
+
+
+######################################################################
+# Command to remove duplicate recommendations
+# Usage:
+#   flask dedupe-recommendations --batch-size 5000
+######################################################################
+@app.cli.command("dedupe-recommendations")
+@click.option("--batch-size", default=1000, show_default=True, type=click.IntRange(min=1))
+def dedupe_recommendations(batch_size):
+    """
+    Deletes recommendations duplicating the same user, product and type
+
+    The newest row of each group is kept. Duplicates are deleted in
+    short transactions, then the unique index is created if missing.
+    """
+    deleted = 0
+    started = time.monotonic()
+    while True:
+        count = Recommendation.delete_duplicates(batch_size)
+        db.session.commit()
+        if not count:
+            break
+        deleted += count
+        _report_rate("Deleted", deleted, started)
+    Recommendation.ensure_natural_key()
+    db.session.commit()
+    click.echo(f"Deduplication complete: {deleted} duplicates deleted")
+
+
+######################################################################
+# Command to fingerprint and precompress the static assets
+# Usage:
+#   flask build-assets
+######################################################################
+@app.cli.command("build-assets")
+def build_assets():
+    """
+    Builds the fingerprinted, precompressed static assets
+
+    The files are written to service/static/dist and served with
+    long-lived caching by the workers started afterwards.
+    """
+    manifest = assets.build(app.static_folder)
+    for path, hashed in sorted(manifest["files"].items()):
+        encodings = ", ".join(manifest["encodings"].get(hashed, [])) or "none"
+        click.echo(f"{path} -> {hashed} (precompressed: {encodings})")
+    click.echo(f"Build complete: {len(manifest['files'])} assets")
+
+
+######################################################################
+# Command to move cold recommendations to the archive table
+# Usage:
+#   flask archive-recommendations --older-than 365
+######################################################################
+@app.cli.command("archive-recommendations")
+@click.option("--older-than", required=True, type=click.IntRange(min=0),
+              help="Archive rows whose update_date is more than this many days ago")
+@click.option("--batch-size", default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option("--pause", default=0.0, show_default=True, type=click.FloatRange(min=0),
+              help="Seconds to sleep between batches to limit the load on the database")
+def archive_recommendations(older_than, batch_size, pause):
+    """
+    Moves recommendations past the retention window to the archive table
+
+    Each batch is moved and committed in its own short transaction.
+    """
+    cutoff = date.today() - timedelta(days=older_than)
+    archived = 0
+    started = time.monotonic()
+    while True:
+        count = Recommendation.archive(cutoff, batch_size)
+        db.session.commit()
+        if not count:
+            break
+        archived += count
+        _report_rate("Archived", archived, started)
+        time.sleep(pause)
+    click.echo(f"Archive complete: {archived} recommendations updated before {cutoff} archived")
+
+
+######################################################################
+# Command to delete old entries of the change feed
+# Usage:
+#   flask prune-changes --older-than 7
+######################################################################
+@app.cli.command("prune-changes")
+@click.option("--older-than", type=click.IntRange(min=0),
+              help="Delete entries appended more than this many days ago [default: CHANGE_FEED_RETENTION]")
+@click.option("--batch-size", default=1000, show_default=True, type=click.IntRange(min=1))
+def prune_changes(older_than, batch_size):
+    """
+    Deletes the change feed entries past the retention window
+
+    Consumers whose cursor is older than the entries kept get 410 Gone
+    and read everything again.
+    """
+    days = app.config["CHANGE_FEED_RETENTION"] if older_than is None else older_than
+    cutoff = time.time() - days * 86400
+    pruned = 0
+    while True:
+        count = RecommendationChange.prune(cutoff, batch_size)
+        db.session.commit()
+        if not count:
+            break
+        pruned += count
+    click.echo(f"Prune complete: {pruned} change feed entries older than {days} days deleted")
+
+
+######################################################################
+# Command to publish the events of the outbox
+# Usage:
+#   flask dispatch-events --sink file:///var/lib/events.ndjson
+######################################################################
+@app.cli.command("dispatch-events")
+@click.option("--sink", "sink_url", help="file:// or http(s):// URL of the sink [default: OUTBOX_SINK]")
+@click.option("--batch-size", type=click.IntRange(min=1), help="[default: OUTBOX_BATCH_SIZE]")
+@click.option("--poll-interval", default=1.0, show_default=True, type=click.FloatRange(min=0),
+              help="Seconds to wait when the outbox is empty")
+@click.option("--once", is_flag=True, help="Exit once the outbox is empty instead of waiting for events")
+def dispatch_events(sink_url, batch_size, poll_interval, once):
+    """
+    Publishes the events of the outbox to a sink
+
+    Each batch is deleted once the sink accepted it, so every event is
+    delivered at least once. Failed batches are retried with a growing
+    delay. Several dispatchers may run on PostgreSQL.
+    """
+    try:
+        sink = outbox.make_sink(sink_url or app.config["OUTBOX_SINK"])
+    except ValueError as error:
+        raise click.UsageError(str(error)) from error
+    dispatcher = outbox.Dispatcher(sink, batch_size or app.config["OUTBOX_BATCH_SIZE"])
+    dispatched = 0
+    started = time.monotonic()
+    delay = 0.0
+    try:
+        while True:
+            count, delay = _dispatch_batch(dispatcher, delay, once)
+            if count is None:
+                continue
+            dispatched += count
+            if count:
+                elapsed = time.monotonic() - started
+                click.echo(f"Dispatched {dispatched} events ({dispatched / elapsed if elapsed else 0:.0f} events/s)", err=True)
+            elif once:
+                break
+            else:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+    click.echo(f"Dispatch complete: {dispatched} events")
+
+
+@contextmanager
+def _open_output(path, compress):
+    """Opens the export destination, which may be stdout"""
+    if path == "-":
+        stdout = sys.stdout.buffer if hasattr(sys.stdout, "buffer") else None
+        if compress and stdout is not None:
+            with gzip.GzipFile(fileobj=stdout, mode="wb") as raw:
+                with io.TextIOWrapper(raw, encoding="utf-8", newline="") as stream:
+                    yield stream
+        else:
+            yield click.get_text_stream("stdout")
+            sys.stdout.flush()
+    else:
+        with bulk_io.open_text(path, "wt", compress=compress) as stream:
+            yield stream
+
+
+def _dispatch_batch(dispatcher, delay, once):
+    """
+    Dispatches one batch, returning its size and the retry delay
+
+    After a failure the size is None, once the delay, doubled up to a
+    minute, has passed. With once the failure is raised instead.
+    """
+    try:
+        return dispatcher.dispatch_batch(), 0.0
+    except Exception as error:  # pylint: disable=broad-except
+        if once:
+            raise click.ClickException(f"Dispatch failed: {error}") from error
+        delay = min(max(delay * 2, 1.0), 60.0)
+        click.echo(f"Dispatch failed, retrying in {delay:.0f}s: {error}", err=True)
+        time.sleep(delay)
+        return None, delay
+
+
+def _report_rate(prefix, count, started):
+    """Prints the number of rows handled and the throughput to stderr"""
+    elapsed = time.monotonic() - started
+    click.echo(f"{prefix} {count} recommendations ({count / elapsed if elapsed else 0:.0f} rows/s)", err=True)
+
+
+def _import_chunk(chunk, errors_file):
+    """Validates and inserts one chunk, returning the imported and rejected counts"""
+    valid = []
+    rejected = 0
+    for line_number, raw, data in chunk:
+        try:
+            if isinstance(data, DataValidationError):
+                raise data
+            valid.append((line_number, raw, bulk_io.validate_record(data, keep_dates=True)))
+        except DataValidationError as error:
+            rejected += 1
+            _reject(errors_file, line_number, raw, error)
+    # rows whose natural key is stored, or earlier in the chunk, are rejected
+    taken = Recommendation.stored_natural_keys([row for _, _, row in valid])
+    rows = []
+    for line_number, raw, row in valid:
+        key = tuple(row[name] for name in Recommendation.NATURAL_KEY)
+        if key in taken:
+            rejected += 1
+            _reject(errors_file, line_number, raw, DataConflictError(NATURAL_KEY_CONFLICT))
+            continue
+        taken.add(key)
+        rows.append(row)
+    Recommendation.bulk_create(rows)
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        raise click.ClickException(
+            "Recommendations were written while importing, run the import again to reject their duplicates"
+        ) from error
+    return len(rows), rejected
+
+
+def _reject(errors_file, line_number, raw, error):
+    """Reports a record that was not imported"""
+    if errors_file:
+        errors_file.write(bulk_io.error_line(line_number, raw, error))
+    else:
+        click.echo(f"line {line_number}: {error}", err=True)
@@ -0,0 +1,108 @@
+"""
+Response Compression
+
+This module compresses responses with the best encoding the client
+accepts (brotli when the brotli package is installed, gzip or deflate).
+Responses smaller than COMPRESSION_MIN_SIZE bytes are sent as they are,
+streamed responses are compressed chunk by chunk, and routes decorated
+with no_compression are never compressed.
+"""
+import zlib
+from flask import request
+from service.common import status
+from service.common.tracing import span
+from service.common.views import view_attribute
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/",
+    "image/svg+xml",
+)
+
+
+def no_compression(func):
+    """Marks a view function, or a Resource method, as never compressed"""
+    func.no_compression = True
+    return func
+
+
+def available_encodings():
+    """The encodings this process can produce, most preferred first"""
+    encodings = ["gzip", "deflate"]
+    if brotli is not None:
+        encodings.insert(0, "br")
+    return encodings
+
+
+def _compressor(encoding: str, level: int):
+    """Returns (compress, flush) functions for encoding"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(level, 11))
+        return compressor.process, compressor.finish
+    # wbits 31 writes a gzip header, 15 a zlib header as HTTP deflate expects
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+    return compressor.compress, compressor.flush
+
+
+def _stream(chunks, compress, flush, charset="utf-8"):
+    """Compresses an iterable of bytes or str chunks as it is consumed"""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compress(chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def _should_compress(app, response) -> bool:
+    if response.status_code != status.HTTP_200_OK or "Content-Encoding" in response.headers:
+        return False
+    if not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+        return False
+    if not response.is_streamed and not response.direct_passthrough:
+        if (response.content_length or 0) < app.config["COMPRESSION_MIN_SIZE"]:
+            return False
+    return not view_attribute(app, "no_compression", False)
+
+
+def init_app(app):
+    """Registers the compression hook on app"""
+
+    @app.after_request
+    def compress_response(response):  # pylint: disable=unused-variable
+        if not app.config["COMPRESSION_ENABLED"] or not _should_compress(app, response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+
+        compress, flush = _compressor(encoding, app.config["COMPRESSION_LEVEL"])
+        if response.is_streamed or response.direct_passthrough:
+            charset = response.mimetype_params.get("charset", "utf-8")
+            response.response = _stream(response.response, compress, flush, charset)
+            response.direct_passthrough = False
+            response.headers.pop("Content-Length", None)
+        else:
+            with span("compress"):
+                response.set_data(compress(response.get_data()) + flush())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # the compressed body is no longer byte-identical to the original
+            response.set_etag(etag, weak=True)
+        return response
+
+    return compress_response
@@ -0,0 +1,74 @@
+"""
+Total Counts
+
+This module counts the Recommendations matching a list query without
+loading them, for the X-Total-Count header.
+
+The Recommendations of one user are counted exactly, from the natural
+key index. The whole table is estimated from the PostgreSQL planner
+statistics once it holds at least COUNT_ESTIMATE_THRESHOLD rows, and is
+otherwise counted exactly and cached for COUNT_CACHE_TTL seconds. Local
+writes drop the cached count at once.
+"""
+import threading
+import time
+from service.common.metrics import metrics
+from service.models import CHANGE_LISTENERS, Recommendation
+
+
+class CountCache:
+    """
+    Counts the Recommendations, caching the count of the whole table
+
+    Args:
+        ttl (float): seconds a count of the whole table is reused
+        estimate_threshold (int): smallest estimate returned as it is
+    """
+
+    def __init__(self, ttl=10.0, estimate_threshold=100000):
+        self.ttl = ttl
+        self.estimate_threshold = estimate_threshold
+        self._lock = threading.Lock()
+        self._total = None
+        self._expires = 0.0
+        # bumped by every write, a count started before one is not kept
+        self._generation = 0
+
+    def count(self, user_id=None, exact=False):
+        """Returns (count, estimated) for the list of user_id, or of everyone"""
+        if user_id is not None:
+            return Recommendation.count(user_id), False
+        if not exact:
+            estimate = Recommendation.estimated_count()
+            if estimate is not None and estimate >= self.estimate_threshold:
+                metrics.increment("total_count_estimates")
+                return estimate, True
+        with self._lock:
+            if self._total is not None and time.monotonic() < self._expires:
+                metrics.increment("total_count_hits")
+                return self._total, False
+            generation = self._generation
+        total = Recommendation.count()
+        metrics.increment("total_count_misses")
+        with self._lock:
+            if generation == self._generation:
+                self._total = total
+                self._expires = time.monotonic() + self.ttl
+        return total, False
+
+    def on_change(self, _changes):
+        """Drops the cached count after a committed write"""
+        with self._lock:
+            self._total = None
+            self._generation += 1
+
+
+def init_app(app):
+    """Creates the count cache of app"""
+    cache = app.extensions.pop("count_cache", None)
+    if cache is not None:
+        CHANGE_LISTENERS.remove(cache.on_change)
+    cache = CountCache(ttl=app.config["COUNT_CACHE_TTL"], estimate_threshold=app.config["COUNT_ESTIMATE_THRESHOLD"])
+    CHANGE_LISTENERS.append(cache.on_change)
+    app.extensions["count_cache"] = cache
+    return cache
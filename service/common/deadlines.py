@@ -0,0 +1,129 @@
+"""
+Request Deadlines
+
+This module gives every request a deadline, REQUEST_TIMEOUT seconds
+from its start or the X-Request-Timeout header sent by the client
+(capped at REQUEST_TIMEOUT_MAX), and stops its database work once the
+deadline has passed so the worker is freed for other requests.
+
+On PostgreSQL each transaction starts with SET LOCAL statement_timeout
+set to the time left. On SQLite a progress handler interrupts the
+running statement. A statement is never started after the deadline,
+and the request ends with 504 Gateway Timeout.
+"""
+import math
+import sqlite3
+import time
+from contextvars import ContextVar
+from flask import abort, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from werkzeug.exceptions import GatewayTimeout
+from service.common import status
+from service.common.metrics import metrics
+from service.models import RoutingSession
+
+# time.monotonic() value after which the current request is abandoned
+_deadline = ContextVar("deadline", default=None)
+
+# SQLite virtual machine instructions between two deadline checks
+SQLITE_CHECK_INTERVAL = 1000
+# the code of PostgreSQL query_canceled errors
+QUERY_CANCELED = "57014"
+
+
+class DeadlineExceeded(GatewayTimeout):
+    """Used when a request runs past its deadline"""
+
+    description = "The request did not complete within its deadline."
+    # requests coalesced with this one have deadlines of their own
+    per_request = True
+
+
+def remaining():
+    """Returns the seconds left before the deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check():
+    """Raises DeadlineExceeded when the deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.increment("deadlines_exceeded")
+        raise DeadlineExceeded()
+
+
+def parse_timeout(value, default: float, maximum: float):
+    """Returns the timeout in seconds requested by an X-Request-Timeout value"""
+    if value is None:
+        return default or None
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = 0
+    if not (timeout > 0 and math.isfinite(timeout)):
+        abort(status.HTTP_400_BAD_REQUEST, "X-Request-Timeout must be a positive number of seconds.")
+    return min(timeout, maximum) if maximum else timeout
+
+
+######################################################################
+# Database hooks
+######################################################################
+@event.listens_for(RoutingSession, "after_begin")
+def _limit_transaction(_session, _transaction, connection):
+    """Bounds the statements of a PostgreSQL transaction by the time left"""
+    left = remaining()
+    if left is None or connection.dialect.name != "postgresql":
+        return
+    check()
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(left * 1000), 1)}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_statement(*_args):
+    """Never starts a statement after the deadline"""
+    check()
+
+
+@event.listens_for(Pool, "connect")
+def _install_progress_handler(dbapi_connection, _record):
+    """Lets SQLite interrupt a statement running past the deadline"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.set_progress_handler(_sqlite_progress, SQLITE_CHECK_INTERVAL)
+
+
+def _sqlite_progress():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+@event.listens_for(Engine, "handle_error")
+def _timeout_error(context):
+    """Turns statements canceled for the deadline into DeadlineExceeded"""
+    left = remaining()
+    if left is None:
+        return
+    canceled = getattr(context.original_exception, "pgcode", None) == QUERY_CANCELED
+    if canceled or left <= 0:
+        metrics.increment("deadlines_exceeded")
+        raise DeadlineExceeded() from context.original_exception
+
+
+def init_app(app):
+    """Starts the deadline of every request"""
+
+    @app.before_request
+    def start_deadline():  # pylint: disable=unused-variable
+        timeout = parse_timeout(
+            request.headers.get("X-Request-Timeout"),
+            app.config["REQUEST_TIMEOUT"],
+            app.config["REQUEST_TIMEOUT_MAX"],
+        )
+        if timeout:
+            _deadline.set(time.monotonic() + timeout)
+
+    @app.teardown_request
+    def end_deadline(_error):  # pylint: disable=unused-variable
+        _deadline.set(None)
@@ -18,8 +18,8 @@
 Module: error_handlers
 """
 from flask import jsonify
-from service.models import DataValidationError
-from service import app
+from service.models import DataValidationError, DataConflictError
+from service import app, api
 from . import status
 
 
@@ -28,8 +28,40 @@ from . import status
 ######################################################################
 @app.errorhandler(DataValidationError)
 def request_validation_error(error):
-    """Handles Value Errors from bad data"""
-    return bad_request(error)
+    """Handles Value Errors from bad data, listing every invalid field"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_400_BAD_REQUEST,
+            error="Bad Request",
+            message=message,
+            errors=error.errors,
+        ),
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+@app.errorhandler(DataConflictError)
+def request_conflict_error(error):
+    """Handles writes that would duplicate an existing recommendation"""
+    return resource_conflict(error)
+
+
+# flask-restx hands the exceptions of its Resources to the app handlers
+# only when PROPAGATE_EXCEPTIONS is set, so they are registered on the api
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors raised by the API resources"""
+    response, code = request_validation_error(error)
+    return response.get_json(), code
+
+
+@api.errorhandler(DataConflictError)
+def api_conflict_error(error):
+    """Handles duplicate writes raised by the API resources"""
+    response, code = request_conflict_error(error)
+    return response.get_json(), code
 
 
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
@@ -71,19 +103,72 @@ def method_not_supported(error):
     )
 
 
-# @app.errorhandler(status.HTTP_409_CONFLICT)
-# def resource_conflict(error):
-#     """Handles resource conflicts with HTTP_409_CONFLICT"""
-#     message = str(error)
-#     app.logger.warning(message)
-#     return (
-#         jsonify(
-#             status=status.HTTP_409_CONFLICT,
-#             error="Conflict",
-#             message=message,
-#         ),
-#         status.HTTP_409_CONFLICT,
-#     )
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def resource_conflict(error):
+    """Handles resource conflicts with HTTP_409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_409_CONFLICT,
+            error="Conflict",
+            message=message,
+        ),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+@app.errorhandler(status.HTTP_429_TOO_MANY_REQUESTS)
+def too_many_requests(error):
+    """Handles throttled clients with 429_TOO_MANY_REQUESTS"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            error="Too Many Requests",
+            message=message,
+        ),
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        _retry_after(error),
+    )
+
+
+@app.errorhandler(status.HTTP_503_SERVICE_UNAVAILABLE)
+def service_unavailable(error):
+    """Handles shed requests with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            error="Service Unavailable",
+            message=message,
+        ),
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        _retry_after(error),
+    )
+
+
+@app.errorhandler(status.HTTP_504_GATEWAY_TIMEOUT)
+def gateway_timeout(error):
+    """Handles requests past their deadline with 504_GATEWAY_TIMEOUT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_504_GATEWAY_TIMEOUT,
+            error="Gateway Timeout",
+            message=message,
+        ),
+        status.HTTP_504_GATEWAY_TIMEOUT,
+    )
+
+
+def _retry_after(error) -> dict:
+    """The Retry-After header of an error that suggests one"""
+    retry_after = getattr(error, "retry_after", None)
+    return {"Retry-After": str(retry_after)} if retry_after is not None else {}
 
 
 # @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
@@ -0,0 +1,226 @@
+"""
+Cache Invalidation Bus
+
+This module tells the other workers and pods which recommendations were
+written so they can evict them from their shared list cache and their
+rankings. The changes of every
+transaction are published with PostgreSQL NOTIFY on the connection that
+wrote them, just before it commits, so a message is delivered if and
+only if the transaction committed. Every
+worker runs a listener thread that LISTENs and invalidates the users it
+receives. On databases without LISTEN/NOTIFY (SQLite in the tests) the
+messages are inserted into the cache_invalidation table within the same
+transaction, and the listeners poll it instead.
+
+A worker ignores its own messages, and the list cache ignores the
+messages of its own pod: they were already invalidated when the
+transaction committed. The rankings are cached by each worker, so they
+apply the messages of the other workers of the pod too. A listener that
+loses its connection clears the caches once it reconnects, since it may
+have missed messages.
+"""
+import atexit
+import json
+import os
+import select
+import socket
+import threading
+import time
+import sqlalchemy as sa
+from sqlalchemy.pool import NullPool
+from service.common.metrics import metrics
+from service.models import COMMIT_LISTENERS, CacheInvalidation, ChangeSet, db
+
+CHANNEL = "recommendation_changes"
+# ids per message, keeping NOTIFY payloads under their 8000 byte limit
+CHUNK_SIZE = 300
+
+
+def encode(origin: str, changes, pid=None) -> list:
+    """Returns the JSON messages describing a models.ChangeSet written by process pid"""
+    if changes.everything:
+        return [json.dumps({"origin": origin, "pid": pid, "all": True})]
+    ids = sorted(changes.ids)
+    user_ids = sorted(changes.user_ids)
+    return [
+        json.dumps(
+            {
+                "origin": origin,
+                "pid": pid,
+                "ids": ids[start:start + CHUNK_SIZE],
+                "user_ids": user_ids[start:start + CHUNK_SIZE],
+            }
+        )
+        for start in range(0, max(len(ids), len(user_ids), 1), CHUNK_SIZE)
+    ]
+
+
+def decode(message: dict):
+    """Returns the models.ChangeSet of the users described by a message"""
+    changes = ChangeSet()
+    changes.user_ids.update(message.get("user_ids") or ())
+    changes.everything = bool(message.get("all"))
+    return changes
+
+
+class InvalidationBus:
+    """
+    Publishes committed changes and applies the ones of other workers
+
+    Args:
+        app (Flask): the application holding the list cache
+        engine (Engine): the primary database
+        origin (str): the name of this pod
+        poll_interval (float): seconds between two polls of the table,
+            or between two checks of the stop flag when listening
+        retention (float): seconds the table keeps a message
+    """
+
+    def __init__(self, app, engine, origin: str, poll_interval=1.0, retention=300.0):
+        self.app = app
+        self.engine = engine
+        self.origin = origin
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.notify = engine.dialect.name == "postgresql"
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def publish(self, changes, connection):
+        """Sends the changes of a committing transaction on its connection"""
+        messages = encode(self.origin, changes, os.getpid())
+        if self.notify:
+            for message in messages:
+                connection.execute(sa.select(sa.func.pg_notify(CHANNEL, message)))
+        else:
+            now = time.time()
+            connection.execute(
+                sa.insert(CacheInvalidation.__table__),
+                [{"created_at": now, "payload": message} for message in messages],
+            )
+        metrics.increment("invalidations_published", len(messages))
+
+    def receive(self, payload: str):
+        """Applies one message to the shared list cache and the rankings"""
+        message = json.loads(payload)
+        same_pod = message.get("origin") == self.origin
+        if same_pod and message.get("pid") == os.getpid():
+            return
+        self._apply(decode(message), list_cache=not same_pod)
+        metrics.increment("invalidations_received")
+
+    def _missed(self):
+        """Clears the caches after messages may have been lost"""
+        changes = ChangeSet()
+        changes.everything = True
+        self._apply(changes)
+
+    def _apply(self, changes, list_cache=True):
+        """Evicts the users of a models.ChangeSet"""
+        cache = self.app.extensions.get("list_cache") if list_cache else None
+        if cache is not None:
+            if changes.everything:
+                cache.clear()
+            elif changes.user_ids:
+                cache.invalidate(sorted(changes.user_ids))
+        rankings = self.app.extensions.get("ranking_cache")
+        if rankings is not None:
+            rankings.on_change(changes)
+
+    ######################################################################
+    # Listener thread
+    ######################################################################
+    def start(self):
+        """Starts the listener thread"""
+        if self._thread:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the listener thread"""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval * 2 + 1)
+            self._thread = None
+
+    def _run(self):
+        missed = False
+        while not self._stopped.is_set():
+            try:
+                if missed:
+                    self._missed()
+                    missed = False
+                if self.notify:
+                    self._listen()
+                else:
+                    self._poll()
+            except Exception:  # pylint: disable=broad-except
+                self.app.logger.exception("Cache invalidation listener failed, retrying")
+                metrics.increment("invalidation_listener_errors")
+                missed = True
+                self._stopped.wait(self.poll_interval)
+
+    def _listen(self):
+        """Receives NOTIFY messages on a dedicated connection"""
+        engine = sa.create_engine(self.engine.url, poolclass=NullPool)
+        connection = engine.raw_connection()
+        try:
+            driver = connection.dbapi_connection
+            driver.autocommit = True
+            with driver.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while not self._stopped.is_set():
+                if select.select([driver], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                driver.poll()
+                while driver.notifies:
+                    self.receive(driver.notifies.pop(0).payload)
+        finally:
+            connection.close()
+            engine.dispose()
+
+    def _poll(self):
+        """Reads the messages added to the cache_invalidation table"""
+        table = CacheInvalidation.__table__
+        with self.engine.connect() as connection:
+            last_id = connection.execute(sa.select(sa.func.max(table.c.id))).scalar() or 0
+        pruned = time.monotonic()
+        while not self._stopped.wait(self.poll_interval):
+            with self.engine.begin() as connection:
+                rows = connection.execute(
+                    sa.select(table.c.id, table.c.payload).where(table.c.id > last_id).order_by(table.c.id)
+                ).all()
+                for row in rows:
+                    self.receive(row.payload)
+                    last_id = row.id
+                if time.monotonic() - pruned > self.retention / 10:
+                    connection.execute(sa.delete(table).where(table.c.created_at < time.time() - self.retention))
+                    pruned = time.monotonic()
+
+
+def init_app(app, start: bool = True):
+    """Starts the invalidation bus when there is a list cache or a ranking cache"""
+    bus = app.extensions.pop("invalidation_bus", None)
+    if bus is not None:
+        COMMIT_LISTENERS.remove(bus.publish)
+        bus.stop()
+    caches = {"list_cache", "ranking_cache"} & set(app.extensions)
+    if not caches or not app.config.get("INVALIDATION_BUS"):
+        return None
+    with app.app_context():
+        engine = db.engine
+    bus = InvalidationBus(
+        app,
+        engine,
+        app.config.get("INVALIDATION_ORIGIN") or socket.gethostname(),
+        poll_interval=app.config["INVALIDATION_POLL_INTERVAL"],
+    )
+    COMMIT_LISTENERS.append(bus.publish)
+    if start:
+        bus.start()
+    app.extensions["invalidation_bus"] = bus
+    app.logger.info("Cache invalidation bus started (%s)", "LISTEN/NOTIFY" if bus.notify else "polling")
+    return bus
@@ -0,0 +1,62 @@
+"""
+Worker Lifecycle
+
+The background threads of a worker (the log QueueListener, the cache
+invalidation listener, the rating write-behind flusher and the warm-up)
+are not started when the service is imported, so the flask CLI and the
+image build run without them. gunicorn starts them in every worker once
+it loaded the application, from post_worker_init in gunicorn.conf.py;
+other servers, like flask run, start them on their first request.
+"""
+import threading
+from service.common import log_handlers
+
+# extensions holding an object with a start() method
+BACKGROUND_EXTENSIONS = ("invalidation_bus", "rating_buffer", "warmup")
+
+
+class BackgroundThreads:
+    """
+    Starts the background threads of a worker, once
+
+    Args:
+        app (Flask): the application owning the threads
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.started = False
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Starts the threads unless they were started, returns whether it did"""
+        if self.started:
+            return False
+        with self._lock:
+            if self.started:
+                return False
+            log_handlers.start_listener(self.app)
+            for name in BACKGROUND_EXTENSIONS:
+                extension = self.app.extensions.get(name)
+                if extension is not None:
+                    extension.start()
+            self.started = True
+        self.app.logger.info("Background threads started")
+        return True
+
+
+def start(app) -> bool:
+    """Starts the background threads of app, called by gunicorn"""
+    return app.extensions["background_threads"].start()
+
+
+def init_app(app):
+    """Starts the background threads on the first request unless gunicorn did"""
+    if "background_threads" not in app.extensions:
+
+        @app.before_request
+        def start_background_threads():  # pylint: disable=unused-variable
+            app.extensions["background_threads"].start()
+
+    app.extensions["background_threads"] = BackgroundThreads(app)
+    return app.extensions["background_threads"]
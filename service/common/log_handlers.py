@@ -19,18 +19,165 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+Records are written as text or as one JSON object per line
+(LOG_FORMAT=json). With LOG_ASYNC the request threads only put records
+on a bounded queue; a QueueListener thread formats them and writes them
+to the gunicorn handlers, and records arriving while the queue is full
+are dropped and counted. The INFO and DEBUG records of a request are
+kept for LOG_REQUEST_SAMPLE_RATE of the requests, all or none of them.
+LOG_SAMPLE_RATES keeps only a fraction of the records of the chatty
+levels, e.g. "DEBUG=0.01,INFO=0.5"; warnings and errors are always kept.
 """
+import atexit
+import copy
+import json
 import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
+from service.common.metrics import metrics
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# attributes of every LogRecord, the others were passed with extra=
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (name, value) for name, value in record.__dict__.items() if name not in RECORD_ATTRIBUTES
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the records of a random fraction of the requests, and a random
+    fraction of the records of each sampled level
+    """
+
+    def __init__(self, rates: dict, request_rate: float = 1.0):
+        super().__init__()
+        self.rates = rates
+        self.request_rate = request_rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.request_rate < 1 and has_request_context():
+            # kept in the WSGI environ, g can outlive a request
+            sampled = request.environ.get("service.log_sampled")
+            if sampled is None:
+                sampled = request.environ["service.log_sampled"] = random.random() < self.request_rate
+            if not sampled:
+                metrics.increment("log_records_sampled_out")
+                return False
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        metrics.increment("log_records_sampled_out")
+        return False
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Puts records on a bounded queue without ever blocking the caller"""
+
+    def prepare(self, record):
+        # merge the arguments now, they may change before the listener runs,
+        # but leave the formatting to the handlers behind the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+
+
+def parse_sample_rates(value: str) -> dict:
+    """Returns {level number: rate} for a "LEVEL=rate,..." setting"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, rate = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int) or level >= logging.WARNING:
+            raise ValueError(f"Cannot sample the {name} log level")
+        rates[level] = float(rate)
+    return rates
+
+
+def stop_logging(app):
+    """Writes the queued records and stops the listener thread"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        atexit.unregister(listener.stop)
+        listener.stop()
+
+
+def start_listener(app):
+    """Hands the records of app to a QueueListener thread when LOG_ASYNC is set"""
+    handlers = app.logger.handlers
+    if not app.config.get("LOG_ASYNC") or not handlers or "log_listener" in app.extensions:
+        return None
+    queue_handler = AsyncQueueHandler(queue.Queue(app.config["LOG_QUEUE_SIZE"]))
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    app.extensions["log_listener"] = listener
+    app.logger.handlers = [queue_handler]
+    return listener
+
 
+def init_logging(app, logger_name: str, start: bool = True):
+    """
+    Set up logging for production
 
-def init_logging(app, logger_name: str):
-    """Set up logging for production"""
+    Without start the records are written synchronously until
+    start_listener is called.
+    """
+    stop_logging(app)
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+    for old in [item for item in app.logger.filters if isinstance(item, SamplingFilter)]:
+        app.logger.removeFilter(old)
+    rates = parse_sample_rates(app.config.get("LOG_SAMPLE_RATES"))
+    request_rate = app.config.get("LOG_REQUEST_SAMPLE_RATE", 1.0)
+    if rates or request_rate < 1:
+        app.logger.addFilter(SamplingFilter(rates, request_rate))
+    app.logger.handlers = handlers
+    if start:
+        start_listener(app)
     app.logger.info("Logging handler established")
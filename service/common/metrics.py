@@ -0,0 +1,56 @@
+"""
+Metrics
+
+This module keeps simple in-process counters, gauges and timers that
+are exposed as JSON on the /metrics endpoint. Values are per worker
+process.
+"""
+import threading
+
+
+class Metrics:
+    """A thread safe registry of named counters, gauges and timers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}
+
+    def increment(self, name: str, value: int = 1):
+        """Adds value to the counter called name"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value):
+        """Sets the gauge called name to its current value"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        """Records one duration for the timer called name"""
+        with self._lock:
+            timer = self._timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+            timer["last"] = seconds
+
+    def snapshot(self) -> dict:
+        """Returns a copy of every metric"""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timers": {name: dict(timer) for name, timer in self._timers.items()},
+            }
+
+    def reset(self):
+        """Clears every metric"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,127 @@
+"""
+Event Outbox
+
+Writes to Recommendations store their events in the outbox table in the
+same transaction (see OutboxEvent), so no request waits on a downstream
+system. The Dispatcher publishes them: it claims the oldest events in
+batches, sends each batch to a sink and deletes it once the sink
+accepted it. Events are delivered at least once: a batch sent by a
+dispatcher that dies before its deletion commits is sent again, so
+consumers dedupe on event_id.
+
+The sink is chosen by the scheme of its URL:
+    file:///var/lib/events.ndjson  appends JSON lines to a file
+    http://host/path               POSTs each batch as a JSON array
+Other sinks are registered in SINKS.
+"""
+import json
+import os
+import time
+import urllib.request
+from urllib.parse import urlparse
+from service.common.metrics import metrics
+from service.models import OutboxEvent, db
+
+
+class FileSink:
+    """
+    Appends the events to a file, one JSON document per line
+
+    Args:
+        url (str): a file:// URL
+    """
+
+    def __init__(self, url: str):
+        self.path = urlparse(url).path
+        # pylint: disable=consider-using-with
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def send(self, events: list):
+        """Writes the events, returning once they are on disk"""
+        self._file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Closes the file"""
+        self._file.close()
+
+
+class HttpSink:
+    """
+    POSTs the events to an HTTP endpoint as one JSON array per batch
+
+    Any response but a 2xx fails the batch, which is sent again.
+
+    Args:
+        url (str): the http:// or https:// URL of the endpoint
+        timeout (float): seconds to wait for the endpoint
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events: list):
+        """Sends the events, raising unless the endpoint accepted them"""
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(events, separators=(",", ":")).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        # HTTPError is raised for 4xx and 5xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def close(self):
+        """Nothing to release"""
+
+
+# Sink classes by URL scheme
+SINKS = {"file": FileSink, "http": HttpSink, "https": HttpSink}
+
+
+def make_sink(url: str):
+    """Returns the sink of url"""
+    if not url:
+        raise ValueError("No sink configured, set OUTBOX_SINK or pass --sink")
+    scheme = urlparse(url).scheme
+    if scheme not in SINKS:
+        raise ValueError(f"Unknown sink {url!r}, expected one of: {', '.join(f'{name}://' for name in SINKS)}")
+    return SINKS[scheme](url)
+
+
+class Dispatcher:  # pylint: disable=too-few-public-methods
+    """
+    Sends the events of the outbox to a sink in batches
+
+    Args:
+        sink: an object whose send(events) raises when delivery failed
+        batch_size (int): largest number of events sent at once
+    """
+
+    def __init__(self, sink, batch_size: int = 500):
+        self.sink = sink
+        self.batch_size = batch_size
+
+    def dispatch_batch(self) -> int:
+        """Sends and deletes the oldest batch, returning its size"""
+        events = OutboxEvent.claim(self.batch_size)
+        if not events:
+            db.session.rollback()
+            metrics.gauge("outbox_lag_seconds", 0.0)
+            return 0
+        metrics.gauge("outbox_lag_seconds", time.time() - events[0].created_at)
+        started = time.monotonic()
+        try:
+            self.sink.send([event.to_dict() for event in events])
+        except Exception:
+            db.session.rollback()
+            metrics.increment("outbox_send_failures")
+            raise
+        OutboxEvent.remove(event.id for event in events)
+        db.session.commit()
+        metrics.observe("outbox_batch", time.monotonic() - started)
+        metrics.increment("outbox_events_dispatched", len(events))
+        return len(events)
@@ -0,0 +1,100 @@
+"""
+Read Replicas
+
+This module routes read-only request handlers to the replica databases
+listed in DATABASE_READ_URI. Replicas are used round-robin; a replica
+that fails is skipped for REPLICA_RETRY_SECONDS and the request is
+retried on the primary database. Code that must not read stale rows,
+like filling a cache, runs in a primary() block.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import sqlalchemy as sa
+from flask import current_app
+from service.common.metrics import metrics
+from service.models import db
+
+
+class ReplicaRouter:
+    """Hands out replica engines round-robin, skipping failed ones"""
+
+    def __init__(self, uris, retry_seconds: float = 30.0):
+        self.engines = [sa.create_engine(uri, pool_pre_ping=True) for uri in uris]
+        self.retry_seconds = retry_seconds
+        self._down_until = [0.0] * len(self.engines)
+        self._order = itertools.cycle(range(len(self.engines)))
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Returns the next healthy replica engine, or None to use the primary"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.engines)):
+                position = next(self._order)
+                if self._down_until[position] <= now:
+                    return self.engines[position]
+        return None
+
+    def mark_down(self, engine):
+        """Stops using engine for retry_seconds"""
+        with self._lock:
+            self._down_until[self.engines.index(engine)] = time.monotonic() + self.retry_seconds
+        engine.dispose()
+
+
+def init_app(app):
+    """Creates the replica router when DATABASE_READ_URI is configured"""
+    uris = app.config.get("DATABASE_READ_URIS")
+    if not uris:
+        app.extensions.pop("replicas", None)
+        return None
+    router = ReplicaRouter(uris, app.config["REPLICA_RETRY_SECONDS"])
+    app.extensions["replicas"] = router
+    app.logger.info("Routing reads to %d replicas", len(uris))
+    return router
+
+
+@contextmanager
+def primary():
+    """Sends the statements of the block to the primary database"""
+    info = db.session.info
+    replica = info.pop("replica", None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            info["replica"] = replica
+
+
+def read_only(func):
+    """Runs a request handler against a replica when one is available"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        router = current_app.extensions.get("replicas")
+        replica = router.choose() if router else None
+        if replica is None:
+            return func(*args, **kwargs)
+        info = db.session.info
+        info.update(replica=replica, wrote=False)
+        metrics.increment("replica_reads")
+        try:
+            return func(*args, **kwargs)
+        except sa.exc.OperationalError:
+            if info.get("wrote"):
+                raise
+            current_app.logger.warning("Replica unavailable, falling back to the primary")
+            metrics.increment("replica_fallbacks")
+            router.mark_down(replica)
+            db.session.rollback()
+            info.pop("replica", None)
+            return func(*args, **kwargs)
+        finally:
+            info.pop("replica", None)
+            info.pop("wrote", None)
+
+    wrapper.read_only = True
+    return wrapper
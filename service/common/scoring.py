@@ -0,0 +1,245 @@
+"""
+Scoring
+
+This module ranks the recommendations of a user by business rules, for
+GET /recommendations/ranked. The list of the user is loaded once and
+held as columnar NumPy arrays, every scorer is evaluated over the whole
+array at once and the score of a recommendation is the weighted sum of
+the scores of the pipeline, set by SCORING_PIPELINE as "name:weight,...":
+
+    rating     the rating, scaled to 0..1
+    recency    1 on the day of the last update, halved every
+               SCORING_RECENCY_HALF_LIFE days
+    type       the weight of the recommendation type in SCORING_TYPE_WEIGHTS
+    purchased  -1 when bought in the last 30 days, so its weight is a penalty
+
+Other scorers are registered in SCORERS. The ranking of each user is
+cached until one of the user's recommendations is written, or for
+SCORING_CACHE_TTL seconds since recency depends on the current day.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from service.common.metrics import metrics
+from service.common.tracing import span
+from service.models import CHANGE_LISTENERS
+
+
+class Candidates:  # pylint: disable=too-few-public-methods
+    """
+    The serialized recommendations of one user as columnar arrays
+
+    Args:
+        records (list): serialized recommendations
+        today (date): the day recency is measured from
+    """
+
+    def __init__(self, records: list, today: date = None):
+        self.records = records
+        count = len(records)
+        self.today = np.datetime64(today or date.today(), "D")
+        self.id = np.fromiter((record["id"] for record in records), dtype=np.int64, count=count)
+        self.rating = np.fromiter((record["rating"] for record in records), dtype=np.float64, count=count)
+        self.bought = np.fromiter(
+            (record["bought_in_last_30_days"] for record in records), dtype=np.bool_, count=count
+        )
+        # ISO dates are parsed by NumPy in one pass
+        self.update_date = np.array([record["update_date"] for record in records], dtype="datetime64[D]")
+        # each type once, and the position of the type of every row
+        codes = {}
+        self.type_codes = np.fromiter(
+            (codes.setdefault(record["recommendation_type"], len(codes)) for record in records),
+            dtype=np.intp,
+            count=count,
+        )
+        self.type_names = list(codes)
+
+    def __len__(self):
+        return len(self.records)
+
+
+class RatingScorer:  # pylint: disable=too-few-public-methods
+    """Scores the rating, from 0 to 1"""
+
+    def __call__(self, candidates: Candidates) -> np.ndarray:
+        return candidates.rating / 5.0
+
+
+class RecencyScorer:  # pylint: disable=too-few-public-methods
+    """Scores 1 on the day of the last update, halved every half_life days"""
+
+    def __init__(self, half_life: float):
+        self.half_life = half_life
+
+    def __call__(self, candidates: Candidates) -> np.ndarray:
+        age = (candidates.today - candidates.update_date).astype(np.float64)
+        return np.exp2(-np.maximum(age, 0.0) / self.half_life)
+
+
+class TypeWeightScorer:  # pylint: disable=too-few-public-methods
+    """Scores the weight of the recommendation type, 0 for the types without one"""
+
+    def __init__(self, weights: dict):
+        self.weights = weights
+
+    def __call__(self, candidates: Candidates) -> np.ndarray:
+        weights = np.array([self.weights.get(name, 0.0) for name in candidates.type_names], dtype=np.float64)
+        return weights[candidates.type_codes]
+
+
+class PurchasedScorer:  # pylint: disable=too-few-public-methods
+    """Scores -1 for the products bought in the last 30 days"""
+
+    def __call__(self, candidates: Candidates) -> np.ndarray:
+        return -candidates.bought.astype(np.float64)
+
+
+# Factories of the scorers by name, called with the app config
+SCORERS = {
+    "rating": lambda config: RatingScorer(),
+    "recency": lambda config: RecencyScorer(config["SCORING_RECENCY_HALF_LIFE"]),
+    "type": lambda config: TypeWeightScorer(parse_weights(config["SCORING_TYPE_WEIGHTS"])),
+    "purchased": lambda config: PurchasedScorer(),
+}
+
+
+def parse_weights(value: str) -> dict:
+    """Returns {name: weight} for a "NAME=weight,..." setting"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class ScoringPipeline:
+    """
+    Ranks Candidates by the weighted sum of the scores of scorers
+
+    Args:
+        scorers (list): (weight, scorer) tuples, a scorer returns one
+            score per candidate
+    """
+
+    def __init__(self, scorers: list):
+        self.scorers = scorers
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the pipeline of a "name:weight,..." SCORING_PIPELINE"""
+        scorers = []
+        for item in filter(None, (part.strip() for part in config["SCORING_PIPELINE"].split(","))):
+            name, _, weight = item.partition(":")
+            if name.strip() not in SCORERS:
+                raise ValueError(f"Unknown scorer {name.strip()!r}, expected one of: {', '.join(SCORERS)}")
+            scorers.append((float(weight or 1.0), SCORERS[name.strip()](config)))
+        return cls(scorers)
+
+    def score(self, candidates: Candidates) -> np.ndarray:
+        """Returns the score of every candidate"""
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for weight, scorer in self.scorers:
+            scores += weight * scorer(candidates)
+        return scores
+
+    def rank(self, records: list) -> "Ranking":
+        """Returns the Ranking of the records"""
+        candidates = Candidates(records)
+        scores = self.score(candidates)
+        # best score first, the oldest id first among equal scores
+        order = np.lexsort((candidates.id, -scores))
+        return Ranking(records, order.tolist(), scores[order].round(6).tolist())
+
+
+class Ranking:  # pylint: disable=too-few-public-methods
+    """
+    Records in the order of their scores
+
+    Only the records returned by top are copied with their score, so a
+    page of a long ranking costs no more than the page.
+    """
+
+    def __init__(self, records: list, order: list, scores: list):
+        self.records = records
+        self.order = order
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.order)
+
+    def top(self, limit: int = None) -> list:
+        """Returns the limit best records, or all of them, with their score"""
+        return [
+            dict(self.records[index], score=score)
+            for index, score in zip(self.order[:limit], self.scores[:limit])
+        ]
+
+
+class RankingCache:
+    """
+    Ranks the recommendations of users, caching the rankings until a write
+
+    Args:
+        pipeline (ScoringPipeline): ranks the recommendations
+        max_users (int): the number of rankings kept, least recently used
+            first out
+        ttl (float): seconds a ranking is reused
+    """
+
+    def __init__(self, pipeline: ScoringPipeline, max_users=10000, ttl=300.0):
+        self.pipeline = pipeline
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rankings = OrderedDict()
+        # bumped by every write, a ranking started before one is not kept
+        self._generation = 0
+
+    def ranked(self, user_id: int, load) -> Ranking:
+        """Returns the Ranking of the recommendations of user_id, load() returns them"""
+        with self._lock:
+            cached = self._rankings.get(user_id)
+            if cached is not None and time.monotonic() < cached[0]:
+                self._rankings.move_to_end(user_id)
+                metrics.increment("ranking_hits")
+                return cached[1]
+            generation = self._generation
+        records = load()
+        started = time.monotonic()
+        with span("score"):
+            ranking = self.pipeline.rank(records)
+        metrics.observe("ranking", time.monotonic() - started)
+        metrics.increment("ranking_misses")
+        with self._lock:
+            if generation == self._generation:
+                self._rankings[user_id] = (time.monotonic() + self.ttl, ranking)
+                self._rankings.move_to_end(user_id)
+                while len(self._rankings) > self.max_users:
+                    self._rankings.popitem(last=False)
+        return ranking
+
+    def on_change(self, changes):
+        """Drops the rankings of the users whose recommendations were written"""
+        with self._lock:
+            self._generation += 1
+            if changes.everything:
+                self._rankings.clear()
+            for user_id in changes.user_ids:
+                self._rankings.pop(user_id, None)
+
+
+def init_app(app):
+    """Creates the ranking cache of app from its SCORING_* settings"""
+    cache = app.extensions.pop("ranking_cache", None)
+    if cache is not None:
+        CHANGE_LISTENERS.remove(cache.on_change)
+    cache = RankingCache(
+        ScoringPipeline.from_config(app.config),
+        max_users=app.config["SCORING_CACHE_SIZE"],
+        ttl=app.config["SCORING_CACHE_TTL"],
+    )
+    CHANGE_LISTENERS.append(cache.on_change)
+    app.extensions["ranking_cache"] = cache
+    return cache
@@ -0,0 +1,229 @@
+"""
+Shared List Cache
+
+This module caches the rendered recommendation list of each user in a
+memory-mapped file (under /dev/shm by default) so every gunicorn worker
+on a pod shares one warm cache instead of keeping its own cold copy.
+
+The file holds a table of version counters followed by fixed size
+slots grouped in small sets. A user hashes to one version counter and
+one set; a write to any of the user's recommendations bumps the counter
+so entries stored under the previous version are never served again.
+When a set is full the entry filled least recently is evicted, and
+lists larger than a slot are not cached.
+
+Writers serialize on an flock of the file. Readers take no lock: each
+slot carries a sequence number that is odd while the slot is written,
+and a read is discarded when the sequence changed under it.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from service.common.metrics import metrics
+from service.models import CHANGE_LISTENERS
+
+MAGIC = b"RECOLST1"
+# magic, slots, slot size, version counters, ways, epoch, fill clock
+HEADER = struct.Struct("<8sIIIIQQ")
+HEADER_SIZE = 64
+EPOCH_OFFSET = 24
+CLOCK_OFFSET = 32
+# sequence, key, version, epoch, filled at, fill clock, length
+SLOT = struct.Struct("<QqQQdQI4x")
+COUNTER = struct.Struct("<Q")
+
+
+def default_path() -> str:
+    """Returns a path in shared memory when the system has one"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "recommendation-list-cache")
+
+
+class SharedCache:
+    """
+    A size bounded cache of bytes keyed by int, shared between processes
+
+    Args:
+        path (str): the file backing the cache
+        slots (int): the number of entries kept
+        slot_size (int): the largest value stored, in bytes
+        ttl (float): the seconds after which an entry is no longer served
+        buckets (int): the number of version counters keys hash to
+        ways (int): the number of slots a key may be stored in
+    """
+
+    def __init__(self, path: str, slots=2048, slot_size=16384, ttl=60.0, buckets=65536, ways=4):
+        self.path = path
+        self.ways = ways
+        self.sets = max(slots // ways, 1)
+        self.slots = self.sets * ways
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.buckets = buckets
+        self._slots_offset = HEADER_SIZE + buckets * COUNTER.size
+        self._stride = SLOT.size + slot_size
+        self.size = self._slots_offset + self.slots * self._stride
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(mapped=False):
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self._map = mmap.mmap(self._fd, self.size)
+            expected = (MAGIC, self.slots, slot_size, buckets, ways)
+            if HEADER.unpack_from(self._map, 0)[:5] != expected:
+                self._map[: self.size] = bytes(self.size)
+                HEADER.pack_into(self._map, 0, *expected, 0, 0)
+
+    @contextmanager
+    def _locked(self, mapped=True):
+        """Excludes the other threads and processes writing to the cache"""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map if mapped else None
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        """Unmaps the cache file"""
+        self._map.close()
+        os.close(self._fd)
+
+    ######################################################################
+    # Versions
+    ######################################################################
+    def _bucket_offset(self, key: int) -> int:
+        return HEADER_SIZE + (hash(key) % self.buckets) * COUNTER.size
+
+    def version(self, key: int):
+        """Returns the current (epoch, version) of key"""
+        epoch = COUNTER.unpack_from(self._map, EPOCH_OFFSET)[0]
+        return epoch, COUNTER.unpack_from(self._map, self._bucket_offset(key))[0]
+
+    def invalidate(self, keys):
+        """Makes the entries of keys stale"""
+        with self._locked() as data:
+            for offset in {self._bucket_offset(key) for key in keys}:
+                COUNTER.pack_into(data, offset, COUNTER.unpack_from(data, offset)[0] + 1)
+        metrics.increment("list_cache_invalidations")
+
+    def clear(self):
+        """Makes every entry stale"""
+        with self._locked() as data:
+            COUNTER.pack_into(data, EPOCH_OFFSET, COUNTER.unpack_from(data, EPOCH_OFFSET)[0] + 1)
+        metrics.increment("list_cache_clears")
+
+    def on_change(self, changes):
+        """Invalidates the users of a committed models.ChangeSet"""
+        if changes.everything:
+            self.clear()
+        elif changes.user_ids:
+            self.invalidate(changes.user_ids)
+
+    ######################################################################
+    # Entries
+    ######################################################################
+    def _set_offsets(self, key: int):
+        first = (hash(key) * 2654435761 % (1 << 32)) % self.sets * self.ways
+        return [self._slots_offset + (first + way) * self._stride for way in range(self.ways)]
+
+    def get(self, key: int):
+        """Returns the bytes stored for key, or None"""
+        epoch, version = self.version(key)
+        data = self._map
+        for offset in self._set_offsets(key):
+            sequence, slot_key, slot_version, slot_epoch, filled_at, _clock, length = SLOT.unpack_from(data, offset)
+            if sequence % 2 or slot_key != key or not 0 < length <= self.slot_size:
+                continue
+            if (slot_epoch, slot_version) != (epoch, version) or time.time() - filled_at > self.ttl:
+                break
+            start = offset + SLOT.size
+            value = data[start:start + length]
+            if COUNTER.unpack_from(data, offset)[0] != sequence:
+                break  # the slot was rewritten while it was read
+            metrics.increment("list_cache_hits")
+            return value
+        metrics.increment("list_cache_misses")
+        return None
+
+    def put(self, key: int, version, value: bytes) -> bool:
+        """
+        Stores value for key if key is still at version
+
+        version must be read with version() before the value is computed,
+        so a value computed before a concurrent write is never stored
+        under the version that follows the write.
+        """
+        if len(value) > self.slot_size:
+            metrics.increment("list_cache_too_large")
+            return False
+        with self._locked() as data:
+            if self.version(key) != tuple(version):
+                return False
+            offset = self._victim(data, key)
+            sequence = COUNTER.unpack_from(data, offset)[0]
+            clock = COUNTER.unpack_from(data, CLOCK_OFFSET)[0] + 1
+            COUNTER.pack_into(data, CLOCK_OFFSET, clock)
+            COUNTER.pack_into(data, offset, sequence + 1)
+            start = offset + SLOT.size
+            data[start:start + len(value)] = value
+            SLOT.pack_into(data, offset, sequence + 1, key, version[1], version[0], time.time(), clock, len(value))
+            COUNTER.pack_into(data, offset, sequence + 2)
+        metrics.increment("list_cache_stores")
+        return True
+
+    def _victim(self, data, key: int) -> int:
+        """Returns the slot of key's set to write: its own, an empty one or the oldest"""
+        oldest = None
+        for offset in self._set_offsets(key):
+            _sequence, slot_key, _version, _epoch, _filled_at, clock, length = SLOT.unpack_from(data, offset)
+            if slot_key == key or length == 0:
+                return offset
+            if oldest is None or clock < oldest[0]:
+                oldest = (clock, offset)
+        metrics.increment("list_cache_evictions")
+        return oldest[1]
+
+    ######################################################################
+    # JSON values
+    ######################################################################
+    def load(self, key: int):
+        """Returns the JSON value stored for key, or None"""
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def fill(self, key: int, func):
+        """Returns func() after storing it as JSON for key"""
+        version = self.version(key)
+        result = func()
+        self.put(key, version, json.dumps(result, separators=(",", ":")).encode())
+        return result
+
+
+def init_app(app):
+    """Opens the shared list cache when LIST_CACHE is enabled"""
+    cache = app.extensions.pop("list_cache", None)
+    if cache is not None:
+        CHANGE_LISTENERS.remove(cache.on_change)
+        cache.close()
+    if not app.config.get("LIST_CACHE"):
+        return None
+    cache = SharedCache(
+        app.config.get("LIST_CACHE_PATH") or default_path(),
+        slots=app.config["LIST_CACHE_SLOTS"],
+        slot_size=app.config["LIST_CACHE_SLOT_SIZE"],
+        ttl=app.config["LIST_CACHE_TTL"],
+    )
+    # the database may have changed while no worker was running
+    cache.clear()
+    CHANGE_LISTENERS.append(cache.on_change)
+    app.extensions["list_cache"] = cache
+    app.logger.info("Shared list cache at %s", cache.path)
+    return cache
@@ -0,0 +1,98 @@
+"""
+Single-flight
+
+This module coalesces identical concurrent reads: while a query for a
+key is in flight, other requests for the same key wait for it and share
+its serialized result instead of running the query again. Nothing is
+kept once the query returns, so a result is never older than the
+query the request joined.
+
+Coalescing happens between the threads of one worker, so it needs a
+threaded worker class (for example gunicorn --threads).
+"""
+import threading
+from service.common.metrics import metrics
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """One in-flight query and the requests waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time
+
+    Args:
+        name (str): prefix of the metrics counted for this group
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Returns func() or, when a call for key is already running, its result
+
+        An exception raised by the running call is raised in every request
+        that waited on it, unless it is flagged per_request (e.g. a deadline
+        of the running request): the waiting requests then try again. The
+        shared result must not be modified.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.increment(f"{self.name}_coalesced")
+            call.done.wait()
+            if getattr(call.error, "per_request", False):
+                return self.do(key, func)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(f"{self.name}_queries")
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """Returns the number of keys with a running call"""
+        with self._lock:
+            return len(self._calls)
+
+
+def init_app(app):
+    """Creates the single-flight groups of the read endpoints when SINGLE_FLIGHT is enabled"""
+    if not app.config.get("SINGLE_FLIGHT"):
+        app.extensions.pop("single_flight", None)
+        return None
+    flights = {
+        "list": SingleFlight("recommendation_list"),
+        "get": SingleFlight("recommendation_get"),
+    }
+    app.extensions["single_flight"] = flights
+    return flights
+
+
+def coalesce(app, group: str, key, func):
+    """Runs func through the single-flight group of app, or directly when disabled"""
+    flights = app.extensions.get("single_flight")
+    if flights is None:
+        return func()
+    return flights[group].do(key, func)
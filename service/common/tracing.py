@@ -0,0 +1,265 @@
+"""
+Tracing
+
+This module records where the time of a request goes. A sampled
+request gets a trace made of spans: the whole request, the marshalling
+done by flask-restx, the route handler, payload validation, every SQL
+statement, serialization and compression. Spans nest, and each one
+reports its own time without its children.
+
+TRACE_SAMPLE_RATE requests are sampled at random, and every request
+sent with X-Trace-Sampled: 1. The trace id comes from the X-Trace-Id
+header, or is generated, and is returned in X-Trace-Id on every
+response so calls can be followed across services.
+
+The last TRACE_BUFFER_SIZE traces are kept in memory and served by
+GET /debug/traces; with TRACE_FILE they are also appended to that file
+as JSON lines. Outside of a sampled request span() does nothing.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.common.metrics import metrics
+
+# the trace of the current request, None when it is not sampled
+_trace = ContextVar("trace", default=None)
+
+TRACE_ID = re.compile(r"^[0-9A-Za-z-]{1,64}$")
+# characters of SQL kept in the db spans
+STATEMENT_LENGTH = 120
+
+
+class Trace:
+    """The spans recorded for one request"""
+
+    def __init__(self, trace_id: str, method: str, path: str):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.status = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self._open = []
+
+    def begin(self, name: str, detail=None) -> dict:
+        """Opens a span under the innermost open span"""
+        item = {
+            "name": name,
+            "parent": self._open[-1]["id"] if self._open else None,
+            "id": len(self.spans),
+            "start": time.perf_counter() - self.started,
+        }
+        if detail is not None:
+            item["detail"] = detail
+        self.spans.append(item)
+        self._open.append(item)
+        return item
+
+    def end(self, item: dict, error=None):
+        """Closes the span opened by begin"""
+        item["duration"] = time.perf_counter() - self.started - item["start"]
+        if error is not None:
+            item["error"] = type(error).__name__
+        if item in self._open:
+            self._open.remove(item)
+
+    def finish(self, error=None):
+        """Closes the spans left open, the root span last"""
+        while self._open:
+            item = self._open[-1]
+            self.end(item, error if len(self._open) == 1 else None)
+
+    def to_dict(self) -> dict:
+        """Returns the trace with times in milliseconds"""
+        children = [0.0] * len(self.spans)
+        for item in self.spans:
+            if item["parent"] is not None:
+                children[item["parent"]] += item.get("duration", 0.0)
+        spans = []
+        for item in self.spans:
+            duration = item.get("duration", 0.0)
+            spans.append({
+                **item,
+                "start": round(item["start"] * 1000, 3),
+                "duration": round(duration * 1000, 3),
+                "self": round((duration - children[item["id"]]) * 1000, 3),
+            })
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "spans": spans,
+        }
+
+
+class _Span:
+    """Context manager timing one span of a trace"""
+
+    __slots__ = ("trace", "name", "detail", "item")
+
+    def __init__(self, trace, name, detail):
+        self.trace = trace
+        self.name = name
+        self.detail = detail
+        self.item = None
+
+    def __enter__(self):
+        self.item = self.trace.begin(self.name, self.detail)
+        return self
+
+    def __exit__(self, _kind, error, _traceback):
+        self.trace.end(self.item, error)
+
+
+class _NoSpan:
+    """Context manager used outside of sampled requests"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        return None
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name: str, detail=None):
+    """Returns a context manager recording a span of the current trace"""
+    trace = _trace.get()
+    return NO_SPAN if trace is None else _Span(trace, name, detail)
+
+
+def traced(name: str):
+    """Decorator recording a span for every call of the function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Tracer:
+    """
+    Samples requests and keeps their finished traces
+
+    Args:
+        sample_rate (float): fraction of the requests traced
+        buffer_size (int): finished traces kept in memory
+        path (str): file the traces are appended to, as JSON lines
+    """
+
+    def __init__(self, sample_rate=0.01, buffer_size=200, path=None):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.traces = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def sampled(self, forced: bool) -> bool:
+        """Decides whether a request is traced"""
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def record(self, trace: Trace):
+        """Keeps a finished trace"""
+        result = trace.to_dict()
+        with self._lock:
+            self.traces.append(result)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(json.dumps(result) + "\n")
+        metrics.increment("traces_recorded")
+
+    def recent(self, trace_id=None, limit=None) -> list:
+        """Returns the kept traces, newest first"""
+        with self._lock:
+            traces = list(reversed(self.traces))
+        if trace_id is not None:
+            traces = [trace for trace in traces if trace["trace_id"] == trace_id]
+        return traces[:limit] if limit else traces
+
+
+######################################################################
+# Database hooks
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def _statement_started(connection, _cursor, statement, *_args):
+    """Opens a db span for every statement of a traced request"""
+    trace = _trace.get()
+    if trace is not None:
+        detail = " ".join(statement.split())[:STATEMENT_LENGTH]
+        connection.info["trace_span"] = (trace, trace.begin("db", detail))
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statement_ended(connection, *_args):
+    """Closes the db span of the statement"""
+    trace, item = connection.info.pop("trace_span", (None, None))
+    if trace is not None and trace is _trace.get():
+        trace.end(item)
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_failed(context):
+    """Closes the db span of a failed statement"""
+    connection = context.connection
+    trace, item = connection.info.pop("trace_span", (None, None)) if connection is not None else (None, None)
+    if trace is not None and trace is _trace.get():
+        trace.end(item, context.original_exception)
+
+
+def init_app(app):
+    """Traces the sampled requests of app"""
+    tracer = Tracer(
+        sample_rate=app.config["TRACE_SAMPLE_RATE"],
+        buffer_size=app.config["TRACE_BUFFER_SIZE"],
+        path=app.config.get("TRACE_FILE"),
+    )
+    app.extensions["tracer"] = tracer
+    if app.extensions.get("tracing_hooks"):
+        return tracer  # the hooks look the tracer up, registering them once
+    app.extensions["tracing_hooks"] = True
+
+    @app.before_request
+    def start_trace():  # pylint: disable=unused-variable
+        trace_id = request.headers.get("X-Trace-Id", "")
+        g.trace_id = trace_id if TRACE_ID.match(trace_id) else uuid.uuid4().hex
+        current = app.extensions["tracer"]
+        if current.sampled(request.headers.get("X-Trace-Sampled") == "1"):
+            trace = Trace(g.trace_id, request.method, request.path)
+            trace.begin("request")
+            _trace.set(trace)
+
+    @app.after_request
+    def add_trace_header(response):  # pylint: disable=unused-variable
+        response.headers["X-Trace-Id"] = g.get("trace_id") or uuid.uuid4().hex
+        trace = _trace.get()
+        if trace is not None:
+            trace.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_trace(error):  # pylint: disable=unused-variable
+        trace = _trace.get()
+        if trace is None:
+            return
+        _trace.set(None)
+        trace.finish(error)
+        app.extensions["tracer"].record(trace)
+
+    return tracer
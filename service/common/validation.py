@@ -0,0 +1,186 @@
+"""
+Payload Validation
+
+This module turns a payload schema once, at import time, into a list of
+per-field checker closures: one type check per field, enum names
+resolved through a lookup table and no exceptions on the happy path.
+Every invalid field is reported, not just the first one.
+"""
+from collections import namedtuple
+
+
+class DataValidationError(Exception):
+    """Used for an data validation errors when deserializing"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or [message]
+
+
+Field = namedtuple("Field", "kind required minimum maximum members")
+
+
+def integer(required: bool = True, minimum=None, maximum=None) -> Field:
+    """An int field, bools excluded, optionally within [minimum, maximum]"""
+    return Field("int", required, minimum, maximum, None)
+
+
+def boolean(required: bool = True) -> Field:
+    """A bool field"""
+    return Field("bool", required, None, None, None)
+
+
+def enumeration(enum_class: type, required: bool = True) -> Field:
+    """A field holding the name of a member of enum_class"""
+    return Field("enum", required, None, None, dict(enum_class.__members__))
+
+
+######################################################################
+# Error messages, only built when a value is invalid
+######################################################################
+def _int_error(name, value, field):
+    if type(value) is not int:  # pylint: disable=unidiomatic-typecheck
+        return f"Invalid type for int [{name}]"
+    return f"Invalid value for [{name}]: must be between {field.minimum} and {field.maximum}"
+
+
+def _bool_error(name, value, _field):
+    return f"Invalid type for bool [{name}]: {type(value)}"
+
+
+def _enum_error(name, value, _field):
+    if not isinstance(value, str):
+        return f"Invalid type for string [{name}]: {type(value)}"
+    return f"Invalid value for [{name}]: {value}"
+
+
+def _add_error(errors, message):
+    """Appends message, creating the list on the first error only"""
+    if errors is None:
+        return [message]
+    errors.append(message)
+    return errors
+
+
+_INVALID = object()
+
+
+def _int_checker(field: Field):
+    """Returns a check accepting ints, bools excluded, within the field bounds"""
+    minimum, maximum = field.minimum, field.maximum
+
+    def check(value):
+        if type(value) is not int:  # pylint: disable=unidiomatic-typecheck
+            return _INVALID
+        if minimum is not None and value < minimum:
+            return _INVALID
+        if maximum is not None and value > maximum:
+            return _INVALID
+        return value
+
+    return check
+
+
+def _bool_checker(_field: Field):
+    """Returns a check accepting True and False only"""
+
+    def check(value):
+        return value if value is True or value is False else _INVALID
+
+    return check
+
+
+def _enum_checker(field: Field):
+    """Returns a check mapping a member name to its enum member"""
+    members = field.members
+
+    def check(value):
+        if type(value) is not str:  # pylint: disable=unidiomatic-typecheck
+            return _INVALID
+        return members.get(value, _INVALID)
+
+    return check
+
+
+_KINDS = {
+    "int": (_int_checker, _int_error),
+    "bool": (_bool_checker, _bool_error),
+    "enum": (_enum_checker, _enum_error),
+}
+
+
+class PayloadValidator:
+    """
+    Validates dictionaries against a schema of per-field checkers
+
+    Args:
+        resource (str): the name used in error messages
+        schema (dict): a Field keyed by field name
+    """
+
+    def __init__(self, resource: str, schema: dict):
+        self.resource = resource
+        self.schema = dict(schema)
+        self._bad_body = f"Invalid {resource}: body of request contained bad or no data"
+        self._fields = []
+        for name, field in self.schema.items():
+            make_checker, error = _KINDS[field.kind]
+            missing = f"Invalid {resource}: missing {name}" if field.required else None
+            self._fields.append((name, make_checker(field), error, field, missing))
+
+    def _collect(self, data, partial):
+        """Runs every field checker over data"""
+        if type(data) is not dict:  # pylint: disable=unidiomatic-typecheck
+            return {}, [self._bad_body]
+        get = data.get
+        values = {}
+        errors = None
+        for name, check, error, field, missing in self._fields:
+            value = get(name)
+            if value is None:
+                if missing is not None and not partial:
+                    errors = _add_error(errors, missing)
+                continue
+            checked = check(value)
+            if checked is _INVALID:
+                errors = _add_error(errors, error(name, value, field))
+            else:
+                values[name] = checked
+        return values, errors
+
+    def collect(self, data, partial: bool = False):
+        """
+        Returns (values, errors) for data without raising
+
+        errors is None when data is valid. With partial, missing required
+        fields are not errors so only the fields present in data are
+        validated and returned.
+        """
+        return self._collect(data, partial)
+
+    def validate(self, data, partial: bool = False) -> dict:
+        """Returns the validated values of data or raises DataValidationError"""
+        values, errors = self._collect(data, partial)
+        if errors:
+            raise DataValidationError("; ".join(errors), errors)
+        return values
+
+    def validate_many(self, items, partial: bool = False):
+        """
+        Validates a batch of payloads
+
+        Returns:
+            (values, errors) where values holds the validated items and
+            errors maps the position of every invalid item to its errors
+        """
+        values = []
+        errors = {}
+        collect = self._collect
+        append = values.append
+        for position, item in enumerate(items):
+            item_values, item_errors = collect(item, partial)
+            if item_errors:
+                errors[position] = item_errors
+            else:
+                append(item_values)
+        return values, errors
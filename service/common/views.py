@@ -0,0 +1,19 @@
+"""
+View Attributes
+
+Helpers reading the attributes that decorators such as no_compression
+set on a view function or on the method of a flask-restx Resource.
+"""
+from flask import request
+
+
+def view_attribute(app, name: str, default=None):
+    """Returns attribute name of the view handling this request"""
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return default
+    if hasattr(view, name):
+        return getattr(view, name)
+    view_class = getattr(view, "view_class", None)
+    method = getattr(view_class, request.method.lower(), None)
+    return getattr(method, name, default)
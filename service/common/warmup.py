@@ -0,0 +1,105 @@
+"""
+Warm-up
+
+This module warms a worker up before it reports ready: it opens
+WARMUP_CONNECTIONS pooled connections to the primary database (and one
+to each read replica) and, when the shared list cache is enabled, fills
+it with the lists of the WARMUP_USERS most active users. The readiness
+endpoint answers 503 until the warm-up is done; the liveness endpoint
+does not depend on it.
+
+A warm-up that fails, e.g. because the database is not reachable yet,
+is retried every WARMUP_RETRY seconds.
+"""
+import threading
+import time
+from service.common.metrics import metrics
+from service.models import Recommendation, db
+
+
+class WarmUp:
+    """
+    Warms the pools and caches of a worker in a background thread
+
+    Args:
+        app (Flask): the application to warm up
+        connections (int): pooled connections opened on the primary
+        users (int): most active users whose lists are cached
+        retry_seconds (float): delay before a failed warm-up is retried
+    """
+
+    def __init__(self, app, connections=5, users=100, retry_seconds=5.0):
+        self.app = app
+        self.connections = connections
+        self.users = users
+        self.retry_seconds = retry_seconds
+        self.ready = threading.Event()
+        self.duration = None
+        self._thread = None
+
+    def start(self):
+        """Runs the warm-up in a background thread"""
+        if self._thread or self.ready.is_set():
+            return
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Warms up, retrying until it succeeds"""
+        started = time.monotonic()
+        while not self.ready.is_set():
+            try:
+                with self.app.app_context():
+                    self._open_connections()
+                    primed = self._prime_caches()
+                self.duration = time.monotonic() - started
+                metrics.observe("warmup_seconds", self.duration)
+                self.app.logger.info("Warm-up done in %.2fs, %d lists cached", self.duration, primed)
+                self.ready.set()
+            except Exception as error:  # pylint: disable=broad-except
+                self.app.logger.warning("Warm-up failed, retrying: %s", error)
+                metrics.increment("warmup_errors")
+                time.sleep(self.retry_seconds)
+
+    def _open_connections(self):
+        """Checks out connections at once so the pools create them"""
+        engines = [db.engine] * self.connections
+        router = self.app.extensions.get("replicas")
+        if router is not None:
+            engines.extend(router.engines)
+        opened = []
+        try:
+            for engine in engines:
+                connection = engine.connect()
+                opened.append(connection)
+                connection.exec_driver_sql("SELECT 1")
+        finally:
+            for connection in opened:
+                connection.close()
+
+    def _prime_caches(self) -> int:
+        """Caches the lists of the most active users"""
+        if "list_cache" not in self.app.extensions or not self.users:
+            return 0
+        from service import routes  # pylint: disable=import-outside-toplevel, cyclic-import
+
+        user_ids = Recommendation.most_active_users(self.users)
+        for user_id in user_ids:
+            routes.list_results(user_id)
+        return len(user_ids)
+
+
+def init_app(app, start: bool = True):
+    """Starts the warm-up, or marks the worker ready when WARMUP is disabled"""
+    warm_up = WarmUp(
+        app,
+        connections=app.config["WARMUP_CONNECTIONS"],
+        users=app.config["WARMUP_USERS"],
+        retry_seconds=app.config["WARMUP_RETRY"],
+    )
+    app.extensions["warmup"] = warm_up
+    if not app.config.get("WARMUP"):
+        warm_up.ready.set()
+    elif start:
+        warm_up.start()
+    return warm_up
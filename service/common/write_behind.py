@@ -0,0 +1,117 @@
+"""
+Write-behind buffer for ratings
+
+Rating updates are accepted into memory and written in batches. Repeated
+updates to the same recommendation are coalesced so only the last rating
+is written. A background thread flushes the buffer every
+RATING_FLUSH_INTERVAL seconds, as soon as it reaches RATING_FLUSH_SIZE
+entries and when the process exits, so requests never wait on a flush.
+"""
+import atexit
+import logging
+import threading
+import time
+from service.common.metrics import metrics
+from service.models import Recommendation, db
+
+logger = logging.getLogger("flask.app")
+
+
+class RatingBuffer:
+    """Coalesces rating updates in memory and writes them in batches"""
+
+    def __init__(self, app, max_size: int = 500, interval: float = 1.0):
+        self.app = app
+        self.max_size = max_size
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        # set when the buffer is full, so the thread flushes without waiting
+        self._full = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def put(self, recommendation_id: int, rating: int):
+        """Queues a rating, replacing any pending rating for the same id"""
+        with self._lock:
+            if recommendation_id in self._pending:
+                metrics.increment("rating_updates_coalesced")
+            self._pending[recommendation_id] = rating
+            depth = len(self._pending)
+        metrics.increment("rating_updates_queued")
+        metrics.gauge("rating_queue_depth", depth)
+        if depth >= self.max_size:
+            self._full.set()
+
+    def flush(self) -> int:
+        """Writes every pending rating, returning the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            metrics.gauge("rating_queue_depth", 0)
+            if not pending:
+                return 0
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    Recommendation.update_ratings(pending)
+                    db.session.commit()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not flush %d ratings, will retry", len(pending))
+                metrics.increment("rating_flush_errors")
+                with self._lock:
+                    # keep newer ratings that arrived during the failed flush
+                    pending.update(self._pending)
+                    self._pending = pending
+                    metrics.gauge("rating_queue_depth", len(self._pending))
+                return 0
+            metrics.observe("rating_flush_seconds", time.monotonic() - started)
+            metrics.increment("rating_flushes")
+            logger.info("Flushed %d ratings", len(pending))
+            return len(pending)
+
+    def start(self):
+        """Starts the background thread that flushes on the time threshold"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="rating-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the background thread and flushes what is left"""
+        self._stopped.set()
+        self._full.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            self._full.wait(self.interval)
+            if self._stopped.is_set():
+                return
+            self._full.clear()
+            self.flush()
+
+
+def init_app(app, start: bool = True):
+    """Creates and starts the rating buffer when RATING_WRITE_BEHIND is enabled"""
+    if not app.config.get("RATING_WRITE_BEHIND"):
+        return None
+    buffer = RatingBuffer(
+        app,
+        max_size=app.config["RATING_FLUSH_SIZE"],
+        interval=app.config["RATING_FLUSH_INTERVAL"],
+    )
+    if start:
+        buffer.start()
+    app.extensions["rating_buffer"] = buffer
+    app.logger.info("Rating write-behind enabled")
+    return buffer
@@ -3,16 +3,75 @@ Models for Recommendation
 
 All of the models are stored in this module
 """
+# pylint: disable=too-many-lines
+import csv
+import io
+import json
 import logging
+import time
 from datetime import date
 from enum import Enum
+from itertools import chain
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import CheckConstraint
+from flask_sqlalchemy.session import Session
+from sqlalchemy import (
+    Boolean, CheckConstraint, Integer, bindparam, cast, column, event, insert, inspect, literal, select, delete, text,
+    tuple_, union_all, update, values as values_clause,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.pool import QueuePool
+from service.common.validation import PayloadValidator, boolean, enumeration, integer
+# re-exported, routes and the CLI import it from the models
+from service.common.validation import DataValidationError  # noqa: F401 pylint: disable=unused-import
 
 logger = logging.getLogger("flask.app")
 
+
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """
+    Session that sends reads to a replica engine when one is assigned
+
+    A replica is assigned by service.common.replicas.read_only through
+    session.info. Writes, and every statement after the first write,
+    always use the primary database so a request reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):  # pylint: disable=arguments-differ
+        replica = self.info.get("replica")
+        if replica is not None and bind is None:
+            if self._flushing or getattr(clause, "is_dml", False):
+                self.info["wrote"] = True
+            if not self.info.get("wrote"):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that measures how long checkouts wait for a connection
+
+    wait_time is a moving average of the recent checkouts, read by the
+    admission control to shed load when the pool is saturated.
+    """
+
+    wait_time = 0.0
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_time += (time.monotonic() - started - self.wait_time) * 0.2
+
+    def saturated(self) -> bool:
+        """True when every connection is checked out and no more can be opened"""
+        return self.checkedin() == 0 and self.overflow() >= self._max_overflow
+
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class RecommendationType(Enum):
@@ -32,23 +91,112 @@ def init_db(app):
     Recommendation.init_db(app)
 
 
-def check_is_int(value, error_message):
-    """Throws DataValidationError if the value is not an int"""
-    if not isinstance(value, int):
-        raise DataValidationError(error_message)
+# Validates create, update and bulk payloads, built once at import
+RECOMMENDATION_VALIDATOR = PayloadValidator(
+    "Recommendation",
+    {
+        "user_id": integer(),
+        "product_id": integer(),
+        "recommendation_type": enumeration(RecommendationType),
+        "bought_in_last_30_days": boolean(),
+        "rating": integer(required=False, minimum=0, maximum=5),
+    },
+)
+
+
+def _copy_buffer(rows, columns):
+    """Renders rows of column values as CSV suitable for Postgres COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            [
+                value.name if isinstance(value, Enum) else value
+                for value in (row[column] for column in columns)
+            ]
+        )
+    buffer.seek(0)
+    return buffer
+
+
+def _constraint_error(error: IntegrityError) -> Exception:
+    """
+    Returns the DataConflictError of a natural key violation, or the
+    DataValidationError of any other constraint the row breaks
+    """
+    message = str(error.orig)
+    constraint = getattr(getattr(error.orig, "diag", None), "constraint_name", None)
+    # SQLite names the columns of a unique index, not the index
+    columns = ", ".join(f"{Recommendation.__tablename__}.{key}" for key in Recommendation.NATURAL_KEY)
+    if constraint == NATURAL_KEY_INDEX or NATURAL_KEY_INDEX in message or columns in message:
+        return DataConflictError(NATURAL_KEY_CONFLICT)
+    return DataValidationError(f"Invalid Recommendation: {message.splitlines()[0]}")
+
+
+def _commit_or_conflict():
+    """Commits the session, turning constraint violations into DataConflictError or DataValidationError"""
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        raise _constraint_error(error) from error
+
+
+class DataConflictError(Exception):
+    """Used when a write would duplicate an existing Recommendation"""
+
+
+NATURAL_KEY_CONFLICT = "A recommendation for this user, product and type already exists"
+NATURAL_KEY_INDEX = "recommendation_natural_key"
+
+
+######################################################################
+# Change tracking
+######################################################################
+class ChangeSet:  # pylint: disable=too-few-public-methods
+    """The Recommendations written by one transaction"""
+
+    def __init__(self):
+        self.ids = set()
+        self.user_ids = set()
+        # set by writes whose rows are not known, e.g. Query.delete()
+        self.everything = False
 
+    def __bool__(self):
+        return self.everything or bool(self.ids or self.user_ids)
 
-class DataValidationError(Exception):
-    """Used for an data validation errors when deserializing"""
 
+# Called with the ChangeSet of every committed transaction that wrote
+# Recommendations, e.g. to invalidate caches
+CHANGE_LISTENERS = []
 
-class Recommendation(db.Model):
+# Called with the ChangeSet and the connection of every committing
+# transaction that wrote Recommendations, before it commits, to write
+# messages that must commit or roll back together with the changes
+COMMIT_LISTENERS = []
+
+# Execution option of the statements whose changes are recorded explicitly
+RECORDED = {"changes_recorded": True}
+
+
+def record_changes(ids=(), user_ids=(), everything=False):
+    """Records Recommendations written by the current transaction"""
+    changes = db.session.info.setdefault("changes", ChangeSet())
+    changes.ids.update(ids)
+    changes.user_ids.update(user_ids)
+    changes.everything = changes.everything or everything
+
+
+class Recommendation(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Recommendation
     """
 
     app = None
 
+    # Columns identifying the same recommendation across writes
+    NATURAL_KEY = ("user_id", "product_id", "recommendation_type")
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
@@ -69,6 +217,16 @@ class Recommendation(db.Model):
         server_default=(RecommendationType.UNKNOWN.name),
     )
 
+    # Columns PATCH /recommendations may change on many rows at once
+    BULK_PATCHABLE = ("recommendation_type", "bought_in_last_30_days")
+
+    # archive rows, change feed tombstones and outbox events keep the ids
+    # of deleted rows, so ids are never reused
+    __table_args__ = (
+        db.Index(NATURAL_KEY_INDEX, *NATURAL_KEY, unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self):
         return f"<Recommendation id=[{self.id}]>"
 
@@ -79,21 +237,411 @@ class Recommendation(db.Model):
         logger.info("Creating recommendation for user id %s", self.user_id)
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
-        db.session.commit()
+        _commit_or_conflict()
 
     def update(self):
         """
         Updates a Recommendation to the database
         """
         logger.info("Saving %s", self.user_id)
-        db.session.commit()
+        _commit_or_conflict()
 
     def delete(self):
-        """Removes a Recommendation from the data store"""
+        """Removes a Recommendation from the data store
+
+        The row is soft deleted: it is moved to the archive table in the
+        same transaction so list and get queries only see live rows.
+        """
         logger.info("Deleting %s", self.id)
+        self._move_to_archive([self.id], deleted=True)
         db.session.delete(self)
         db.session.commit()
 
+    @classmethod
+    def archive(cls, older_than, batch_size=1000):
+        """
+        Moves one batch of Recommendations not updated since older_than
+        to the archive table
+
+        Rows locked by other transactions are skipped so the batch never
+        waits on live traffic. The caller is responsible for committing.
+
+        Args:
+            older_than (date): rows with an earlier update_date are archived
+            batch_size (int): the largest number of rows moved
+
+        Returns:
+            the number of rows archived
+        """
+        rows = db.session.execute(
+            select(cls.id, cls.user_id)
+            .where(cls.update_date < older_than)
+            .order_by(cls.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if rows:
+            logger.info("Archiving %d recommendations", len(rows))
+            cls._delete_rows(rows, archive=True)
+        return len(rows)
+
+    @classmethod
+    def _delete_rows(cls, rows, archive=False):
+        """Deletes the (id, user_id) rows, first copying them to the archive"""
+        ids = [row.id for row in rows]
+        record_changes(ids=ids, user_ids=[row.user_id for row in rows])
+        if archive:
+            cls._move_to_archive(ids)
+        db.session.execute(delete(cls).where(cls.id.in_(ids)), execution_options=RECORDED)
+
+    @classmethod
+    def _move_to_archive(cls, ids, deleted=False):
+        """Copies the rows with the given ids into the archive table"""
+        columns = list(cls.__table__.columns)
+        db.session.execute(
+            insert(RecommendationArchive).from_select(
+                [column.name for column in columns] + ["archived_date", "deleted"],
+                select(*columns, literal(date.today()), literal(deleted)).where(cls.id.in_(ids)),
+            )
+        )
+
+    @classmethod
+    def bulk_create(cls, rows):
+        """
+        Inserts a batch of already validated rows in a single round trip
+
+        Uses Postgres COPY when the driver supports it and a multi-row
+        INSERT otherwise. The caller is responsible for committing.
+
+        Args:
+            rows (list): dictionaries of column values
+        """
+        if not rows:
+            return 0
+        logger.info("Bulk inserting %d recommendations", len(rows))
+        user_ids = [row["user_id"] for row in rows]
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            cursor = connection.connection.cursor()
+            if hasattr(cursor, "copy_expert"):
+                # COPY returns no ids, so they are taken from the sequence first
+                ids = db.session.scalars(
+                    text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                    {"table": cls.__tablename__, "count": len(rows)},
+                ).all()
+                rows = [dict(row, id=by_id) for row, by_id in zip(rows, ids)]
+                columns = tuple(rows[0].keys())
+                cursor.copy_expert(
+                    f"COPY {cls.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                    _copy_buffer(rows, columns),
+                )
+                cursor.close()
+                record_changes(ids=ids, user_ids=user_ids)
+                return len(rows)
+        ids = db.session.scalars(insert(cls).returning(cls.id), rows, execution_options=RECORDED).all()
+        record_changes(ids=ids, user_ids=user_ids)
+        return len(rows)
+
+    @classmethod
+    def update_ratings(cls, ratings):
+        """
+        Writes many ratings with one batched UPDATE statement
+
+        Ids that no longer exist are ignored. The caller is responsible
+        for committing.
+
+        Args:
+            ratings (dict): the new rating keyed by recommendation id
+        """
+        logger.info("Updating %d ratings", len(ratings))
+        table = cls.__table__
+        user_ids = db.session.scalars(
+            select(table.c.user_id).where(table.c.id.in_(list(ratings))).distinct()
+        ).all()
+        record_changes(ids=ratings, user_ids=user_ids)
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam("recommendation_id"))
+            .values(rating=bindparam("new_rating")),
+            [
+                {"recommendation_id": by_id, "new_rating": rating}
+                for by_id, rating in ratings.items()
+            ],
+            execution_options=RECORDED,
+        )
+
+    @classmethod
+    def stored_natural_keys(cls, rows, chunk_size=500):
+        """
+        Returns the natural keys of rows that are already stored
+
+        Args:
+            rows (list): dictionaries of column values
+
+        Returns:
+            a set of (user_id, product_id, recommendation_type) tuples
+        """
+        keys = list({tuple(row[key] for key in cls.NATURAL_KEY) for row in rows})
+        columns = [getattr(cls, key) for key in cls.NATURAL_KEY]
+        stored = set()
+        for start in range(0, len(keys), chunk_size):
+            stored.update(
+                tuple(row)
+                for row in db.session.execute(
+                    select(*columns).where(tuple_(*columns).in_(keys[start:start + chunk_size]))
+                ).all()
+            )
+        return stored
+
+    @classmethod
+    def upsert(cls, rows):
+        """
+        Inserts rows or updates the existing ones sharing their natural key
+
+        Runs a single INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and
+        SQLite, other databases lock and read the stored rows first. The
+        rating and create_date of existing rows are preserved. The caller
+        is responsible for committing.
+
+        Args:
+            rows (list): dictionaries of column values
+
+        Returns:
+            the inserted or updated Recommendations
+        """
+        # a statement may only touch a row once, so the last duplicate wins
+        rows = list({tuple(row[key] for key in cls.NATURAL_KEY): row for row in rows}.values())
+        if not rows:
+            return []
+        logger.info("Upserting %d recommendations", len(rows))
+        dialect = db.session.connection().dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(cls)
+        elif dialect == "sqlite":
+            statement = sqlite.insert(cls)
+        else:
+            return cls._upsert_rows(rows)
+        statement = statement.values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(cls.NATURAL_KEY),
+            set_={
+                "bought_in_last_30_days": statement.excluded.bought_in_last_30_days,
+                "update_date": statement.excluded.update_date,
+            },
+        ).returning(cls)
+        recommendations = db.session.scalars(
+            statement, execution_options={"populate_existing": True, **RECORDED}
+        ).all()
+        record_changes(
+            ids=[recommendation.id for recommendation in recommendations],
+            user_ids=[recommendation.user_id for recommendation in recommendations],
+        )
+        return recommendations
+
+    @classmethod
+    def _upsert_rows(cls, rows):
+        """Upserts by locking and reading the stored rows, for databases without ON CONFLICT"""
+        columns = [getattr(cls, key) for key in cls.NATURAL_KEY]
+        keys = [tuple(row[key] for key in cls.NATURAL_KEY) for row in rows]
+        stored = {
+            tuple(getattr(recommendation, key) for key in cls.NATURAL_KEY): recommendation
+            for recommendation in db.session.scalars(
+                select(cls).where(tuple_(*columns).in_(keys)).with_for_update()
+            ).all()
+        }
+        recommendations = []
+        for key, row in zip(keys, rows):
+            recommendation = stored.get(key)
+            if recommendation is None:
+                recommendation = cls(**row)
+                db.session.add(recommendation)
+            else:
+                recommendation.bought_in_last_30_days = row["bought_in_last_30_days"]
+                recommendation.update_date = row["update_date"]
+            recommendations.append(recommendation)
+        db.session.flush()
+        return recommendations
+
+    @classmethod
+    def patch(cls, by_id, values):
+        """
+        Writes only the given columns of one Recommendation with a single UPDATE
+
+        The caller is responsible for committing.
+
+        Args:
+            by_id (int): the id of the Recommendation
+            values (dict): validated column values
+
+        Returns:
+            the updated Recommendation, or None when it does not exist
+        """
+        logger.info("Patching %s with %s", by_id, sorted(values))
+        user_ids = []
+        if "user_id" in values:
+            # the list of the previous user changes too
+            user_ids = db.session.scalars(select(cls.user_id).where(cls.id == by_id).with_for_update()).all()
+        statement = update(cls).where(cls.id == by_id).values(update_date=date.today(), **values).returning(cls)
+        try:
+            recommendation = db.session.scalars(
+                statement, execution_options={"synchronize_session": "fetch", **RECORDED}
+            ).one_or_none()
+        except IntegrityError as error:
+            db.session.rollback()
+            raise _constraint_error(error) from error
+        if recommendation is not None:
+            record_changes(ids=[by_id], user_ids=user_ids + [recommendation.user_id])
+        return recommendation
+
+    @classmethod
+    def patch_many(cls, patches, chunk_size=500):
+        """
+        Applies partial updates to many rows with one UPDATE ... FROM (VALUES ...) per chunk
+
+        The rows are locked and read first, so the columns a patch leaves
+        out keep their value, and patches moving a row onto the natural
+        key of another row are refused. The caller is responsible for
+        committing.
+
+        Args:
+            patches (dict): validated BULK_PATCHABLE values keyed by id
+
+        Returns:
+            (updated, conflicts): the updated Recommendations keyed by id
+            and the ids refused because of the natural key, the other
+            ids do not exist
+        """
+        table = cls.__table__
+        ids = sorted(patches)
+        current = {}
+        for start in range(0, len(ids), chunk_size):
+            statement = select(table).where(table.c.id.in_(ids[start:start + chunk_size])).with_for_update()
+            current.update((row["id"], row) for row in db.session.execute(statement).mappings().all())
+        targets = {by_id: {**row, **patches[by_id]} for by_id, row in current.items()}
+        conflicts = cls._natural_key_conflicts(current, targets)
+        rows = [
+            (by_id, target["recommendation_type"], target["bought_in_last_30_days"])
+            for by_id, target in targets.items()
+            if by_id not in conflicts
+        ]
+        logger.info("Patching %d recommendations", len(rows))
+        record_changes(ids=[row[0] for row in rows], user_ids=[targets[row[0]]["user_id"] for row in rows])
+        return cls._apply_patches(rows, chunk_size), conflicts
+
+    @classmethod
+    def _apply_patches(cls, rows, chunk_size):
+        """Writes the (id, recommendation_type, bought_in_last_30_days) rows, returning them by id"""
+        dialect = db.session.connection().dialect.name
+        updated = {}
+        try:
+            for start in range(0, len(rows), chunk_size):
+                patch = cls._patch_source(rows[start:start + chunk_size], dialect)
+                statement = (
+                    update(cls)
+                    .where(cls.id == patch.c.id)
+                    .values(
+                        # PostgreSQL types the strings of a VALUES list as text
+                        recommendation_type=cast(patch.c.recommendation_type, cls.recommendation_type.type),
+                        bought_in_last_30_days=patch.c.bought_in_last_30_days,
+                        update_date=date.today(),
+                    )
+                    .returning(cls)
+                )
+                options = {"synchronize_session": "fetch", **RECORDED}
+                recommendations = db.session.scalars(statement, execution_options=options).all()
+                updated.update((recommendation.id, recommendation) for recommendation in recommendations)
+        except IntegrityError as error:
+            # a row inserted by a concurrent transaction took a target key after the check
+            db.session.rollback()
+            raise _constraint_error(error) from error
+        return updated
+
+    @classmethod
+    def _natural_key_conflicts(cls, current, targets):
+        """
+        Returns the moved ids whose target natural key is held by another row
+
+        The UPDATE checks the unique index row by row, so a key is held as
+        long as its current row has it, even when that row moves away in the
+        same batch: such chains and swaps are refused like any other conflict.
+        """
+        moved = {
+            by_id for by_id, target in targets.items()
+            if target["recommendation_type"] != current[by_id]["recommendation_type"]
+        }
+        if not moved:
+            return set()
+        table = cls.__table__
+        statement = select(table.c.id, table.c.user_id, table.c.product_id, table.c.recommendation_type).where(
+            table.c.user_id.in_({targets[by_id]["user_id"] for by_id in moved}),
+            table.c.product_id.in_({targets[by_id]["product_id"] for by_id in moved}),
+        )
+        holders = {}
+        for row in db.session.execute(statement).mappings().all():
+            holders.setdefault(tuple(row[key] for key in cls.NATURAL_KEY), set()).add(row["id"])
+        movers = {}
+        for by_id in moved:
+            movers.setdefault(tuple(targets[by_id][key] for key in cls.NATURAL_KEY), []).append(by_id)
+        return {
+            by_id for key, ids in movers.items() for by_id in ids
+            if len(ids) > 1 or holders.get(key, set()) - {by_id}
+        }
+
+    @classmethod
+    def _patch_source(cls, rows, dialect):
+        """Returns the (id, recommendation_type, bought_in_last_30_days) rows as a table named patch"""
+        type_ = cls.__table__.c.recommendation_type.type
+        if dialect == "sqlite":
+            # SQLite cannot name the columns of a VALUES list
+            return union_all(*[
+                select(
+                    literal(by_id, Integer).label("id"),
+                    literal(recommendation_type, type_).label("recommendation_type"),
+                    literal(bought, Boolean).label("bought_in_last_30_days"),
+                )
+                for by_id, recommendation_type, bought in rows
+            ]).subquery("patch")
+        return values_clause(
+            column("id", Integer), column("recommendation_type", type_), column("bought_in_last_30_days", Boolean),
+            name="patch",
+        ).data(rows)
+
+    @classmethod
+    def delete_duplicates(cls, batch_size=1000):
+        """
+        Deletes one batch of rows sharing a natural key with a newer row
+
+        The row with the highest id of each natural key is kept.
+
+        Returns:
+            the number of rows deleted
+        """
+        newer = aliased(cls)
+        rows = db.session.execute(
+            select(cls.id, cls.user_id)
+            .where(
+                select(newer.id)
+                .where(
+                    newer.user_id == cls.user_id,
+                    newer.product_id == cls.product_id,
+                    newer.recommendation_type == cls.recommendation_type,
+                    newer.id > cls.id,
+                )
+                .exists()
+            )
+            .limit(batch_size)
+        ).all()
+        if rows:
+            logger.info("Deleting %d duplicate recommendations", len(rows))
+            cls._delete_rows(rows)
+        return len(rows)
+
+    @classmethod
+    def ensure_natural_key(cls):
+        """Creates the natural key index on tables that predate it"""
+        for index in cls.__table__.indexes:
+            index.create(db.session.connection(), checkfirst=True)
+
     def serialize(self):
         """Serializes a Recommendation into a dictionary"""
         return {
@@ -114,44 +662,12 @@ class Recommendation(db.Model):
         Args:
             data (dict): A dictionary containing the resource data
         """
-        try:
-            check_is_int(data["user_id"], "Invalid type for int [user_id]")
-            self.user_id = data["user_id"]
-            check_is_int(data["product_id"], "Invalid type for int [product_id]")
-            self.product_id = data["product_id"]
-            if isinstance(data["recommendation_type"], str):
-                self.recommendation_type = getattr(
-                    RecommendationType, data["recommendation_type"]
-                )  # create enum from string
-            else:
-                raise DataValidationError(
-                    "Invalid type for string [recommendation_type]: "
-                    + str(type(data["recommendation_type"]))
-                )
-            if isinstance(data["bought_in_last_30_days"], bool):
-                self.bought_in_last_30_days = data["bought_in_last_30_days"]
-            else:
-                raise DataValidationError(
-                    "Invalid type for bool [bought_in_last_30_days]: "
-                    + str(type(data["bought_in_last_30_days"]))
-                )
-            if data.get("rating"):
-                check_is_int(data["rating"], "Invalid type for int [rating]")
-                self.rating = data["rating"]
-
-        except KeyError as error:
-            raise DataValidationError(
-                "Invalid Recommendation: missing " + error.args[0]
-            ) from error
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid Recommendation: body of request contained bad or no data - "
-                "Error message: " + str(error)
-            ) from error
-        except AttributeError as error:
-            raise DataValidationError(
-                "Invalid Recommendation: bad data " + error.args[0]
-            ) from error
+        values = RECOMMENDATION_VALIDATOR.validate(data)
+        if not values.get("rating"):
+            # a missing or zero rating never overwrites the current one
+            values.pop("rating", None)
+        for name, value in values.items():
+            setattr(self, name, value)
         return self
 
     @classmethod
@@ -159,10 +675,24 @@ class Recommendation(db.Model):
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
+        if ":memory:" not in app.config["SQLALCHEMY_DATABASE_URI"]:
+            options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+            options.setdefault("poolclass", TimedQueuePool)
         # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
+        try:
+            cls.ensure_natural_key()
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            # serving without the index beats every pod failing to start
+            logger.warning(
+                "Duplicate recommendations prevent the natural key index (%s), run flask dedupe-recommendations",
+                error.orig,
+            )
 
     @classmethod
     def all(cls):
@@ -170,12 +700,59 @@ class Recommendation(db.Model):
         logger.info("Processing all Recommendations")
         return cls.query.all()
 
+    @classmethod
+    def count(cls, user_id=None) -> int:
+        """Returns the number of Recommendations, or of those of user_id
+
+        Counting the rows of one user only reads the natural key index,
+        whose first column is user_id.
+        """
+        logger.info("Processing count for user_id %s ...", user_id)
+        statement = select(db.func.count()).select_from(cls)
+        if user_id is not None:
+            statement = statement.where(cls.user_id == user_id)
+        return db.session.execute(statement).scalar_one()
+
+    @classmethod
+    def estimated_count(cls):
+        """Returns the row count estimated by the PostgreSQL planner
+
+        The estimate is kept up to date by autovacuum and costs a single
+        catalog lookup. None is returned on other databases and before
+        the table was first analyzed.
+        """
+        if db.session.connection().dialect.name != "postgresql":
+            return None
+        estimate = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": cls.__tablename__},
+        ).scalar()
+        return estimate if estimate is not None and estimate >= 0 else None
+
     @classmethod
     def find(cls, by_id):
         """Finds a Recommendation by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_many(cls, ids):
+        """Finds the Recommendations with the given ids in a single query
+
+        Args:
+            ids (list): the ids of the Recommendations to look up
+
+        Returns:
+            a dictionary of the Recommendations found keyed by id
+        """
+        logger.info("Processing lookup for %d ids ...", len(ids))
+        if not ids:
+            return {}
+        return {
+            recommendation.id: recommendation
+            for recommendation in db.session.scalars(select(cls).where(cls.id.in_(ids))).all()
+        }
+
     @classmethod
     def find_by_user_id(cls, user_id):
         """Returns all Recommendations with the given user id
@@ -185,3 +762,376 @@ class Recommendation(db.Model):
         """
         logger.info("Processing user_id query for %s ...", user_id)
         return cls.query.filter(cls.user_id == user_id)
+
+    @classmethod
+    def find_page(cls, user_id=None, after_id=None, limit=100):
+        """Returns up to limit Recommendations ordered by id, after after_id
+
+        Keyset paging reads each page from the index, however deep it is.
+
+        Args:
+            user_id (int): only return the Recommendations of this user
+            after_id (int): the id of the last Recommendation of the previous page
+            limit (int): the largest number of Recommendations returned
+        """
+        logger.info("Processing page after id %s for user_id %s ...", after_id, user_id)
+        query = cls.query
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def most_active_users(cls, limit):
+        """Returns the user ids whose recommendations changed most recently
+
+        Args:
+            limit (int): the largest number of user ids returned
+        """
+        logger.info("Processing the %d most active users ...", limit)
+        return db.session.scalars(
+            select(cls.user_id)
+            .group_by(cls.user_id)
+            .order_by(db.func.max(cls.update_date).desc(), db.func.count().desc(), cls.user_id)
+            .limit(limit)
+        ).all()
+
+    @classmethod
+    def stream(cls, batch_size=1000, **filters):
+        """Iterates over the Recommendations using a server side cursor
+
+        Rows are fetched batch_size at a time so exports do not hold the
+        whole table in memory.
+
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+            filters: optional user_id, recommendation_type, min_id, max_id
+                and updated_since values used to narrow the export
+        """
+        logger.info("Streaming Recommendations with filters %s", filters)
+        statement = select(cls).order_by(cls.id)
+        if filters.get("user_id") is not None:
+            statement = statement.where(cls.user_id == filters["user_id"])
+        if filters.get("recommendation_type") is not None:
+            statement = statement.where(cls.recommendation_type == filters["recommendation_type"])
+        if filters.get("min_id") is not None:
+            statement = statement.where(cls.id >= filters["min_id"])
+        if filters.get("max_id") is not None:
+            statement = statement.where(cls.id <= filters["max_id"])
+        if filters.get("updated_since") is not None:
+            statement = statement.where(cls.update_date >= filters["updated_since"])
+        statement = statement.execution_options(yield_per=batch_size)
+        return db.session.scalars(statement)
+
+
+class RecommendationArchive(db.Model):
+    """
+    Class that represents an archived Recommendation
+
+    Rows are moved here when they are deleted or pass the retention
+    window so the recommendation table and its indexes stay small.
+    """
+
+    archive_id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    create_date = db.Column(db.Date(), nullable=False)
+    update_date = db.Column(db.Date(), nullable=False)
+    bought_in_last_30_days = db.Column(db.Boolean, nullable=False)
+    rating = db.Column(db.Integer, nullable=False)
+    recommendation_type = db.Column(db.Enum(RecommendationType), nullable=False)
+    archived_date = db.Column(db.Date(), nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f"<RecommendationArchive id=[{self.id}]>"
+
+    @classmethod
+    def find(cls, by_id):
+        """Finds the archived copies of the Recommendation with the given id"""
+        logger.info("Processing archive lookup for id %s ...", by_id)
+        return db.session.scalars(select(cls).where(cls.id == by_id)).all()
+
+
+class CacheInvalidation(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that represents a cache invalidation message
+
+    Databases without LISTEN/NOTIFY carry the messages of the
+    invalidation bus in this table, polled by every worker.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.Float, nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)
+
+    # listeners read the ids above the last one seen, so ids are never reused
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    def __repr__(self):
+        return f"<CacheInvalidation id=[{self.id}]>"
+
+
+class RecommendationChange(db.Model):
+    """
+    Class that represents one entry of the change feed
+
+    Every committed transaction writing Recommendations appends one row
+    per Recommendation it created, updated or deleted, in commit order,
+    so consumers can follow the changes after the last seq they read.
+    A row without a recommendation_id marks a write whose rows are not
+    known: consumers have to read everything again.
+    """
+
+    seq = db.Column(db.Integer, primary_key=True)
+    recommendation_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.Float, nullable=False, index=True)
+
+    # consumers resume after the last seq they read, so seqs are never reused
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # the key of the advisory lock ordering the appends on PostgreSQL
+    LOCK_KEY = 4046
+
+    def __repr__(self):
+        return f"<RecommendationChange seq=[{self.seq}]>"
+
+    @classmethod
+    def append(cls, changes):
+        """Appends the entries of a ChangeSet within the current transaction"""
+        ids = sorted(changes.ids - {None})
+        if not ids and not changes.everything:
+            return
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            # sequence values are taken in commit order while the lock is held
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": cls.LOCK_KEY})
+        # deleted recommendations were moved to the archive in this transaction
+        users = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for model in (RecommendationArchive, Recommendation):
+                users.update(db.session.execute(select(model.id, model.user_id).where(model.id.in_(chunk))).all())
+        now = time.time()
+        rows = [{"recommendation_id": by_id, "user_id": users.get(by_id), "changed_at": now} for by_id in ids]
+        if changes.everything:
+            rows.append({"recommendation_id": None, "user_id": None, "changed_at": now})
+        db.session.execute(insert(cls), rows)
+
+    @classmethod
+    def since(cls, since, limit=100):
+        """
+        Returns the entries after since with the current Recommendations
+
+        Returns:
+            up to limit + 1 (RecommendationChange, Recommendation or None)
+            tuples in seq order, the extra one telling that more follow
+        """
+        logger.info("Processing changes since %s ...", since)
+        return db.session.execute(
+            select(cls, Recommendation)
+            .outerjoin(Recommendation, Recommendation.id == cls.recommendation_id)
+            .where(cls.seq > since)
+            .order_by(cls.seq)
+            .limit(limit + 1)
+        ).all()
+
+    @classmethod
+    def bounds(cls):
+        """Returns the lowest and the highest seq kept, or (None, None)"""
+        return tuple(db.session.execute(select(db.func.min(cls.seq), db.func.max(cls.seq))).one())
+
+    @classmethod
+    def prune(cls, older_than: float, batch_size=1000) -> int:
+        """Deletes one batch of the entries appended before the older_than timestamp
+
+        The newest entry is always kept: its seq is the current cursor.
+        """
+        newest = select(db.func.max(cls.seq)).scalar_subquery()
+        seqs = (
+            select(cls.seq)
+            .where(cls.changed_at < older_than, cls.seq < newest)
+            .order_by(cls.seq)
+            .limit(batch_size)
+        )
+        return db.session.execute(delete(cls).where(cls.seq.in_(seqs.scalar_subquery()))).rowcount
+
+
+class OutboxEvent(db.Model):
+    """
+    Class that represents an event waiting to be published
+
+    Every committed transaction writing Recommendations stores one event
+    per Recommendation it wrote, in the same transaction, so an event is
+    stored if and only if its change committed. flask dispatch-events
+    sends them to downstream systems and deletes them once delivered.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(64), nullable=False)
+    recommendation_id = db.Column(db.Integer, nullable=True)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+
+    # consumers dedupe redelivered events on their id, so ids are never reused
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    UPSERTED = "recommendation.upserted"
+    DELETED = "recommendation.deleted"
+    # a write whose rows are not known, consumers read everything again
+    RESET = "recommendations.reset"
+
+    def __repr__(self):
+        return f"<OutboxEvent id=[{self.id}]>"
+
+    def to_dict(self) -> dict:
+        """Returns the event as it is published"""
+        return {
+            "event_id": self.id,
+            "type": self.event_type,
+            "recommendation_id": self.recommendation_id,
+            "occurred_at": self.created_at,
+            "data": json.loads(self.payload),
+        }
+
+    @classmethod
+    def append(cls, changes):
+        """Stores the events of a ChangeSet within the current transaction"""
+        ids = sorted(changes.ids - {None})
+        if not ids and not changes.everything:
+            return
+        current, deleted = {}, {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            # bulk UPDATEs leave the loaded instances stale
+            current.update(
+                (recommendation.id, recommendation.serialize())
+                for recommendation in db.session.scalars(
+                    select(Recommendation).where(Recommendation.id.in_(chunk)).execution_options(populate_existing=True)
+                ).all()
+            )
+            deleted.update(
+                db.session.execute(
+                    select(RecommendationArchive.id, RecommendationArchive.user_id).where(RecommendationArchive.id.in_(chunk))
+                ).all()
+            )
+        now = time.time()
+        rows = []
+        for by_id in ids:
+            if by_id in current:
+                rows.append({"event_type": cls.UPSERTED, "recommendation_id": by_id, "payload": current[by_id]})
+            else:
+                data = {"id": by_id, "user_id": deleted.get(by_id)}
+                rows.append({"event_type": cls.DELETED, "recommendation_id": by_id, "payload": data})
+        if changes.everything:
+            rows.append({"event_type": cls.RESET, "recommendation_id": None, "payload": {}})
+        for row in rows:
+            row["payload"] = json.dumps(row["payload"], separators=(",", ":"))
+            row["created_at"] = now
+        db.session.execute(insert(cls), rows)
+
+    @classmethod
+    def claim(cls, limit: int):
+        """
+        Returns the oldest events, locked until the transaction ends
+
+        Events locked by another dispatcher are skipped on PostgreSQL, so
+        several dispatchers send different batches.
+        """
+        return db.session.scalars(
+            select(cls).order_by(cls.id).limit(limit).with_for_update(skip_locked=True)
+        ).all()
+
+    @classmethod
+    def remove(cls, ids):
+        """Deletes the delivered events with the given ids"""
+        db.session.execute(delete(cls).where(cls.id.in_(list(ids))))
+
+
+######################################################################
+# Session events publishing the changes of committed transactions
+######################################################################
+@event.listens_for(RoutingSession, "after_flush")
+def _track_flushed(session, _context):
+    """Records the Recommendations added, changed or deleted by a flush"""
+    changes = session.info.setdefault("changes", ChangeSet())
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Recommendation):
+            changes.ids.add(instance.id)
+            changes.user_ids.add(instance.user_id)
+            # a recommendation moved to another user also changes the old one
+            changes.user_ids.update(inspect(instance).attrs.user_id.history.deleted or ())
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _track_statements(state):
+    """Records writes to the recommendation table not recorded explicitly"""
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    if state.execution_options.get("changes_recorded"):
+        return
+    table = getattr(state.statement, "table", None)
+    if getattr(table, "name", None) == Recommendation.__tablename__:
+        state.session.info.setdefault("changes", ChangeSet()).everything = True
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _append_change_feed(session):
+    """Appends the changes of the committing transaction to the change feed"""
+    app = Recommendation.app
+    if app is None or not app.config.get("CHANGE_FEED"):
+        return
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    changes = session.info.get("changes")
+    if changes:
+        RecommendationChange.append(changes)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _store_outbox_events(session):
+    """Stores the events of the committing transaction in the outbox"""
+    app = Recommendation.app
+    if app is None or not app.config.get("OUTBOX"):
+        return
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    changes = session.info.get("changes")
+    if changes:
+        OutboxEvent.append(changes)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _notify_commit_listeners(session):
+    """Hands the changes of the committing transaction to COMMIT_LISTENERS"""
+    if not COMMIT_LISTENERS:
+        return
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    changes = session.info.get("changes")
+    if changes:
+        connection = session.connection()
+        for listener in COMMIT_LISTENERS:
+            listener(changes, connection)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _publish_changes(session):
+    """Hands the changes of the committed transaction to CHANGE_LISTENERS"""
+    changes = session.info.pop("changes", None)
+    if not changes:
+        return
+    for listener in CHANGE_LISTENERS:
+        try:
+            listener(changes)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Change listener %s failed", listener)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _discard_changes(session, _previous_transaction):
+    """Forgets the changes of a rolled back transaction"""
+    session.info.pop("changes", None)
@@ -4,17 +4,36 @@ Recommendations Service with Swagger
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
-GET /recommendations - Returns a list all of the recommendations
+GET /health - Liveness, always OK while the process runs
+GET /ready - Readiness, OK once the worker has warmed up
+GET /recommendations - Returns a list all of the recommendations, or one page of it
+HEAD /recommendations - Returns the number of recommendations in X-Total-Count
 GET /recommendations/{recommendation_id} - Returns the recommendations with a given id number
 POST /recommendations - creates a new recommendation record in the database
 PUT /recommendations/{id} - updates a recommendation record in the database
+PATCH /recommendations/{id} - changes some of the fields of a recommendation
 DELETE /recommendations/{id} - deletes a recommendation record in the database
+PATCH /recommendations - changes the type or purchase flag of many recommendations at once
+PUT /recommendations/upsert - creates or updates a list of recommendations by natural key
+POST /recommendations/batch-get - returns the recommendations with the given ids
+GET /recommendations/changes - returns the changes committed after a cursor
+GET /recommendations/ranked - returns the recommendations of a user, best first
+GET /debug/traces - Returns the most recent request traces of this worker
 """
 from datetime import date
-from flask import abort
+from flask import abort, request, url_for
 from flask_restx import Resource, fields, reqparse
 from service.common import status  # HTTP Status Codes
-from service.models import Recommendation, RecommendationType
+from service.common.admission import no_admission
+from service.common.compression import no_compression
+from service.common.metrics import metrics
+from service.common.replicas import primary, read_only
+from service.common.singleflight import coalesce
+from service.common.tracing import span, traced
+from service.common.bulk_io import validate_records
+from service.models import (
+    RECOMMENDATION_VALIDATOR, Recommendation, RecommendationChange, RecommendationType, DataValidationError, db,
+)
 
 # from service.common import error_handlers
 
@@ -26,11 +45,54 @@ from . import app, api
 # Health Endpoint
 ############################################################
 @app.route("/health")
+@no_compression
+@no_admission
 def health():
     """Health Status"""
     return {"status": 'OK'}, status.HTTP_200_OK
 
 
+############################################################
+# Readiness Endpoint
+############################################################
+@app.route("/ready")
+@no_compression
+@no_admission
+def ready():
+    """Readiness Status, OK once the worker has warmed up"""
+    warm_up = app.extensions.get("warmup")
+    if warm_up is not None and not warm_up.ready.is_set():
+        return {"status": "warming up"}, status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready"}, status.HTTP_200_OK
+
+
+############################################################
+# Metrics Endpoint
+############################################################
+@app.route("/metrics")
+@no_admission
+def get_metrics():
+    """Counters, gauges and timers of this worker"""
+    return metrics.snapshot(), status.HTTP_200_OK
+
+
+############################################################
+# Traces Endpoint
+############################################################
+@app.route("/debug/traces")
+@no_admission
+def get_traces():
+    """The most recent sampled request traces of this worker, newest first"""
+    if not app.config.get("TRACE_ENDPOINT"):
+        abort(status.HTTP_404_NOT_FOUND)
+    maximum = app.config["TRACE_BUFFER_SIZE"]
+    limit = request.args.get("limit", str(min(20, maximum)))
+    if not limit.isdigit() or not 1 <= int(limit) <= maximum:
+        abort(status.HTTP_400_BAD_REQUEST, f"limit must be an integer between 1 and {maximum}.")
+    trace_id = request.args.get("trace_id")
+    return {"traces": app.extensions["tracer"].recent(trace_id, int(limit))}, status.HTTP_200_OK
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -39,6 +101,9 @@ def index():
     """
     Base URL for our service
     """
+    built = app.extensions.get("assets")
+    if built is not None:
+        return built.send("dist/index.html")
     return app.send_static_file("index.html")
 # Define the model so that the docs reflect what can be sent
 
@@ -90,11 +155,148 @@ recommendation_model = api.inherit(
     },
 )
 
+batch_get_model = api.model(
+    "BatchGetModel",
+    {
+        "ids": fields.List(
+            fields.Integer,
+            required=True,
+            description="The ids of the recommendations to return",
+        ),
+    }
+)
+
+batch_get_result_model = api.model(
+    "BatchGetResultModel",
+    {
+        "recommendations": fields.List(
+            fields.Nested(recommendation_model),
+            description="The recommendations found, in the order they were requested",
+        ),
+        "missing": fields.List(
+            fields.Integer,
+            description="The requested ids that were not found",
+        ),
+    }
+)
+
+patch_model = api.model(
+    "RecommendationPatchModel",
+    {
+        "user_id": fields.Integer(description="The user_id"),
+        "product_id": fields.Integer(description="The product_id"),
+        "bought_in_last_30_days": fields.Boolean(description="Has the user bought the product in the last 30 days?"),
+        "recommendation_type": fields.String(
+            # pylint: disable=protected-access
+            enum=RecommendationType._member_names_,
+            description="UPSELL, CROSS_SELL, TRENDING, FREQUENTLY_BOUGHT_TOGETHER, RECOMMENDED_FOR_YOU, UNKNOWN",
+        ),
+    }
+)
+
+patch_item_model = api.model(
+    "PatchItemModel",
+    {
+        "id": fields.Integer(required=True, description="The id of the recommendation to change"),
+        "changes": fields.Raw(
+            required=True,
+            description="The new values of any of: " + ", ".join(Recommendation.BULK_PATCHABLE),
+            example={"recommendation_type": "UPSELL", "bought_in_last_30_days": True},
+        ),
+    }
+)
+
+patch_result_model = api.model(
+    "PatchResultModel",
+    {
+        "id": fields.Integer(description="The id of the patch, null when it was not an integer"),
+        "status": fields.String(
+            enum=["updated", "not_found", "conflict", "invalid"],
+            description="conflict when another recommendation has the same user, product and type",
+        ),
+        "errors": fields.List(fields.String, description="Why the patch was invalid"),
+        "recommendation": fields.Nested(
+            recommendation_model, allow_null=True, description="The recommendation, once updated"
+        ),
+    }
+)
+
+patch_results_model = api.model(
+    "PatchResultsModel",
+    {
+        "results": fields.List(fields.Nested(patch_result_model), description="The outcomes, in the order of the patches"),
+    }
+)
+
+change_model = api.model(
+    "ChangeModel",
+    {
+        "seq": fields.Integer(description="The position of the change in the feed"),
+        "op": fields.String(
+            enum=["upsert", "delete", "reset"],
+            description="upsert and delete of one recommendation, or reset when everything must be read again",
+        ),
+        "id": fields.Integer(description="The id of the recommendation changed"),
+        "user_id": fields.Integer(description="The user_id of the recommendation changed"),
+        "recommendation": fields.Nested(
+            recommendation_model, allow_null=True, description="The current recommendation, for upserts"
+        ),
+    }
+)
+
+change_feed_model = api.model(
+    "ChangeFeedModel",
+    {
+        "changes": fields.List(fields.Nested(change_model), description="The changes, oldest first"),
+        "next": fields.Integer(description="The cursor to send as since to read the following changes"),
+        "more": fields.Boolean(description="Whether more changes follow"),
+    }
+)
+
+change_args = reqparse.RequestParser()
+change_args.add_argument(
+    "since", type=int, location="args", required=False,
+    help="The next cursor of the last page read, the current cursor is returned without it",
+)
+change_args.add_argument(
+    "limit", type=int, location="args", required=False, help="The largest number of changes returned"
+)
+
+ranked_model = api.inherit(
+    "RankedRecommendationModel",
+    recommendation_model,
+    {
+        "score": fields.Float(description="The score given by the scoring pipeline, higher first"),
+    },
+)
+
+ranked_args = reqparse.RequestParser()
+ranked_args.add_argument(
+    "user_id", type=int, location="args", required=True, help="Rank the Recommendations of the user_id"
+)
+ranked_args.add_argument(
+    "limit", type=int, location="args", required=False, help="Return only the limit best Recommendations"
+)
+
 # query string arguments
 recommendation_args = reqparse.RequestParser()
 recommendation_args.add_argument(
     "user_id", type=int, location="args", required=False, help="List Recommendations for the user_id"
 )
+recommendation_args.add_argument(
+    "count",
+    type=str,
+    location="args",
+    required=False,
+    choices=("true", "false", "exact"),
+    help="Return the total count in X-Total-Count, estimated for large tables unless exact",
+)
+recommendation_args.add_argument(
+    "limit", type=int, location="args", required=False, help="Return one page of at most limit Recommendations"
+)
+recommendation_args.add_argument(
+    "after_id", type=int, location="args", required=False, help="Return the page after the Recommendation with this id"
+)
 
 
 ######################################################################
@@ -109,6 +311,7 @@ class RecommendationResource(Resource):
     Allows the manipulation of a single Recommendation
     GET /recommendation{id} - Returns a recommendation with the id
     PUT /recommendation{id} - Update a recommendation with the id
+    PATCH /recommendation{id} - Change some fields of a recommendation with the id
     DELETE /recommendation{id} -  Deletes a recommendation with the id
     """
 
@@ -117,22 +320,25 @@ class RecommendationResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("get_recommendations")
     @api.response(404, "Recommendation not found")
+    @traced("marshal")
     @api.marshal_with(recommendation_model)
+    @traced("handler")
+    @read_only
     def get(self, recommendation_id):
         """
         Retrieve a single recommendation
         This endpoint will return a recommendation based on its id
         """
         app.logger.info("Request for recommendation with id: %s", recommendation_id)
-        recommendation = Recommendation.find(recommendation_id)
-        if not recommendation:
+        result = coalesce(app, "get", recommendation_id, lambda: _find_serialized(recommendation_id))
+        if not result:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"recommendation with id '{recommendation_id}' was not found.",
             )
 
-        app.logger.info("Returning recommendation: %s", recommendation.user_id)
-        return recommendation.serialize(), status.HTTP_200_OK
+        app.logger.info("Returning recommendation: %s", result["user_id"])
+        return result, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING RECOMMENDATION
@@ -141,7 +347,9 @@ class RecommendationResource(Resource):
     @api.response(404, "Recommendation not found")
     @api.response(400, "The posted recommendation data was not valid")
     @api.expect(create_model)
+    @traced("marshal")
     @api.marshal_with(recommendation_model)
+    @traced("handler")
     def put(self, recommendation_id):
         """
         Update a Recommendation
@@ -157,29 +365,66 @@ class RecommendationResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"recommendation with id '{recommendation_id}' was not found.",
             )
-        # Get the original create date, so that it doesn't get updated
-        create_date = recommendation.serialize()["create_date"]
-
-        # Get the original rating, so that it doesn't get updated
-        rating_original = recommendation.serialize()["rating"]
+        # the rating is only changed through PUT /recommendations/{id}/rating
+        rating = recommendation.rating
 
         # Deserialize the incoming payload into the recommendation
         data = api.payload
-        recommendation.deserialize(data)
+        with span("validate"):
+            recommendation.deserialize(data)
 
-        recommendation.id = recommendation_id
-        recommendation.rating = rating_original
+        recommendation.rating = rating
         recommendation.update_date = date.today()
-        recommendation.create_date = create_date
         recommendation.update()
         app.logger.info("Recommendation with ID [%s] updated.", recommendation.id)
         return recommendation.serialize(), status.HTTP_200_OK
 
+    # ------------------------------------------------------------------
+    # CHANGE SOME FIELDS OF A RECOMMENDATION
+    # ------------------------------------------------------------------
+    @api.doc("patch_recommendation")
+    @api.response(404, "Recommendation not found")
+    @api.response(400, "The patch was not valid")
+    @api.response(409, "Another recommendation has the same user, product and type")
+    @api.expect(patch_model)
+    @traced("marshal")
+    @api.marshal_with(recommendation_model)
+    @traced("handler")
+    def patch(self, recommendation_id):
+        """
+        Change some fields of a Recommendation
+        Only the fields in the body are validated and written
+        """
+        app.logger.info("Request to patch recommendation with id: %s", recommendation_id)
+        data = api.payload
+        with span("validate"):
+            if not isinstance(data, dict) or not data:
+                raise DataValidationError("Invalid Recommendation: the patch must change at least one field")
+            if "rating" in data:
+                raise DataValidationError(
+                    "Invalid Recommendation: the rating is changed through PUT /recommendations/{id}/rating"
+                )
+            values = RECOMMENDATION_VALIDATOR.validate(data, partial=True)
+            if not values:
+                raise DataValidationError("Invalid Recommendation: the patch does not change any field")
+        recommendation = Recommendation.patch(recommendation_id, values)
+        if recommendation is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"recommendation with id '{recommendation_id}' was not found.",
+            )
+        with span("serialize"):
+            result = recommendation.serialize()
+        db.session.commit()
+        app.logger.info("Recommendation with ID [%s] patched.", recommendation_id)
+        return result, status.HTTP_200_OK
+
     # ------------------------------------------------------------------
     # DELETE A RECOMMENDATION
     # ------------------------------------------------------------------
     @api.doc("delete_recommendations")
     @api.response(204, "Recommendation deleted")
+    @traced("handler")
     def delete(self, recommendation_id):
         """
         Delete a recommendation
@@ -206,22 +451,40 @@ class RecommendationCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("list_recommendations")
     @api.expect(recommendation_args, validate=True)
+    @traced("marshal")
     @api.marshal_list_with(recommendation_model)
+    @traced("handler")
+    @read_only
     def get(self):
         """Returns all of the Recommendations"""
         app.logger.info("Request for recommendation list")
-        recommendations = []
-
         args = recommendation_args.parse_args()
-
-        if args["user_id"]:
-            recommendations = Recommendation.find_by_user_id(args["user_id"])
+        user_id = args["user_id"] or None
+        headers = {}
+        if args["limit"] is None and args["after_id"] is None:
+            results = list_results(user_id)
         else:
-            recommendations = Recommendation.all()
-
-        results = [recommendation.serialize() for recommendation in recommendations]
+            results, more = _page_results(user_id, args["after_id"], args["limit"])
+            if more:
+                headers["Link"] = _next_link(args, results[-1]["id"])
+        if args["count"] in ("true", "exact"):
+            headers.update(_count_headers(user_id, args["count"] == "exact"))
         app.logger.info("Returning %d recommendations", len(results))
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
+
+    # ------------------------------------------------------------------
+    # COUNT RECOMMENDATIONS
+    # ------------------------------------------------------------------
+    @api.doc("count_recommendations")
+    @api.expect(recommendation_args, validate=True)
+    @traced("handler")
+    @read_only
+    def head(self):
+        """Returns the number of Recommendations in X-Total-Count"""
+        app.logger.info("Request for recommendation count")
+        args = recommendation_args.parse_args()
+        headers = _count_headers(args["user_id"] or None, args["count"] == "exact")
+        return "", status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # ADD A NEW RECOMMENDATION
@@ -229,7 +492,9 @@ class RecommendationCollection(Resource):
     @api.doc("create_recommendations")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_model)
+    @traced("marshal")
     @api.marshal_with(recommendation_model, code=201)
+    @traced("handler")
     def post(self):
         """
         Creates a Recommendation
@@ -239,7 +504,8 @@ class RecommendationCollection(Resource):
         # check_content_type("application/json")
         recommendation = Recommendation()
         app.logger.debug("Payload = %s", api.payload)
-        recommendation.deserialize(api.payload)
+        with span("validate"):
+            recommendation.deserialize(api.payload)
         recommendation.create_date = date.today()
         recommendation.create()
         location_url = api.url_for(
@@ -249,6 +515,218 @@ class RecommendationCollection(Resource):
         app.logger.info("Recommendation with ID [%s] created.", recommendation.id)
         return recommendation.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
+    # ------------------------------------------------------------------
+    # CHANGE MANY RECOMMENDATIONS
+    # ------------------------------------------------------------------
+    @api.doc("patch_recommendations")
+    @api.response(400, "The body was not a list of patches")
+    @api.response(409, "A concurrent write took the natural key of a patched recommendation")
+    @api.expect([patch_item_model])
+    @traced("marshal")
+    @api.marshal_with(patch_results_model)
+    @traced("handler")
+    def patch(self):
+        """
+        Changes many Recommendations
+        Each patch sets the recommendation_type or bought_in_last_30_days of one
+        recommendation; all of them are applied in one transaction and the
+        outcome of each one is returned
+        """
+        data = api.payload
+        if not isinstance(data, list):
+            abort(status.HTTP_400_BAD_REQUEST, "The body must be a list of patches.")
+        if len(data) > app.config["MAX_BATCH_SIZE"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"At most {app.config['MAX_BATCH_SIZE']} recommendations can be patched at once.",
+            )
+        app.logger.info("Request to patch %d recommendations", len(data))
+        with span("validate"):
+            patches, items = _validate_patches(data)
+        updated, conflicts = Recommendation.patch_many(patches)
+        db.session.commit()
+        with span("serialize"):
+            results = [_patch_result(by_id, errors, updated, conflicts) for by_id, errors in items]
+        app.logger.info("Patched %d recommendations", len(updated))
+        return {"results": results}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /recommendations/upsert
+######################################################################
+
+
+@api.route("/recommendations/upsert")
+class UpsertResource(Resource):
+    """Idempotent writes of Recommendations keyed by user, product and type"""
+
+    @api.doc("upsert_recommendations")
+    @api.response(400, "The posted data was not valid")
+    @api.expect([create_model])
+    @traced("marshal")
+    @api.marshal_list_with(recommendation_model)
+    @traced("handler")
+    def put(self):
+        """
+        Creates or updates a list of Recommendations
+        Recommendations sharing a user_id, product_id and recommendation_type
+        with an existing one update it instead of creating a duplicate
+        """
+        app.logger.info("Request to upsert recommendations")
+        data = api.payload
+        if not isinstance(data, list):
+            data = [data]
+        if len(data) > app.config["MAX_BATCH_SIZE"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"At most {app.config['MAX_BATCH_SIZE']} recommendations can be upserted at once.",
+            )
+        with span("validate"):
+            rows, errors = validate_records(data)
+        if errors:
+            messages = [
+                f"Recommendation [{position}]: {error}"
+                for position, item_errors in errors.items()
+                for error in item_errors
+            ]
+            raise DataValidationError("; ".join(messages), messages)
+
+        recommendations = Recommendation.upsert(rows)
+        with span("serialize"):
+            results = [recommendation.serialize() for recommendation in recommendations]
+        db.session.commit()
+        app.logger.info("Upserted %d recommendations", len(results))
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /recommendations/batch-get
+######################################################################
+
+
+@api.route("/recommendations/batch-get")
+class BatchGetResource(Resource):
+    """Retrieves many Recommendations in one round trip"""
+
+    @api.doc("batch_get_recommendations")
+    @api.response(400, "The ids were not valid")
+    @api.expect(batch_get_model)
+    @traced("marshal")
+    @api.marshal_with(batch_get_result_model)
+    @traced("handler")
+    @read_only
+    def post(self):
+        """
+        Retrieve many recommendations by id
+        This endpoint returns the recommendations in the requested order and
+        lists the ids that were not found
+        """
+        data = api.payload
+        ids = data.get("ids") if isinstance(data, dict) else None
+        if not isinstance(ids, list) or not all(
+            isinstance(by_id, int) and not isinstance(by_id, bool) for by_id in ids
+        ):
+            abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of integers.")
+        ids = list(dict.fromkeys(ids))  # drop repeated ids, keeping the first
+        if len(ids) > app.config["MAX_BATCH_SIZE"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"At most {app.config['MAX_BATCH_SIZE']} ids can be requested at once.",
+            )
+        app.logger.info("Request for %d recommendations", len(ids))
+
+        found = Recommendation.find_many(ids)
+        with span("serialize"):
+            results = {
+                "recommendations": [found[by_id].serialize() for by_id in ids if by_id in found],
+                "missing": [by_id for by_id in ids if by_id not in found],
+            }
+        app.logger.info("Returning %d recommendations", len(results["recommendations"]))
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /recommendations/changes
+######################################################################
+
+
+@api.route("/recommendations/changes")
+class ChangeFeedResource(Resource):
+    """The changes committed to Recommendations, for consumers syncing incrementally"""
+
+    @api.doc("list_recommendation_changes")
+    @api.response(400, "The cursor or limit was not valid")
+    @api.response(410, "The changes after the cursor were pruned, read everything again")
+    @api.expect(change_args, validate=True)
+    @traced("marshal")
+    @api.marshal_with(change_feed_model)
+    @traced("handler")
+    @read_only
+    def get(self):
+        """
+        Returns the changes committed after a cursor
+        Each recommendation created, updated or deleted is returned once
+        per page with its current state; deletes are tombstones
+        """
+        args = change_args.parse_args()
+        since = args["since"]
+        limit = 100 if args["limit"] is None else args["limit"]
+        if not 1 <= limit <= app.config["MAX_PAGE_SIZE"]:
+            abort(status.HTTP_400_BAD_REQUEST, f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}.")
+        oldest, newest = RecommendationChange.bounds()
+        if since is None:
+            # consumers start from the current cursor after a full read
+            return {"changes": [], "next": newest or 0, "more": False}, status.HTTP_200_OK
+        if since < 0:
+            abort(status.HTTP_400_BAD_REQUEST, "since must be a cursor returned by this endpoint.")
+        if oldest is not None and since < oldest - 1:
+            abort(status.HTTP_410_GONE, f"The changes after {since} were pruned, read everything again.")
+        app.logger.info("Request for changes since %s", since)
+
+        rows = RecommendationChange.since(since, limit)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        with span("serialize"):
+            changes = _feed_entries(rows)
+        result = {"changes": changes, "next": rows[-1][0].seq if rows else since, "more": more}
+        app.logger.info("Returning %d changes", len(changes))
+        return result, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /recommendations/ranked
+######################################################################
+
+
+@api.route("/recommendations/ranked")
+class RankedResource(Resource):
+    """The Recommendations of a user ranked by business rules"""
+
+    @api.doc("rank_recommendations")
+    @api.response(400, "The user_id or limit was not valid")
+    @api.expect(ranked_args, validate=True)
+    @traced("marshal")
+    @api.marshal_list_with(ranked_model)
+    @traced("handler")
+    @read_only
+    def get(self):
+        """
+        Returns the Recommendations of a user, best first
+        Recommendations are scored by the SCORING_PIPELINE of the service,
+        e.g. by rating, recency, type and recent purchase
+        """
+        args = ranked_args.parse_args()
+        user_id, limit = args["user_id"], args["limit"]
+        if limit is not None and not 1 <= limit <= app.config["MAX_PAGE_SIZE"]:
+            abort(status.HTTP_400_BAD_REQUEST, f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}.")
+        app.logger.info("Request for the ranked recommendations of user %s", user_id)
+        ranking = app.extensions["ranking_cache"].ranked(user_id, lambda: list_results(user_id))
+        with span("serialize"):
+            results = ranking.top(limit)
+        app.logger.info("Returning %d ranked recommendations", len(results))
+        return results, status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /recommendations/{recommendation_id}/rating
 ######################################################################
@@ -260,10 +738,13 @@ class RatingResource(Resource):
     """Rating actions on a Recommendation"""
 
     @api.doc("rating_recommendations")
+    @api.response(202, "Rating queued (RATING_WRITE_BEHIND mode)")
     @api.response(404, "recommendation not found")
     @api.response(400, "Bad Request. Rating is not given or not valid")
     @api.expect(rate_model)
+    @traced("marshal")
     @api.marshal_with(recommendation_model)
+    @traced("handler")
     def put(self, recommendation_id):
         """
         Rate a Recommendation
@@ -271,9 +752,10 @@ class RatingResource(Resource):
         """
         app.logger.info("Request to update recommendation rating with id: %s", recommendation_id)
 
-        # Get the recommendation from the database
-        recommendation = Recommendation.find(recommendation_id)
-        if not recommendation:
+        # write-behind skips the read, the flush ignores ids that do not exist
+        rating_buffer = app.extensions.get("rating_buffer")
+        recommendation = Recommendation.find(recommendation_id) if rating_buffer is None else None
+        if rating_buffer is None and not recommendation:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Recommendation with id '{recommendation_id}' was not found.",
@@ -283,14 +765,154 @@ class RatingResource(Resource):
         rating = data.get("rating")
 
         # rating = request.get_json().get("rating")
-        if rating is not None and isinstance(rating, int) and 1 <= rating <= 5:
-            recommendation.rating = rating
-            recommendation.update()
-        else:
+        if rating is None or not isinstance(rating, int) or not 1 <= rating <= 5:
             abort(
                 status.HTTP_400_BAD_REQUEST,
                 "Rating must be an integer between 1 and 5 (inclusive).",
             )
 
+        if rating_buffer is not None:
+            # the rating is written by the next flush of the buffer
+            rating_buffer.put(recommendation_id, rating)
+            app.logger.info("Recommendation rating with ID [%s] queued.", recommendation_id)
+            return {"id": recommendation_id, "rating": rating}, status.HTTP_202_ACCEPTED
+
+        recommendation.rating = rating
+        recommendation.update()
         app.logger.info("Recommendation rating with ID [%s] updated.", recommendation.id)
         return recommendation.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def _find_serialized(recommendation_id):
+    """Returns the serialized recommendation with the id, or None"""
+    recommendation = Recommendation.find(recommendation_id)
+    if recommendation is None:
+        return None
+    with span("serialize"):
+        return recommendation.serialize()
+
+
+def list_results(user_id):
+    """Returns the serialized list of user_id from the shared cache or the database"""
+    cache = app.extensions.get("list_cache")
+    if cache is None or user_id is None:
+        return coalesce(app, "list", user_id, lambda: _list_serialized(user_id))
+    results = cache.load(user_id)
+    if results is None:
+        results = coalesce(app, "list", user_id, lambda: cache.fill(user_id, lambda: _primary_list(user_id)))
+    return results
+
+
+def _primary_list(user_id):
+    """Lists user_id from the primary, a replica may still miss the write that invalidated the cache"""
+    with primary():
+        return _list_serialized(user_id)
+
+
+def _count_headers(user_id, exact):
+    """Returns the X-Total-Count headers of the list of user_id"""
+    total, estimated = app.extensions["count_cache"].count(user_id, exact)
+    headers = {"X-Total-Count": str(total)}
+    if estimated:
+        headers["X-Total-Count-Estimated"] = "true"
+    return headers
+
+
+def _page_results(user_id, after_id, limit):
+    """Returns one serialized page of the list of user_id and whether more follow"""
+    limit = app.config["MAX_PAGE_SIZE"] if limit is None else limit
+    if not 1 <= limit <= app.config["MAX_PAGE_SIZE"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}.",
+        )
+    # one more row tells whether there is a next page
+    recommendations = Recommendation.find_page(user_id, after_id, limit + 1)
+    with span("serialize"):
+        results = [recommendation.serialize() for recommendation in recommendations[:limit]]
+    return results, len(recommendations) > limit
+
+
+def _next_link(args, last_id):
+    """Returns the Link header of the page after last_id"""
+    params = {"after_id": last_id, "limit": args["limit"] or app.config["MAX_PAGE_SIZE"]}
+    if args["user_id"]:
+        params["user_id"] = args["user_id"]
+    return f'<{url_for(request.endpoint, _external=True, **params)}>; rel="next"'
+
+
+def _validate_patches(data):
+    """
+    Validates the items of a bulk patch
+
+    Returns:
+        (patches, items): the validated changes keyed by id, the patches
+        of an id repeated in the list being merged in order, and the
+        (id, errors) of every item, errors being None when it is valid
+    """
+    patches, items = {}, []
+    for position, item in enumerate(data):
+        by_id = item.get("id") if isinstance(item, dict) else None
+        if type(by_id) is not int:  # pylint: disable=unidiomatic-typecheck
+            items.append((None, [f"Patch [{position}]: id must be an integer"]))
+            continue
+        changes = item.get("changes")
+        if not isinstance(changes, dict) or not changes:
+            items.append((by_id, ["changes must be an object with at least one field"]))
+            continue
+        values, errors = RECOMMENDATION_VALIDATOR.collect(changes, partial=True)
+        errors = (errors or []) + [
+            f"Field [{name}] cannot be patched in bulk" for name in changes if name not in Recommendation.BULK_PATCHABLE
+        ]
+        if errors:
+            items.append((by_id, errors))
+            continue
+        patches.setdefault(by_id, {}).update(values)
+        items.append((by_id, None))
+    return patches, items
+
+
+def _patch_result(by_id, errors, updated, conflicts):
+    """Returns the outcome of one patch"""
+    if errors:
+        return {"id": by_id, "status": "invalid", "errors": errors}
+    if by_id in updated:
+        return {"id": by_id, "status": "updated", "recommendation": updated[by_id].serialize()}
+    return {"id": by_id, "status": "conflict" if by_id in conflicts else "not_found"}
+
+
+def _feed_entries(rows):
+    """Returns the change feed entries of (change, recommendation) rows
+
+    A recommendation changed several times in the page is only returned
+    at its last change.
+    """
+    last = {change.recommendation_id: change.seq for change, _ in rows}
+    entries = []
+    for change, recommendation in rows:
+        if change.recommendation_id is None:
+            entries.append({"seq": change.seq, "op": "reset"})
+        elif last[change.recommendation_id] == change.seq:
+            entries.append({
+                "seq": change.seq,
+                "op": "delete" if recommendation is None else "upsert",
+                "id": change.recommendation_id,
+                "user_id": change.user_id if recommendation is None else recommendation.user_id,
+                "recommendation": recommendation.serialize() if recommendation is not None else None,
+            })
+    return entries
+
+
+def _list_serialized(user_id):
+    """Returns the serialized recommendations of user_id, or all of them for None"""
+    if user_id is not None:
+        recommendations = Recommendation.find_by_user_id(user_id)
+    else:
+        recommendations = Recommendation.all()
+    with span("serialize"):
+        return [recommendation.serialize() for recommendation in recommendations]
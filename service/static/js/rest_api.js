@@ -183,60 +183,126 @@ $(function () {
     // Search for  Recommendations
     // ****************************************
 
-    $("#search-btn").click(function () {
-
-        let user_id = $("#reco_user_id").val();
+    // Results are requested PAGE_SIZE rows at a time and appended as
+    // they arrive, "Load more" requests the next page
+    const PAGE_SIZE = 100;
+    const SEARCH_DELAY = 200;
+
+    let search = null;       // the search whose rows are shown
+    let searchTimer = null;  // pending debounced search
+
+    // Returns the after_id of the rel="next" link, or null
+    function next_after_id(ajax) {
+        let link = ajax.getResponseHeader("Link") || "";
+        let match = link.match(/[?&]after_id=(\d+)[^>]*>;\s*rel="next"/);
+        return match ? match[1] : null;
+    }
 
-        let queryString = ""
+    // Shows an empty result table with a "Load more" button
+    function reset_results() {
+        $("#search_results").empty();
+        let table = '<table class="table table-striped" cellpadding="10">'
+        table += '<thead><tr>'
+        table += '<th class="col-md-2">ID</th>'
+        table += '<th class="col-md-2">User ID</th>'
+        table += '<th class="col-md-2">Product ID</th>'
+        table += '<th class="col-md-2">Bought in last 30 days</th>'
+        table += '<th class="col-md-2">Rating</th>'
+        table += '<th class="col-md-2">Recommendation Type</th>'
+        table += '</tr></thead><tbody></tbody></table>';
+        table += '<p><span id="search_count"></span> '
+        table += '<button type="button" class="btn btn-default" id="more-btn" style="display: none;">Load more</button></p>'
+        $("#search_results").append(table);
+    }
 
-        if (user_id) {
-            queryString += 'user_id=' + user_id
+    // Appends one page of recommendations to the result table
+    function append_rows(rows) {
+        let body = document.querySelector("#search_results tbody");
+        let fragment = document.createDocumentFragment();
+        for (let recommendation of rows) {
+            let row = document.createElement("tr");
+            row.id = `row_${search.shown++}`;
+            for (let field of ["id", "user_id", "product_id", "bought_in_last_30_days", "rating", "recommendation_type"]) {
+                let cell = document.createElement("td");
+                cell.textContent = recommendation[field];
+                row.appendChild(cell);
+            }
+            fragment.appendChild(row);
         }
+        body.appendChild(fragment);
+    }
 
-        $("#flash_message").empty();
+    // Requests the page of the current search after after_id
+    function load_page(after_id) {
+        let current = search;
+        let params = { limit: PAGE_SIZE };
+        if (current.user_id) {
+            params.user_id = current.user_id;
+        }
+        if (after_id) {
+            params.after_id = after_id;
+        } else {
+            params.count = "true";
+        }
 
-        let ajax = $.ajax({
+        $("#more-btn").prop("disabled", true);
+        current.ajax = $.ajax({
             type: "GET",
-            url: `/api/recommendations?${queryString}`,
+            url: `/api/recommendations?${$.param(params)}`,
             contentType: "application/json",
             data: ''
         })
 
-        ajax.done(function (res) {
-            //alert(res.toSource())
-            $("#search_results").empty();
-            let table = '<table class="table table-striped" cellpadding="10">'
-            table += '<thead><tr>'
-            table += '<th class="col-md-2">ID</th>'
-            table += '<th class="col-md-2">User ID</th>'
-            table += '<th class="col-md-2">Product ID</th>'
-            table += '<th class="col-md-2">Bought in last 30 days</th>'
-            table += '<th class="col-md-2">Rating</th>'
-            table += '<th class="col-md-2">Recommendation Type</th>'
-            table += '</tr></thead><tbody>'
-            let firstRecommendation = "";
-            for (let i = 0; i < res.length; i++) {
-                let recommendation = res[i];
-                table += `<tr id="row_${i}"><td>${recommendation.id}</td><td>${recommendation.user_id}</td><td>${recommendation.product_id}</td><td>${recommendation.bought_in_last_30_days}</td><td>${recommendation.rating}</td><td>${recommendation.recommendation_type}</td></tr>`;
-                if (i == 0) {
-                    firstRecommendation = recommendation;
-                }
+        current.ajax.done(function (res, _status, ajax) {
+            if (current !== search) {
+                return; // a newer search replaced this one
+            }
+            let total = ajax.getResponseHeader("X-Total-Count");
+            if (total !== null) {
+                current.total = parseInt(total);
             }
-            table += '</tbody></table>';
-            $("#search_results").append(table);
-
             // copy the first result to the form
-            if (firstRecommendation != "") {
-                update_form_data(firstRecommendation)
+            if (!after_id && res.length > 0) {
+                update_form_data(res[0])
             }
-
+            append_rows(res);
+            current.after_id = next_after_id(ajax);
+            let shown = current.shown.toLocaleString();
+            $("#search_count").text(current.total === null ? `${shown} shown` : `${shown} of ${current.total.toLocaleString()}`);
+            $("#more-btn").prop("disabled", false).toggle(current.after_id !== null);
             flash_message("Success")
         });
 
-        ajax.fail(function (res) {
-            flash_message(res.responseJSON.message)
+        current.ajax.fail(function (res) {
+            if (current === search && res.statusText !== "abort") {
+                $("#more-btn").prop("disabled", false);
+                flash_message(res.responseJSON.message)
+            }
         });
+    }
+
+    // Starts a new search, dropping the rows and the request of the last one
+    function start_search() {
+        if (search && search.ajax) {
+            search.ajax.abort();
+        }
+        search = { user_id: $("#reco_user_id").val(), shown: 0, total: null, after_id: null, ajax: null };
+        reset_results();
+        load_page(null);
+    }
 
+    $("#search-btn").click(function () {
+        $("#flash_message").empty();
+        $("#search_results").empty();
+        // repeated clicks within SEARCH_DELAY run a single search
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(start_search, SEARCH_DELAY);
+    });
+
+    $("#search_results").on("click", "#more-btn", function () {
+        if (search && search.after_id !== null) {
+            load_page(search.after_id);
+        }
     });
 
     // ****************************************
@@ -0,0 +1,124 @@
+"""
+Test cases for admission control and write rate limits
+"""
+import logging
+from itertools import count
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import admission, status
+from service.common.admission import TokenBucket
+from service.common.metrics import metrics
+from service.models import Recommendation, db
+from tests.factories import RecommendationFactory
+
+BASE_URL = "/api/recommendations"
+
+
+class TestAdmission(TestCase):
+    """Admission Control Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        metrics.reset()
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+        self.client = app.test_client()
+        # distinct products, so created rows never share a natural key
+        self.product_ids = count(1)
+
+    def tearDown(self):
+        """This runs after each test"""
+        admission.init_app(app)
+        db.session.remove()
+
+    def _configure(self, **settings):
+        with patch.dict(app.config, settings):
+            return admission.init_app(app)
+
+    def _create(self, client="a"):
+        recommendation = RecommendationFactory(product_id=next(self.product_ids))
+        return self.client.post(
+            BASE_URL,
+            json={
+                "user_id": recommendation.user_id,
+                "product_id": recommendation.product_id,
+                "recommendation_type": recommendation.recommendation_type.name,
+                "bought_in_last_30_days": recommendation.bought_in_last_30_days,
+            },
+            headers={"X-Client-Id": client},
+        )
+
+    def test_requests_are_released(self):
+        """It should count a request in flight only while it runs"""
+        controller = self._configure(ADMISSION_MAX_IN_FLIGHT=1)
+        for _ in range(3):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_shed_in_flight(self):
+        """It should reject requests beyond the in-flight limit with 503"""
+        controller = self._configure(ADMISSION_MAX_IN_FLIGHT=1, ADMISSION_RETRY_AFTER=2)
+        controller.in_flight = 1  # a request still running
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+        self.assertEqual(controller.in_flight, 1)
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["requests_shed"], 1)
+        self.assertEqual(counters["requests_shed_in_flight"], 1)
+
+    def test_shed_saturated_pool(self):
+        """It should reject requests while the pool is saturated and slow"""
+        self._configure(ADMISSION_POOL_WAIT=0.5)
+        pool = db.engine.pool
+        with patch.object(pool, "wait_time", 1.0):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+            with patch.object(pool, "saturated", return_value=True):
+                response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(metrics.snapshot()["counters"]["requests_shed_pool"], 1)
+
+    def test_throttle_writes(self):
+        """It should limit the writes of each client with a token bucket"""
+        self._configure(WRITE_RATE_LIMIT=0.1, WRITE_BURST=2)
+        self.assertEqual(self._create().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._create().status_code, status.HTTP_201_CREATED)
+        response = self._create()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "10")
+        self.assertEqual(self._create(client="b").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(metrics.snapshot()["counters"]["requests_throttled"], 1)
+
+    def test_reads_are_not_throttled(self):
+        """It should not rate limit reads, including POST batch-get"""
+        self._configure(WRITE_RATE_LIMIT=0.1, WRITE_BURST=1)
+        for _ in range(3):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+            response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": [1]})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_bucket_refills(self):
+        """It should refill the bucket at its rate"""
+        bucket = TokenBucket(rate=10, burst=1)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+        bucket.updated -= 0.1
+        self.assertEqual(bucket.take(), 0)
+
+    def test_client_buckets_are_bounded(self):
+        """It should forget the least recently seen clients"""
+        controller = admission.AdmissionController(write_rate=1, write_burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            controller.admit(client, write=True)
+            controller.release()
+        self.assertEqual(list(controller._buckets), ["b", "c"])  # pylint: disable=protected-access
@@ -0,0 +1,103 @@
+"""
+Test cases for the fingerprinted static assets
+"""
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from service import app
+from service.common import assets, status
+from service.common.cli_commands import build_assets
+
+STATIC = os.path.join(os.path.dirname(__file__), "..", "service", "static")
+
+
+class TestAssets(TestCase):
+    """Static Asset Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.directory = tempfile.mkdtemp()
+        self.static = os.path.join(self.directory, "static")
+        shutil.copytree(STATIC, self.static, ignore=shutil.ignore_patterns(assets.DIST))
+        self.original = app.static_folder
+        app.static_folder = self.static
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.static_folder = self.original
+        assets.init_app(app)
+        shutil.rmtree(self.directory)
+
+    def _build(self):
+        manifest = assets.build(self.static)
+        assets.init_app(app)
+        return manifest
+
+    def test_fingerprint(self):
+        """It should name a file after the hash of its content"""
+        self.assertRegex(assets.fingerprint("js/rest_api.js", b"a"), r"^js/rest_api\.[0-9a-f]{12}\.js$")
+        self.assertNotEqual(assets.fingerprint("x.js", b"a"), assets.fingerprint("x.js", b"b"))
+
+    def test_index_references(self):
+        """It should point index.html at the fingerprinted files"""
+        manifest = self._build()
+        response = self.client.get("/", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        page = response.get_data(as_text=True)
+        self.assertIn(f'src="static/{manifest["files"]["js/rest_api.js"]}"', page)
+        self.assertNotIn('src="static/js/', page)
+
+    def test_immutable_precompressed(self):
+        """It should serve fingerprinted files precompressed and immutable"""
+        hashed = self._build()["files"]["js/rest_api.js"]
+        response = self.client.get(f"/static/{hashed}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn(response.mimetype, ("text/javascript", "application/javascript"))
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        with open(os.path.join(self.static, "js", "rest_api.js"), "rb") as source:
+            self.assertEqual(gzip.decompress(response.data), source.read())
+
+        response = self.client.get(f"/static/{hashed}", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_images_not_compressed(self):
+        """It should serve images as they are"""
+        hashed = self._build()["files"]["images/newapp-icon.png"]
+        response = self.client.get(f"/static/{hashed}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+
+    def test_original_names(self):
+        """It should keep serving the original file names"""
+        self._build()
+        response = self.client.get("/static/js/rest_api.js")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("immutable", response.headers.get("Cache-Control", ""))
+
+    def test_without_build(self):
+        """It should serve the static folder as it is without a build"""
+        self.assertIsNone(assets.init_app(app))
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('src="static/js/rest_api.js"', response.get_data(as_text=True))
+
+    def test_build_command(self):
+        """It should build the assets from the command line"""
+        result = app.test_cli_runner().invoke(build_assets)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Build complete: 9 assets", result.output)
+        self.assertTrue(os.path.exists(os.path.join(self.static, assets.DIST, assets.MANIFEST)))
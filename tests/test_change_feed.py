@@ -0,0 +1,158 @@
+"""
+Test cases for the change feed
+"""
+import logging
+from itertools import count
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import bulk_io, status
+from service.common.cli_commands import prune_changes
+from service.models import Recommendation, RecommendationChange, db
+from tests.factories import RecommendationFactory
+
+CHANGES_URL = "/api/recommendations/changes"
+
+
+class TestChangeFeed(TestCase):
+    """Change Feed Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["CHANGE_FEED"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        app.config["CHANGE_FEED"] = False
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        self.product_ids = count(1)
+        Recommendation.query.delete()
+        db.session.commit()
+        # the untracked delete above appended a reset entry
+        self.cursor = self.client.get(CHANGES_URL).get_json()["next"]
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _recommendation(self, **attributes):
+        """Returns an unsaved Recommendation of a product of its own"""
+        return RecommendationFactory(id=None, product_id=next(self.product_ids), **attributes)
+
+    def _changes(self, since=None, **params):
+        response = self.client.get(CHANGES_URL, query_string={"since": self.cursor if since is None else since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.get_json()
+
+    def test_current_cursor(self):
+        """It should return the current cursor without a since"""
+        self._recommendation().create()
+        feed = self.client.get(CHANGES_URL).get_json()
+        self.assertEqual(feed["changes"], [])
+        self.assertEqual(feed["next"], self.cursor + 1)
+
+    def test_create_update_delete(self):
+        """It should return upserts with the current state and tombstones"""
+        kept = self._recommendation(rating=0)
+        kept.create()
+        gone = self._recommendation()
+        gone.create()
+        kept.rating = 4
+        kept.update()
+        gone.delete()
+        feed = self._changes()
+        self.assertFalse(feed["more"])
+        upsert, tombstone = feed["changes"]
+        # kept changed twice, it is returned once at its last change
+        self.assertEqual((upsert["op"], upsert["id"], upsert["recommendation"]["rating"]), ("upsert", kept.id, 4))
+        self.assertEqual((tombstone["op"], tombstone["id"]), ("delete", gone.id))
+        self.assertEqual(tombstone["user_id"], gone.user_id)
+        self.assertIsNone(tombstone["recommendation"])
+        self.assertEqual(feed["next"], tombstone["seq"])
+        self.assertEqual(self._changes(feed["next"])["changes"], [])
+
+    def test_pages(self):
+        """It should page through the changes in seq order"""
+        created = [self._recommendation() for _ in range(3)]
+        for recommendation in created:
+            recommendation.create()
+        feed = self._changes(limit=2)
+        self.assertTrue(feed["more"])
+        following = self._changes(feed["next"], limit=2)
+        self.assertFalse(following["more"])
+        ids = [change["id"] for change in feed["changes"] + following["changes"]]
+        self.assertEqual(ids, [recommendation.id for recommendation in created])
+
+    def test_bulk_writes(self):
+        """It should record the rows written by bulk statements"""
+        recommendation = self._recommendation()
+        recommendation.create()
+        self.cursor = self._changes()["next"]
+        Recommendation.update_ratings({recommendation.id: 5})
+        db.session.commit()
+        change = self._changes()["changes"][0]
+        self.assertEqual((change["id"], change["recommendation"]["rating"]), (recommendation.id, 5))
+        self.cursor = self._changes()["next"]
+        rows = [bulk_io.validate_record(self._recommendation().serialize()) for _ in range(2)]
+        Recommendation.bulk_create(rows)
+        db.session.commit()
+        changes = self._changes()["changes"]
+        self.assertEqual([change["op"] for change in changes], ["upsert", "upsert"])
+        self.assertEqual(sorted(change["recommendation"]["product_id"] for change in changes),
+                         sorted(row["product_id"] for row in rows))
+
+    def test_untracked_write_resets(self):
+        """It should tell consumers to read everything after an untracked write"""
+        self._recommendation(user_id=5).create()
+        self.cursor = self._changes()["next"]
+        db.session.query(Recommendation).filter(Recommendation.user_id == 5).delete()
+        db.session.commit()
+        self.assertEqual([change["op"] for change in self._changes()["changes"]], ["reset"])
+
+    def test_rollback_appends_nothing(self):
+        """It should not append the changes of a rolled back transaction"""
+        recommendation = self._recommendation()
+        db.session.add(recommendation)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self._changes()["changes"], [])
+
+    def test_disabled(self):
+        """It should not append changes when CHANGE_FEED is off"""
+        with patch.dict(app.config, {"CHANGE_FEED": False}):
+            self._recommendation().create()
+        self.assertEqual(self._changes()["changes"], [])
+
+    def test_bad_arguments(self):
+        """It should reject a negative cursor or a limit out of range"""
+        for params in ({"since": -1}, {"since": 0, "limit": 0}, {"since": "x"}):
+            response = self.client.get(CHANGES_URL, query_string=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pruned_cursor(self):
+        """It should answer 410 Gone once the changes after the cursor were pruned"""
+        for _ in range(2):
+            self._recommendation().create()
+        result = app.test_cli_runner().invoke(prune_changes, ["--older-than", "0"])
+        self.assertIn("Prune complete", result.output)
+        # the newest entry is kept as the current cursor
+        self.assertEqual(RecommendationChange.bounds(), (self.cursor + 2, self.cursor + 2))
+        self._recommendation().create()
+        response = self.client.get(CHANGES_URL, query_string={"since": self.cursor})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(len(self._changes(self.cursor + 1)["changes"]), 2)
+
+    def test_prune_keeps_recent(self):
+        """It should only prune the entries past the retention window"""
+        self._recommendation().create()
+        self.assertEqual(RecommendationChange.prune(time.time() - 3600), 0)
+        self.assertEqual(len(self._changes()["changes"]), 1)
@@ -0,0 +1,102 @@
+"""
+Test cases for response compression
+"""
+import gzip
+import logging
+import zlib
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Response
+from service import app
+from service.common import compression, status
+from service.models import Recommendation, db
+from tests.factories import RecommendationFactory
+
+BASE_URL = "/api/recommendations"
+
+
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """Creates enough recommendations to pass the size threshold"""
+        db.session.execute(db.delete(Recommendation))
+        db.session.add_all(RecommendationFactory(id=None, product_id=product_id) for product_id in range(1, 21))
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def test_gzip(self):
+        """It should gzip large responses when the client accepts it"""
+        plain = self.client.get(BASE_URL)
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+    def test_deflate(self):
+        """It should use deflate when gzip is not accepted"""
+        plain = self.client.get(BASE_URL)
+        with patch.object(compression, "brotli", None):
+            response = self.client.get(BASE_URL, headers={"Accept-Encoding": "deflate, gzip;q=0"})
+        self.assertEqual(response.headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+    def test_no_accept_encoding(self):
+        """It should not compress when the client does not ask for it"""
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(len(response.get_json()), 20)
+
+    def test_small_response(self):
+        """It should not compress responses under the size threshold"""
+        response = self.client.get(BASE_URL, query_string="user_id=1000", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_disabled(self):
+        """It should not compress when compression is disabled"""
+        with patch.dict(app.config, {"COMPRESSION_ENABLED": False}):
+            response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_opt_out(self):
+        """It should not compress routes marked with no_compression"""
+        with patch.dict(app.config, {"COMPRESSION_MIN_SIZE": 0}):
+            response = self.client.get("/health", headers={"Accept-Encoding": "gzip"})
+            self.assertNotIn("Content-Encoding", response.headers)
+            response = self.client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_streamed_str_chunks(self):
+        """It should compress a streamed response whose generator yields str"""
+
+        def generate():
+            yield "ünïcode, "
+            yield "streamed " * 200
+
+        with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = app.process_response(Response(generate(), mimetype="text/plain"))
+            body = b"".join(response.response)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body).decode("utf-8"), "ünïcode, " + "streamed " * 200)
+
+    def test_streamed_static_file(self):
+        """It should compress file responses as a stream and weaken their ETag"""
+        plain = self.client.get("/")
+        response = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertTrue(response.headers["ETag"].startswith("W/"))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
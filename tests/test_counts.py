@@ -0,0 +1,106 @@
+"""
+Test cases for total counts
+"""
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import counts, status
+from service.common.counts import CountCache
+from service.common.metrics import metrics
+from service.models import Recommendation, db
+from tests.factories import RecommendationFactory
+
+BASE_URL = "/api/recommendations"
+
+
+class TestCounts(TestCase):
+    """Total Count Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Recommendation).delete()
+        for product_id, user_id in enumerate((1, 1, 2), start=1):
+            RecommendationFactory(id=None, user_id=user_id, product_id=product_id).create()
+        self.client = app.test_client()
+        counts.init_app(app)
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def test_count_header(self):
+        """It should return X-Total-Count with the list when asked to"""
+        response = self.client.get(BASE_URL, query_string={"count": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+        self.assertNotIn("X-Total-Count-Estimated", response.headers)
+        response = self.client.get(BASE_URL, query_string={"user_id": 1, "count": "exact"})
+        self.assertEqual(response.headers["X-Total-Count"], "2")
+        self.assertNotIn("X-Total-Count", self.client.get(BASE_URL).headers)
+
+    def test_head_counts_only(self):
+        """It should count without returning the list on HEAD"""
+        response = self.client.head(BASE_URL, query_string={"user_id": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+        self.assertEqual(response.data, b"")
+
+    def test_invalid_count(self):
+        """It should reject an unknown count option"""
+        response = self.client.get(BASE_URL, query_string={"count": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_total(self):
+        """It should reuse the total until a write changes it"""
+        for _ in range(3):
+            self.assertEqual(self.client.head(BASE_URL).headers["X-Total-Count"], "3")
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual((counters["total_count_misses"], counters["total_count_hits"]), (1, 2))
+        RecommendationFactory(id=None, product_id=4).create()
+        self.assertEqual(self.client.head(BASE_URL).headers["X-Total-Count"], "4")
+
+    def test_cache_expires(self):
+        """It should count again after COUNT_CACHE_TTL seconds"""
+        cache = CountCache(ttl=0)
+        self.assertEqual(cache.count(), (3, False))
+        self.assertEqual(cache.count(), (3, False))
+        self.assertEqual(metrics.snapshot()["counters"]["total_count_misses"], 2)
+
+    def test_write_during_count(self):
+        """It should not keep a count started before a write"""
+        cache = CountCache(ttl=60)
+        count = Recommendation.count
+
+        def racing_count(user_id=None):
+            result = count(user_id)
+            cache.on_change(None)  # a write commits meanwhile
+            return result
+
+        with patch.object(Recommendation, "count", racing_count):
+            cache.count()
+        self.assertEqual(cache.count(), (3, False))
+        self.assertEqual(metrics.snapshot()["counters"]["total_count_misses"], 2)
+
+    def test_estimate_large_tables(self):
+        """It should return the planner estimate of a large table"""
+        cache = CountCache(estimate_threshold=1000)
+        with patch.object(Recommendation, "estimated_count", return_value=25_000_000):
+            self.assertEqual(cache.count(), (25_000_000, True))
+            self.assertEqual(cache.count(exact=True), (3, False))
+            response = self.client.head(BASE_URL)
+        self.assertEqual(response.headers["X-Total-Count-Estimated"], "true")
+        with patch.object(Recommendation, "estimated_count", return_value=500):
+            self.assertEqual(cache.count(), (3, False))
+
+    def test_no_estimate_on_sqlite(self):
+        """It should only estimate counts on PostgreSQL"""
+        self.assertIsNone(Recommendation.estimated_count())
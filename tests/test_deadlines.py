@@ -0,0 +1,96 @@
+"""
+Test cases for request deadlines
+"""
+import logging
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy import text
+from service import app, routes
+from service.common import deadlines, status
+from service.common.metrics import metrics
+from service.models import db
+
+BASE_URL = "/api/recommendations"
+
+# never ends unless interrupted
+ENDLESS_QUERY = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+
+
+def endless_list(_user_id):
+    """Stands in for a list query much slower than any deadline"""
+    return db.session.execute(text(ENDLESS_QUERY)).scalar()
+
+
+class TestDeadlines(TestCase):
+    """Request Deadline Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        metrics.reset()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def test_interrupts_slow_query(self):
+        """It should interrupt a query running past the deadline with 504"""
+        started = time.monotonic()
+        with patch.object(routes, "_list_serialized", endless_list):
+            response = self.client.get(BASE_URL, headers={"X-Request-Timeout": "0.2"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(metrics.snapshot()["counters"]["deadlines_exceeded"], 1)
+        # the worker is free for the next request
+        self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+
+    def test_no_statement_after_deadline(self):
+        """It should not start a statement once the deadline has passed"""
+        def late_list(user_id):
+            time.sleep(0.05)
+            return routes.Recommendation.find_by_user_id(user_id).all()
+
+        with patch.object(routes, "_list_serialized", late_list):
+            response = self.client.get(BASE_URL, headers={"X-Request-Timeout": "0.01"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def test_invalid_header(self):
+        """It should reject an X-Request-Timeout that is not a positive finite number"""
+        for value in ("soon", "0", "-1", "inf", "nan"):
+            response = self.client.get(BASE_URL, headers={"X-Request-Timeout": value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_parse_timeout(self):
+        """It should default and cap the requested timeout"""
+        self.assertEqual(deadlines.parse_timeout(None, 25, 60), 25)
+        self.assertIsNone(deadlines.parse_timeout(None, 0, 60))
+        self.assertEqual(deadlines.parse_timeout("5", 25, 60), 5)
+        self.assertEqual(deadlines.parse_timeout("600", 25, 60), 60)
+        self.assertEqual(deadlines.parse_timeout("600", 25, 0), 600)
+
+    def test_postgres_statement_timeout(self):
+        """It should bound PostgreSQL transactions by the time left"""
+        connection = MagicMock()
+        connection.dialect.name = "postgresql"
+        with patch.object(deadlines, "remaining", return_value=1.5):
+            deadlines._limit_transaction(None, None, connection)  # pylint: disable=protected-access
+        connection.exec_driver_sql.assert_called_once_with("SET LOCAL statement_timeout = 1500")
+
+    def test_postgres_query_canceled(self):
+        """It should turn a canceled PostgreSQL statement into DeadlineExceeded"""
+        canceled = Exception("canceling statement due to statement timeout")
+        canceled.pgcode = deadlines.QUERY_CANCELED
+        context = MagicMock(original_exception=canceled)
+        with patch.object(deadlines, "remaining", return_value=0.5):
+            with self.assertRaises(deadlines.DeadlineExceeded):
+                deadlines._timeout_error(context)  # pylint: disable=protected-access
+        # errors outside of a request are left alone
+        self.assertIsNone(deadlines._timeout_error(context))  # pylint: disable=protected-access
@@ -0,0 +1,163 @@
+"""
+Test cases for the cache invalidation bus
+"""
+import json
+import logging
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service import app, models
+from service.common import invalidation, shared_cache
+from service.common.invalidation import InvalidationBus, encode
+from service.common.metrics import metrics
+from service.models import CacheInvalidation, ChangeSet, Recommendation, db
+from tests.factories import RecommendationFactory
+from tests.test_singleflight import wait_for
+
+
+def changes_of(user_ids=(), everything=False):
+    """Builds the ChangeSet of a transaction writing user_ids"""
+    changes = ChangeSet()
+    changes.user_ids.update(user_ids)
+    changes.everything = everything
+    return changes
+
+
+class TestInvalidationBus(TestCase):
+    """Cache Invalidation Bus Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        settings = {
+            "LIST_CACHE": True,
+            "LIST_CACHE_PATH": os.path.join(cls.directory.name, "cache"),
+            "INVALIDATION_ORIGIN": "pod-a",
+            "INVALIDATION_POLL_INTERVAL": 0.02,
+        }
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+        cls.settings = patch.dict(app.config, settings)
+        cls.settings.start()
+        shared_cache.init_app(app)
+        cls.bus = invalidation.init_app(app)
+        cls.cache = app.extensions["list_cache"]
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.settings.stop()
+        shared_cache.init_app(app)
+        invalidation.init_app(app, start=False)
+        cls.directory.cleanup()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(CacheInvalidation).delete()
+        db.session.commit()
+        metrics.reset()
+        self.other_pod = InvalidationBus(app, db.engine, "pod-b")
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _fill(self, user_id):
+        self.cache.put(user_id, self.cache.version(user_id), b"[]")
+        self.assertIsNotNone(self.cache.get(user_id))
+
+    def _publish_from_other_pod(self, changes):
+        with db.engine.begin() as connection:
+            self.other_pod.publish(changes, connection)
+
+    def test_encode_chunks(self):
+        """It should split large changes into messages NOTIFY accepts"""
+        changes = changes_of(range(10**9, 10**9 + 700))
+        messages = encode("pod-a", changes)
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(len(message) < 8000 for message in messages))
+        user_ids = [user_id for message in messages for user_id in json.loads(message)["user_ids"]]
+        self.assertEqual(user_ids, sorted(changes.user_ids))
+        self.assertEqual(json.loads(encode("pod-a", changes_of(everything=True))[0])["all"], True)
+
+    def test_commit_publishes(self):
+        """It should publish the users written by a committed transaction"""
+        recommendation = RecommendationFactory(id=None, user_id=77)
+        recommendation.create()
+        message = json.loads(db.session.query(CacheInvalidation).one().payload)
+        self.assertEqual(message["origin"], "pod-a")
+        self.assertEqual(message["user_ids"], [77])
+        self.assertEqual(message["ids"], [recommendation.id])
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+
+    def test_failed_commit_publishes_nothing(self):
+        """It should roll the message back with a transaction that failed to commit"""
+
+        def fail(_changes, _connection):
+            raise RuntimeError("commit failed")
+
+        with patch.object(models, "COMMIT_LISTENERS", models.COMMIT_LISTENERS + [fail]):
+            with self.assertRaises(RuntimeError):
+                RecommendationFactory(id=None, user_id=78).create()
+        db.session.rollback()
+        self.assertEqual(db.session.query(CacheInvalidation).count(), 0)
+        self.assertEqual(db.session.query(Recommendation).filter(Recommendation.user_id == 78).count(), 0)
+
+    def test_other_pod_invalidates(self):
+        """It should evict the users written by another pod"""
+        self._fill(5)
+        self._fill(6)
+        self._publish_from_other_pod(changes_of([5]))
+        wait_for(lambda: metrics.snapshot()["counters"].get("invalidations_received"))
+        self.assertIsNone(self.cache.get(5))
+        self.assertIsNotNone(self.cache.get(6))
+
+    def test_other_pod_clears(self):
+        """It should clear the cache when another pod made untracked writes"""
+        self._fill(5)
+        self._publish_from_other_pod(changes_of(everything=True))
+        wait_for(lambda: metrics.snapshot()["counters"].get("invalidations_received"))
+        self.assertIsNone(self.cache.get(5))
+
+    def test_own_messages_ignored(self):
+        """It should ignore the messages published by its own pod"""
+        self._fill(5)
+        self.bus.receive(json.dumps({"origin": "pod-a", "pid": os.getpid(), "user_ids": [5]}))
+        self.assertIsNotNone(self.cache.get(5))
+        self.assertNotIn("invalidations_received", metrics.snapshot()["counters"])
+
+    def test_rankings_of_other_workers(self):
+        """It should drop the rankings written by another worker of its pod, keeping the list cache"""
+        rankings = app.extensions["ranking_cache"]
+        self._fill(5)
+        with patch.object(rankings, "on_change") as on_change:
+            self.bus.receive(json.dumps({"origin": "pod-a", "pid": -1, "user_ids": [5]}))
+        self.assertEqual(on_change.call_args.args[0].user_ids, {5})
+        self.assertIsNotNone(self.cache.get(5))
+
+    def test_rankings_of_other_pods(self):
+        """It should drop the rankings of the users written by another pod"""
+        rankings = app.extensions["ranking_cache"]
+        with patch.object(rankings, "on_change") as on_change:
+            self._publish_from_other_pod(changes_of([5]))
+            wait_for(lambda: on_change.called)
+        self.assertEqual(on_change.call_args.args[0].user_ids, {5})
+
+    def test_listener_recovers(self):
+        """It should clear the cache once the listener recovered from an error"""
+        self._fill(6)
+        with patch.object(self.bus, "receive", side_effect=RuntimeError("connection lost")):
+            self._publish_from_other_pod(changes_of([5]))
+            wait_for(lambda: metrics.snapshot()["counters"].get("invalidation_listener_errors"))
+        wait_for(lambda: metrics.snapshot()["counters"].get("list_cache_clears"))
+        self.assertIsNone(self.cache.get(6))
+
+    def test_missed_clears_rankings(self):
+        """It should drop every ranking after messages may have been missed"""
+        with patch.object(app.extensions["ranking_cache"], "on_change") as on_change:
+            self.bus._missed()  # pylint: disable=protected-access
+        self.assertTrue(on_change.call_args.args[0].everything)
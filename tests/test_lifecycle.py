@@ -0,0 +1,61 @@
+"""
+Test cases for starting the background threads of a worker
+"""
+import logging
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from service import app
+from service.common import lifecycle
+
+
+class TestLifecycle(TestCase):
+    """Worker Lifecycle Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.workers = {name: Mock() for name in lifecycle.BACKGROUND_EXTENSIONS}
+        self.extensions = patch.dict(app.extensions, self.workers)
+        self.extensions.start()
+        self.threads = lifecycle.init_app(app)
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.extensions.stop()
+
+    def test_starts_once(self):
+        """It should start every background thread once"""
+        self.assertTrue(lifecycle.start(app))
+        self.assertFalse(lifecycle.start(app))
+        for worker in self.workers.values():
+            worker.start.assert_called_once_with()
+
+    def test_first_request_starts(self):
+        """It should start the background threads on the first request"""
+        client = app.test_client()
+        client.get("/health")
+        client.get("/health")
+        self.assertTrue(self.threads.started)
+        self.workers["warmup"].start.assert_called_once_with()
+
+    def test_import_starts_no_thread(self):
+        """It should not start any thread when the service is imported"""
+        environment = dict(
+            os.environ, DATABASE_URI="sqlite:///:memory:", WARMUP="true", LOG_ASYNC="true", RATING_WRITE_BEHIND="true"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", "import threading, service; print(threading.active_count())"],
+            env=environment,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        self.assertEqual(output.split()[-1], "1")
@@ -0,0 +1,149 @@
+"""
+Test cases for the logging pipeline
+"""
+import io
+import json
+import logging
+import queue
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import log_handlers
+from service.common.metrics import metrics
+
+SETTINGS = {
+    "LOG_FORMAT": "json",
+    "LOG_ASYNC": True,
+    "LOG_QUEUE_SIZE": 100,
+    "LOG_SAMPLE_RATES": "",
+    "LOG_REQUEST_SAMPLE_RATE": 1.0,
+}
+
+
+class TestLogHandlers(TestCase):
+    """Logging Pipeline Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        metrics.reset()
+        self.saved = (list(app.logger.handlers), list(app.logger.filters), app.logger.level)
+        self.stream = io.StringIO()
+        self.source = logging.getLogger("tests.gunicorn")
+        self.source.handlers = [logging.StreamHandler(self.stream)]
+        self.source.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        """This runs after each test"""
+        log_handlers.stop_logging(app)
+        app.logger.handlers, app.logger.filters, level = self.saved
+        app.logger.setLevel(level)
+
+    def _init(self, **settings):
+        with patch.dict(app.config, {**SETTINGS, **settings}):
+            log_handlers.init_logging(app, "tests.gunicorn")
+
+    def _records(self):
+        log_handlers.stop_logging(app)
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_lines(self):
+        """It should write one JSON object per record"""
+        self._init(LOG_ASYNC=False)
+        app.logger.info("Processing %s", "request", extra={"user_id": 7})
+        try:
+            raise ValueError("bad payload")
+        except ValueError:
+            app.logger.exception("Failed")
+        records = self._records()
+        self.assertEqual(records[-2]["message"], "Processing request")
+        self.assertEqual(records[-2]["level"], "INFO")
+        self.assertEqual(records[-2]["user_id"], 7)
+        self.assertIn("ValueError: bad payload", records[-1]["exception"])
+
+    def test_text_format(self):
+        """It should keep the text format when asked to"""
+        self._init(LOG_FORMAT="text", LOG_ASYNC=False)
+        app.logger.info("plain")
+        self.assertIn("[INFO] [test_log_handlers] plain", self.stream.getvalue())
+
+    def test_async_delivery(self):
+        """It should write the records from the listener thread"""
+        self._init()
+        self.assertIsInstance(app.logger.handlers[0], log_handlers.AsyncQueueHandler)
+        payload = {"rating": 1}
+        app.logger.debug("Payload = %s", payload)
+        payload["rating"] = 5  # changed before the listener formats it
+        try:
+            raise KeyError("user_id")
+        except KeyError:
+            app.logger.exception("Failed")
+        records = self._records()
+        self.assertEqual(records[1]["message"], "Payload = {'rating': 1}")
+        self.assertIn("KeyError", records[2]["exception"])
+
+    def test_full_queue_drops(self):
+        """It should drop and count records instead of blocking"""
+        with patch.object(log_handlers.QueueListener, "start"):
+            self._init(LOG_QUEUE_SIZE=2)
+        for number in range(5):
+            app.logger.info("record %d", number)
+        # the first queued record is "Logging handler established"
+        self.assertEqual(metrics.snapshot()["counters"]["log_records_dropped"], 4)
+        app.extensions["log_listener"].start()
+        self.assertEqual([record["message"] for record in self._records()][1:], ["record 0"])
+
+    def test_sampling(self):
+        """It should sample the chatty levels and keep warnings"""
+        self._init(LOG_SAMPLE_RATES="DEBUG=0,INFO=1")
+        for _ in range(10):
+            app.logger.debug("noise")
+            app.logger.info("request")
+        app.logger.warning("important")
+        messages = [record["message"] for record in self._records()]
+        self.assertNotIn("noise", messages)
+        self.assertEqual(messages.count("request"), 10)
+        self.assertIn("important", messages)
+        self.assertEqual(metrics.snapshot()["counters"]["log_records_sampled_out"], 10)
+
+    def test_request_sampling(self):
+        """It should keep all or none of the records of a request"""
+        self._init(LOG_ASYNC=False, LOG_REQUEST_SAMPLE_RATE=0.5)
+        with patch.object(log_handlers.random, "random", side_effect=[0.9, 0.1]):
+            for user_id in (1, 2):
+                with app.test_request_context():
+                    app.logger.info("request of %d", user_id)
+                    app.logger.info("response of %d", user_id)
+                    app.logger.warning("warning of %d", user_id)
+        app.logger.info("outside of a request")
+        messages = [record["message"] for record in self._records()]
+        self.assertEqual(
+            messages[1:],
+            ["warning of 1", "request of 2", "response of 2", "warning of 2", "outside of a request"],
+        )
+        self.assertEqual(metrics.snapshot()["counters"]["log_records_sampled_out"], 2)
+
+    def test_reinit_replaces_pipeline(self):
+        """It should stop the previous listener and filters when set up again"""
+        self._init(LOG_SAMPLE_RATES="DEBUG=0.5")
+        first = app.extensions["log_listener"]
+        self._init(LOG_SAMPLE_RATES="DEBUG=0.5")
+        self.assertIsNot(app.extensions["log_listener"], first)
+        self.assertIsNone(first._thread)  # pylint: disable=protected-access
+        samplers = [item for item in app.logger.filters if isinstance(item, log_handlers.SamplingFilter)]
+        self.assertEqual(len(samplers), 1)
+
+    def test_parse_sample_rates(self):
+        """It should parse the sample rates of the levels below WARNING"""
+        self.assertEqual(log_handlers.parse_sample_rates(""), {})
+        self.assertEqual(
+            log_handlers.parse_sample_rates("debug=0.01, INFO=0.5"),
+            {logging.DEBUG: 0.01, logging.INFO: 0.5},
+        )
+        for value in ("ERROR=0.1", "VERBOSE=1"):
+            self.assertRaises(ValueError, log_handlers.parse_sample_rates, value)
+
+    def test_queue_is_bounded(self):
+        """It should size the queue from LOG_QUEUE_SIZE"""
+        self._init(LOG_QUEUE_SIZE=7)
+        self.assertIsInstance(app.logger.handlers[0].queue, queue.Queue)
+        self.assertEqual(app.logger.handlers[0].queue.maxsize, 7)
@@ -0,0 +1,185 @@
+"""
+Test cases for the event outbox
+"""
+import json
+import logging
+from itertools import count
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from urllib.error import HTTPError
+from service import app
+from service.common import outbox
+from service.common.cli_commands import dispatch_events
+from service.common.metrics import metrics
+from service.models import OutboxEvent, Recommendation, db
+from tests.factories import RecommendationFactory
+
+
+class FailingSink:
+    """A sink whose endpoint is down"""
+
+    def send(self, events):
+        """Fails every batch"""
+        raise ConnectionError(f"cannot send {len(events)} events")
+
+    def close(self):
+        """Nothing to release"""
+
+
+class CollectingHandler(BaseHTTPRequestHandler):
+    """Stands in for the HTTP endpoint of a downstream system"""
+
+    received = []
+    status = 204
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Keeps the batch and answers with status"""
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        CollectingHandler.received.append(json.loads(body))
+        self.send_response(CollectingHandler.status)
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keeps the test output quiet"""
+
+
+class TestOutbox(TestCase):
+    """Event Outbox Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        app.config["OUTBOX"] = False
+        Recommendation.query.delete()
+        OutboxEvent.query.delete()
+        db.session.commit()
+        app.config["OUTBOX"] = True
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.directory.name, "events.ndjson")
+        metrics.reset()
+        self.product_ids = count(1)
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["OUTBOX"] = False
+        db.session.remove()
+        self.directory.cleanup()
+
+    def _recommendation(self, **attributes):
+        """Returns an unsaved Recommendation of a product of its own"""
+        return RecommendationFactory(id=None, product_id=next(self.product_ids), **attributes)
+
+    def _events(self):
+        return [event.to_dict() for event in db.session.scalars(db.select(OutboxEvent).order_by(OutboxEvent.id)).all()]
+
+    def _published(self):
+        with open(self.path, encoding="utf-8") as events:
+            return [json.loads(line) for line in events]
+
+    def test_events_of_writes(self):
+        """It should store the event of each write in its transaction"""
+        recommendation = self._recommendation(rating=1)
+        recommendation.create()
+        recommendation.rating = 4
+        recommendation.update()
+        recommendation_id, user_id = recommendation.id, recommendation.user_id
+        recommendation.delete()
+        created, updated, deleted = self._events()
+        self.assertEqual((created["type"], created["recommendation_id"]), (OutboxEvent.UPSERTED, recommendation_id))
+        self.assertEqual((created["data"]["rating"], updated["data"]["rating"]), (1, 4))
+        self.assertEqual(deleted["type"], OutboxEvent.DELETED)
+        self.assertEqual(deleted["data"], {"id": recommendation_id, "user_id": user_id})
+        self.assertLess(created["event_id"], updated["event_id"])
+
+    def test_bulk_writes(self):
+        """It should store the events of bulk inserts and rating updates"""
+        rows = [self._recommendation().serialize() for _ in range(2)]
+        for row in rows:
+            del row["id"], row["create_date"], row["update_date"]
+        Recommendation.bulk_create(rows)
+        db.session.commit()
+        ids = sorted(event["recommendation_id"] for event in self._events())
+        self.assertEqual(len(ids), 2)
+        Recommendation.update_ratings({ids[0]: 5})
+        db.session.commit()
+        self.assertEqual(self._events()[-1]["data"]["rating"], 5)
+
+    def test_untracked_write(self):
+        """It should store a reset event for writes whose rows are not known"""
+        self._recommendation(user_id=7).create()
+        db.session.query(Recommendation).filter(Recommendation.user_id == 7).delete()
+        db.session.commit()
+        self.assertEqual(self._events()[-1]["type"], OutboxEvent.RESET)
+
+    def test_nothing_without_commit(self):
+        """It should not store the events of rolled back writes, or when OUTBOX is off"""
+        db.session.add(self._recommendation())
+        db.session.flush()
+        db.session.rollback()
+        app.config["OUTBOX"] = False
+        self._recommendation().create()
+        self.assertEqual(self._events(), [])
+
+    def test_dispatch_to_file(self):
+        """It should send the events in batches and delete them once delivered"""
+        for _ in range(3):
+            self._recommendation().create()
+        stored = self._events()
+        sink = outbox.make_sink(f"file://{self.path}")
+        dispatcher = outbox.Dispatcher(sink, batch_size=2)
+        self.assertEqual([dispatcher.dispatch_batch() for _ in range(3)], [2, 1, 0])
+        sink.close()
+        self.assertEqual(self._published(), stored)
+        self.assertEqual(self._events(), [])
+        self.assertEqual(metrics.snapshot()["counters"]["outbox_events_dispatched"], 3)
+
+    def test_failed_batch_is_sent_again(self):
+        """It should keep the events of a batch the sink did not accept"""
+        self._recommendation().create()
+        with self.assertRaises(ConnectionError):
+            outbox.Dispatcher(FailingSink()).dispatch_batch()
+        self.assertEqual(len(self._events()), 1)
+        self.assertEqual(metrics.snapshot()["counters"]["outbox_send_failures"], 1)
+        sink = outbox.FileSink(f"file://{self.path}")
+        self.assertEqual(outbox.Dispatcher(sink).dispatch_batch(), 1)
+        sink.close()
+
+    def test_http_sink(self):
+        """It should POST each batch and fail on error responses"""
+        server = HTTPServer(("127.0.0.1", 0), CollectingHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            sink = outbox.make_sink(f"http://127.0.0.1:{server.server_port}/events")
+            CollectingHandler.received.clear()
+            sink.send([{"event_id": 1}, {"event_id": 2}])
+            self.assertEqual(CollectingHandler.received, [[{"event_id": 1}, {"event_id": 2}]])
+            CollectingHandler.status = 503
+            with self.assertRaises(HTTPError):
+                sink.send([{"event_id": 3}])
+        finally:
+            CollectingHandler.status = 204
+            server.shutdown()
+            server.server_close()
+
+    def test_dispatch_command(self):
+        """It should drain the outbox from the command line"""
+        for _ in range(2):
+            self._recommendation().create()
+        runner = app.test_cli_runner()
+        result = runner.invoke(dispatch_events, ["--sink", f"file://{self.path}", "--once"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Dispatch complete: 2 events", result.output)
+        self.assertEqual(len(self._published()), 2)
+        result = runner.invoke(dispatch_events, ["--sink", "ftp://example.com", "--once"])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("Unknown sink", result.output)
@@ -0,0 +1,125 @@
+"""
+Test cases for read replica routing
+"""
+import os
+import logging
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import replicas, shared_cache, status
+from service.common.metrics import metrics
+from service.models import Recommendation, RecommendationType, db
+
+BASE_URL = "/api/recommendations"
+
+
+class TestReplicaRouting(TestCase):
+    """Read Replica Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """Creates a replica database with its own data"""
+        self.client = app.test_client()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        db.session.query(Recommendation).delete()
+        db.session.add(self._recommendation(product_id=1))
+        db.session.commit()
+        metrics.reset()
+        uri = f"sqlite:///{os.path.join(self.tmpdir.name, 'replica.db')}"
+        with patch.dict(app.config, {"DATABASE_READ_URIS": [uri]}):
+            self.router = replicas.init_app(app)
+        self.replica = self.router.engines[0]
+        db.metadata.create_all(self.replica)
+        with self.replica.begin() as connection:
+            connection.execute(
+                Recommendation.__table__.insert(),
+                [self._columns(product_id=100), self._columns(product_id=101)],
+            )
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        replicas.init_app(app)
+        self.replica.dispose()
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def _columns(product_id):
+        return {
+            "user_id": 1,
+            "product_id": product_id,
+            "recommendation_type": RecommendationType.UPSELL,
+            "bought_in_last_30_days": False,
+        }
+
+    def _recommendation(self, product_id):
+        return Recommendation(**self._columns(product_id))
+
+    def test_init_app_without_replicas(self):
+        """It should not route reads when no replica is configured"""
+        self.assertIsNone(replicas.init_app(app))
+        response = self.client.get(BASE_URL)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_reads_use_replica(self):
+        """It should serve GET requests from the replica"""
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(item["product_id"] for item in response.get_json()), [100, 101])
+        self.assertEqual(metrics.snapshot()["counters"]["replica_reads"], 1)
+
+    def test_cache_filled_from_primary(self):
+        """It should fill the shared list cache from the primary, never from a lagging replica"""
+        settings = {"LIST_CACHE": True, "LIST_CACHE_PATH": os.path.join(self.tmpdir.name, "cache")}
+        with patch.dict(app.config, settings):
+            shared_cache.init_app(app)
+        try:
+            for _ in range(2):
+                response = self.client.get(BASE_URL, query_string="user_id=1")
+                self.assertEqual([item["product_id"] for item in response.get_json()], [1])
+            self.assertEqual(metrics.snapshot()["counters"]["list_cache_hits"], 1)
+        finally:
+            shared_cache.init_app(app)
+
+    def test_writes_use_primary(self):
+        """It should send writes and later reads of the same request to the primary"""
+        db.session.info["replica"] = self.replica
+        try:
+            self.assertEqual(len(Recommendation.all()), 2)
+            db.session.rollback()
+            db.session.add(self._recommendation(product_id=2))
+            db.session.flush()
+            self.assertEqual(sorted(reco.product_id for reco in Recommendation.all()), [1, 2])
+        finally:
+            db.session.info.clear()
+            db.session.rollback()
+
+    def test_round_robin(self):
+        """It should alternate between replicas"""
+        router = replicas.ReplicaRouter(["sqlite://", "sqlite://"])
+        first, second = router.choose(), router.choose()
+        self.assertIsNot(first, second)
+        self.assertIs(router.choose(), first)
+        router.mark_down(first)
+        self.assertIs(router.choose(), second)
+        self.assertIs(router.choose(), second)
+        router.mark_down(second)
+        self.assertIsNone(router.choose())
+
+    def test_fallback_to_primary(self):
+        """It should read from the primary when the replica is down"""
+        missing = os.path.join(self.tmpdir.name, "missing", "replica.db")
+        with patch.dict(app.config, {"DATABASE_READ_URIS": [f"sqlite:///{missing}"]}):
+            router = replicas.init_app(app)
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["product_id"] for item in response.get_json()], [1])
+        self.assertEqual(metrics.snapshot()["counters"]["replica_fallbacks"], 1)
+        self.assertIsNone(router.choose())
@@ -7,9 +7,11 @@ Test cases can be run with the following:
 """
 import os
 import logging
+import itertools
 
 # from logging import Formatter
 from unittest import TestCase
+from unittest.mock import patch
 
 # from unittest.mock import MagicMock, patch
 from service import app
@@ -51,6 +53,8 @@ class TestYourResourceServer(TestCase):
         self.client = app.test_client()
         db.session.query(Recommendation).delete()  # clean up the last tests
         db.session.commit()
+        # each created Recommendation gets its own product, so none share a natural key
+        self.product_ids = itertools.count(1)
 
     def tearDown(self):
         """This runs after each test"""
@@ -60,7 +64,7 @@ class TestYourResourceServer(TestCase):
         """Factory method to create recommendations in bulk"""
         recommendations = []
         for _ in range(count):
-            test_recommendation = RecommendationFactory()
+            test_recommendation = RecommendationFactory(product_id=next(self.product_ids))
             response = self.client.post(BASE_URL, json=test_recommendation.serialize())
             self.assertEqual(
                 response.status_code,
@@ -88,6 +92,14 @@ class TestYourResourceServer(TestCase):
         data = response.get_json()
         self.assertEqual(data["status"], "OK")
 
+    def test_metrics(self):
+        """It should return the metrics of the worker"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertIn("counters", data)
+        self.assertIn("timers", data)
+
     def test_create_recommendation(self):
         """It should Create a new Recommendation"""
         test_recommendation = RecommendationFactory()
@@ -131,6 +143,15 @@ class TestYourResourceServer(TestCase):
             test_recommendation.bought_in_last_30_days,
         )
 
+    def test_create_duplicate_recommendation(self):
+        """It should not Create the same Recommendation twice"""
+        test_recommendation = RecommendationFactory()
+        response = self.client.post(BASE_URL, json=test_recommendation.serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(BASE_URL, json=test_recommendation.serialize())
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(len(Recommendation.all()), 1)
+
     def test_create_recommendation_no_content_type(self):
         """It should not Create a Recommendation with no content type"""
         response = self.client.post(BASE_URL)
@@ -159,6 +180,7 @@ class TestYourResourceServer(TestCase):
         """It should not Create a Recommendation with wrong data"""
         response = self.client.post(BASE_URL, json={"foo": "bar"})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.get_json()["errors"]), 4)
 
     ######################################################################
     #  UPDATE   TEST   CASES
@@ -225,6 +247,66 @@ class TestYourResourceServer(TestCase):
             response.status_code, status.HTTP_404_NOT_FOUND
         )
 
+    ######################################################################
+    #  PATCH A RECOMMENDATION
+    ######################################################################
+    def test_patch_recommendation(self):
+        """It should change only the fields in the body"""
+        recommendation = RecommendationFactory(id=None, recommendation_type=RecommendationType.TRENDING)
+        recommendation.create()
+        original = recommendation.serialize()
+        response = self.client.patch(f"{BASE_URL}/{recommendation.id}", json={"recommendation_type": "UPSELL"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        patched = response.get_json()
+        self.assertEqual(patched["recommendation_type"], "UPSELL")
+        for name in ("user_id", "product_id", "bought_in_last_30_days", "rating"):
+            self.assertEqual(patched[name], original[name])
+        response = self.client.get(f"{BASE_URL}/{recommendation.id}")
+        self.assertEqual(response.get_json(), patched)
+
+    def test_patch_recommendation_not_found(self):
+        """It should not patch a Recommendation that is not found"""
+        response = self.client.patch(f"{BASE_URL}/0", json={"product_id": 3})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_recommendation_bad_request(self):
+        """It should not patch with an empty body, the rating or an invalid field"""
+        recommendation = RecommendationFactory(id=None)
+        recommendation.create()
+        url = f"{BASE_URL}/{recommendation.id}"
+        original = self.client.get(url).get_json()
+        for body in ({}, {"unknown": 1}, {"rating": 3}, {"product_id": "four"}, {"recommendation_type": "BEST"}):
+            response = self.client.patch(url, json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        self.assertEqual(self.client.get(url).get_json(), original)
+
+    def test_patch_recommendation_conflict(self):
+        """It should not patch a Recommendation into the natural key of another"""
+        first = RecommendationFactory(id=None, recommendation_type=RecommendationType.UPSELL)
+        first.create()
+        second = RecommendationFactory(
+            id=None, user_id=first.user_id, product_id=first.product_id, recommendation_type=RecommendationType.TRENDING
+        )
+        second.create()
+        response = self.client.patch(f"{BASE_URL}/{second.id}", json={"recommendation_type": "UPSELL"})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_errors_without_testing(self):
+        """It should answer 409 and 400 when exceptions do not propagate"""
+        first = RecommendationFactory(id=None, recommendation_type=RecommendationType.UPSELL)
+        first.create()
+        second = RecommendationFactory(
+            id=None, user_id=first.user_id, product_id=first.product_id, recommendation_type=RecommendationType.TRENDING
+        )
+        second.create()
+        with patch.dict(app.config, {"TESTING": False}):
+            response = self.client.patch(f"{BASE_URL}/{second.id}", json={"recommendation_type": "UPSELL"})
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(response.get_json()["error"], "Conflict")
+            response = self.client.patch(f"{BASE_URL}/{second.id}", json={"product_id": "four"})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.get_json()["errors"], ["Invalid type for int [product_id]"])
+
     ######################################################################
     #  UPDATE A RECOMMENDATION RATING
     ######################################################################
@@ -355,7 +437,212 @@ class TestYourResourceServer(TestCase):
         for recommendation in data:
             self.assertEqual(recommendation["user_id"], test_user_id)
 
+    def test_get_recommendation_pages(self):
+        """It should page through the Recommendations with a next link"""
+        recommendations = self._create_recommendations(5)
+        seen = []
+        url = f"{BASE_URL}?limit=2&count=true"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item["id"] for item in response.get_json())
+            link = response.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        self.assertEqual(seen, sorted(recommendation.id for recommendation in recommendations))
+
+    def test_get_recommendation_page_by_user_id(self):
+        """It should keep the user_id filter on the next pages"""
+        ids = []
+        for product_id, user_id in enumerate((1, 2, 1), start=1):
+            recommendation = RecommendationFactory(user_id=user_id, product_id=product_id)
+            response = self.client.post(BASE_URL, json=recommendation.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            ids.append(response.get_json()["id"])
+        response = self.client.get(BASE_URL, query_string={"user_id": 1, "limit": 1, "count": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "2")
+        self.assertEqual([item["id"] for item in response.get_json()], [ids[0]])
+        link = response.headers["Link"]
+        self.assertIn("user_id=1", link)
+        response = self.client.get(link[1:link.index(">")])
+        self.assertEqual([item["id"] for item in response.get_json()], [ids[2]])
+        response = self.client.get(BASE_URL, query_string={"after_id": ids[-1]})
+        self.assertEqual(response.get_json(), [])
+
+    def test_get_recommendation_page_bad_limit(self):
+        """It should not accept a page size out of range"""
+        for limit in (0, 1001):
+            response = self.client.get(BASE_URL, query_string={"limit": limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_query_recommendation_list_by_wrong_user_id(self):
         """It should not list Recommendations with wrong user id type as a query parameter"""
         response = self.client.get(BASE_URL, query_string=f"user_id={'foo'}")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  UPSERT RECOMMENDATIONS
+    ######################################################################
+    def test_upsert_recommendations(self):
+        """It should create new Recommendations and update existing ones by natural key"""
+        existing = self._create_recommendations(1)[0]
+        self.client.put(f"{BASE_URL}/{existing.id}/rating", json={"rating": 4})
+        changed = existing.serialize()
+        changed["bought_in_last_30_days"] = not existing.bought_in_last_30_days
+        new = RecommendationFactory(product_id=next(self.product_ids)).serialize()
+        response = self.client.put(f"{BASE_URL}/upsert", json=[changed, new, new])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), 2)
+        updated = next(item for item in data if item["id"] == existing.id)
+        self.assertEqual(updated["bought_in_last_30_days"], changed["bought_in_last_30_days"])
+        self.assertEqual(updated["rating"], 4)
+        self.assertEqual(len(Recommendation.all()), 2)
+
+        # repeating the request does not create anything
+        response = self.client.put(f"{BASE_URL}/upsert", json=[changed, new])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(Recommendation.all()), 2)
+
+    def test_upsert_single_recommendation(self):
+        """It should upsert a single Recommendation object"""
+        new = RecommendationFactory().serialize()
+        response = self.client.put(f"{BASE_URL}/upsert", json=new)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()[0]["product_id"], new["product_id"])
+
+    def test_upsert_invalid_recommendation(self):
+        """It should not upsert a list containing invalid data"""
+        new = RecommendationFactory().serialize()
+        response = self.client.put(f"{BASE_URL}/upsert", json=[new, {"user_id": 1}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("[1]", response.get_json()["message"])
+        self.assertEqual(len(Recommendation.all()), 0)
+
+    def test_upsert_too_many_recommendations(self):
+        """It should not upsert more than MAX_BATCH_SIZE Recommendations"""
+        new = RecommendationFactory().serialize()
+        response = self.client.put(f"{BASE_URL}/upsert", json=[new] * (app.config["MAX_BATCH_SIZE"] + 1))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  PATCH MANY RECOMMENDATIONS
+    ######################################################################
+    def test_patch_recommendations(self):
+        """It should change many Recommendations and report the outcome of each patch"""
+        recommendations = self._create_recommendations(2)
+        first, second = recommendations[0], recommendations[1]
+        patches = [
+            {"id": first.id, "changes": {"bought_in_last_30_days": not first.bought_in_last_30_days}},
+            {"id": second.id, "changes": {"recommendation_type": "UNKNOWN", "bought_in_last_30_days": True}},
+            {"id": 0, "changes": {"bought_in_last_30_days": True}},
+            {"id": first.id, "changes": {"rating": 5}},
+            {"changes": {}},
+        ]
+        response = self.client.patch(BASE_URL, json=patches)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.get_json()["results"]
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in results],
+            [(first.id, "updated"), (second.id, "updated"), (0, "not_found"), (first.id, "invalid"), (None, "invalid")],
+        )
+        self.assertEqual(results[3]["errors"], ["Field [rating] cannot be patched in bulk"])
+        patched = results[0]["recommendation"]
+        self.assertEqual(patched["bought_in_last_30_days"], not first.bought_in_last_30_days)
+        self.assertEqual(patched["recommendation_type"], first.recommendation_type.name)
+        stored = Recommendation.find(second.id)
+        self.assertEqual((stored.recommendation_type, stored.bought_in_last_30_days), (RecommendationType.UNKNOWN, True))
+        self.assertEqual(stored.product_id, second.product_id)
+
+    def test_patch_natural_key_conflict(self):
+        """It should not move a Recommendation onto the user, product and type of another one"""
+        kept = RecommendationFactory(id=None, user_id=1, product_id=1, recommendation_type=RecommendationType.UPSELL)
+        kept.create()
+        moved = RecommendationFactory(id=None, user_id=1, product_id=1, recommendation_type=RecommendationType.TRENDING)
+        moved.create()
+        response = self.client.patch(
+            BASE_URL,
+            json=[
+                {"id": moved.id, "changes": {"recommendation_type": "UPSELL"}},
+                {"id": kept.id, "changes": {"bought_in_last_30_days": True}},
+            ],
+        )
+        self.assertEqual([result["status"] for result in response.get_json()["results"]], ["conflict", "updated"])
+        self.assertEqual(Recommendation.find(moved.id).recommendation_type, RecommendationType.TRENDING)
+
+    def _patch_moves(self, types, moves):
+        """Creates Recommendations of user 1 and product 1 with types, then patches them with moves and one unrelated patch"""
+        moving = []
+        for recommendation_type in types:
+            recommendation = RecommendationFactory(id=None, user_id=1, product_id=1, recommendation_type=recommendation_type)
+            recommendation.create()
+            moving.append(recommendation)
+        unrelated = RecommendationFactory(id=None, user_id=2, product_id=2, bought_in_last_30_days=False)
+        unrelated.create()
+        patches = [
+            {"id": recommendation.id, "changes": {"recommendation_type": target.name}}
+            for recommendation, target in zip(moving, moves)
+        ]
+        patches.append({"id": unrelated.id, "changes": {"bought_in_last_30_days": True}})
+        response = self.client.patch(BASE_URL, json=patches)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Recommendation.find(unrelated.id).bought_in_last_30_days)
+        return moving, [result["status"] for result in response.get_json()["results"]]
+
+    def test_patch_chain_of_moves(self):
+        """It should refuse a move onto the key of a row that moves away, applying the other patches"""
+        (first, second), statuses = self._patch_moves(
+            [RecommendationType.UPSELL, RecommendationType.TRENDING],
+            [RecommendationType.TRENDING, RecommendationType.UNKNOWN],
+        )
+        self.assertEqual(statuses, ["conflict", "updated", "updated"])
+        self.assertEqual(Recommendation.find(first.id).recommendation_type, RecommendationType.UPSELL)
+        self.assertEqual(Recommendation.find(second.id).recommendation_type, RecommendationType.UNKNOWN)
+
+    def test_patch_swap(self):
+        """It should refuse to swap the keys of two rows, applying the other patches"""
+        (first, second), statuses = self._patch_moves(
+            [RecommendationType.UPSELL, RecommendationType.TRENDING],
+            [RecommendationType.TRENDING, RecommendationType.UPSELL],
+        )
+        self.assertEqual(statuses, ["conflict", "conflict", "updated"])
+        self.assertEqual(Recommendation.find(first.id).recommendation_type, RecommendationType.UPSELL)
+        self.assertEqual(Recommendation.find(second.id).recommendation_type, RecommendationType.TRENDING)
+
+    def test_patch_bad_request(self):
+        """It should only patch a list of at most MAX_BATCH_SIZE items"""
+        for payload in ({"id": 1, "changes": {}}, [{"id": 1, "changes": {}}] * (app.config["MAX_BATCH_SIZE"] + 1)):
+            response = self.client.patch(BASE_URL, json=payload)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  BATCH GET RECOMMENDATIONS
+    ######################################################################
+    def test_batch_get_recommendations(self):
+        """It should Get many Recommendations in the requested order"""
+        recommendations = self._create_recommendations(3)
+        ids = [recommendations[2].id, 0, recommendations[0].id, recommendations[2].id]
+        response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(
+            [item["id"] for item in data["recommendations"]],
+            [recommendations[2].id, recommendations[0].id],
+        )
+        self.assertEqual(data["recommendations"][0]["user_id"], recommendations[2].user_id)
+        self.assertEqual(data["missing"], [0])
+
+    def test_batch_get_empty(self):
+        """It should return nothing for an empty list of ids"""
+        response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": []})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"recommendations": [], "missing": []})
+
+    def test_batch_get_bad_ids(self):
+        """It should not Get Recommendations with invalid ids"""
+        for payload in ({"ids": ["1"]}, {"ids": 1}, {}, [1, 2]):
+            response = self.client.post(f"{BASE_URL}/batch-get", json=payload)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        too_many = list(range(app.config["MAX_BATCH_SIZE"] + 1))
+        response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": too_many})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
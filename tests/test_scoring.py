@@ -0,0 +1,143 @@
+"""
+Test cases for the scoring pipeline
+"""
+import logging
+from itertools import count
+from datetime import date, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import scoring, status
+from service.common.metrics import metrics
+from service.common.scoring import Candidates, ScoringPipeline
+from service.models import Recommendation, RecommendationType, db
+from tests.factories import RecommendationFactory
+
+RANKED_URL = "/api/recommendations/ranked"
+TODAY = date(2024, 6, 30)
+
+
+def record(by_id, rating=0, days=0, recommendation_type="UNKNOWN", bought=False):
+    """Returns a serialized recommendation updated days before TODAY"""
+    return {
+        "id": by_id,
+        "user_id": 1,
+        "product_id": by_id,
+        "recommendation_type": recommendation_type,
+        "create_date": "2024-01-01",
+        "update_date": (TODAY - timedelta(days=days)).isoformat(),
+        "bought_in_last_30_days": bought,
+        "rating": rating,
+    }
+
+
+class TestScoringPipeline(TestCase):
+    """Scoring Pipeline Tests"""
+
+    def _scores(self, spec, records, **settings):
+        config = dict(app.config, SCORING_PIPELINE=spec, **settings)
+        pipeline = ScoringPipeline.from_config(config)
+        return list(pipeline.score(Candidates(records, TODAY)))
+
+    def test_scorers(self):
+        """It should score each rule over the whole candidate set"""
+        records = [
+            record(1, rating=5, days=0, recommendation_type="UPSELL", bought=True),
+            record(2, rating=1, days=10, recommendation_type="TRENDING"),
+            record(3, rating=0, days=20, recommendation_type="UNKNOWN"),
+        ]
+        self.assertEqual(self._scores("rating", records), [1.0, 0.2, 0.0])
+        self.assertEqual(self._scores("recency", records, SCORING_RECENCY_HALF_LIFE=10), [1.0, 0.5, 0.25])
+        self.assertEqual(self._scores("type", records, SCORING_TYPE_WEIGHTS="UPSELL=0.6,TRENDING=0.4"), [0.6, 0.4, 0.0])
+        self.assertEqual(self._scores("purchased:2", records), [-2.0, 0.0, 0.0])
+        self.assertEqual(self._scores("rating:2,purchased:1", records), [1.0, 0.4, 0.0])
+
+    def test_rank(self):
+        """It should return the records best first, the oldest id first among equals"""
+        pipeline = ScoringPipeline.from_config(dict(app.config, SCORING_PIPELINE="rating"))
+        ranking = pipeline.rank([record(1, rating=2), record(2, rating=4), record(3, rating=2)])
+        self.assertEqual([item["id"] for item in ranking.top()], [2, 1, 3])
+        self.assertEqual(ranking.top(1), [dict(record(2, rating=4), score=0.8)])
+        self.assertEqual(pipeline.rank([]).top(), [])
+
+    def test_unknown_scorer(self):
+        """It should reject a pipeline naming an unknown scorer"""
+        with self.assertRaises(ValueError):
+            ScoringPipeline.from_config(dict(app.config, SCORING_PIPELINE="rating,popularity:2"))
+
+
+class TestRankedRecommendations(TestCase):
+    """Ranked Recommendations Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        Recommendation.query.delete()
+        db.session.commit()
+        self.client = app.test_client()
+        with patch.dict(app.config, {"SCORING_PIPELINE": "rating:1,purchased:1"}):
+            scoring.init_app(app)
+        metrics.reset()
+        self.product_ids = count(1)
+
+    def tearDown(self):
+        """This runs after each test"""
+        scoring.init_app(app)
+        db.session.remove()
+
+    def _create(self, **attributes):
+        recommendation = RecommendationFactory(id=None, user_id=1, product_id=next(self.product_ids), **attributes)
+        recommendation.create()
+        return recommendation
+
+    def _ranked(self, **params):
+        response = self.client.get(RANKED_URL, query_string={"user_id": 1, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.get_json()
+
+    def test_ranked_list(self):
+        """It should return the recommendations of the user best first"""
+        low = self._create(rating=1, bought_in_last_30_days=False)
+        high = self._create(rating=5, bought_in_last_30_days=False)
+        bought = self._create(rating=5, bought_in_last_30_days=True)
+        RecommendationFactory(id=None, user_id=2).create()
+        ranked = self._ranked()
+        self.assertEqual([item["id"] for item in ranked], [high.id, low.id, bought.id])
+        self.assertEqual([item["score"] for item in ranked], [1.0, 0.2, 0.0])
+        self.assertEqual(ranked[0]["recommendation_type"], high.recommendation_type.name)
+        self.assertEqual(len(self._ranked(limit=1)), 1)
+
+    def test_cached_until_write(self):
+        """It should reuse the ranking of a user until one of its recommendations is written"""
+        first = self._create(rating=5, bought_in_last_30_days=False)
+        second = self._create(rating=3, bought_in_last_30_days=False)
+        for _ in range(2):
+            self._ranked()
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual((counters["ranking_misses"], counters["ranking_hits"]), (1, 1))
+        second.rating = 5
+        second.recommendation_type = RecommendationType.UPSELL
+        second.update()
+        first.bought_in_last_30_days = True
+        first.update()
+        self.assertEqual([item["id"] for item in self._ranked()], [second.id, first.id])
+
+    def test_user_zero(self):
+        """It should rank only the recommendations of user 0, not every user's"""
+        self._create(rating=5)
+        zero = RecommendationFactory(id=None, user_id=0, product_id=next(self.product_ids))
+        zero.create()
+        ranked = self._ranked(user_id=0)
+        self.assertEqual([item["id"] for item in ranked], [zero.id])
+
+    def test_bad_arguments(self):
+        """It should require a user_id and a limit in range"""
+        for params in ({}, {"user_id": 1, "limit": 0}, {"user_id": "x"}):
+            response = self.client.get(RANKED_URL, query_string=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
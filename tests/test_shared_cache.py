@@ -0,0 +1,202 @@
+"""
+Test cases for the shared list cache
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import shared_cache, status
+from service.common.metrics import metrics
+from service.common.shared_cache import SharedCache
+from service.models import CHANGE_LISTENERS, Recommendation, db
+from tests.factories import RecommendationFactory
+
+BASE_URL = "/api/recommendations"
+
+
+def store_in_child(path):
+    """Stores a value from another process"""
+    cache = SharedCache(path, slots=8, slot_size=64)
+    cache.put(42, cache.version(42), b"from the child")
+    cache.close()
+
+
+class TestSharedCache(TestCase):
+    """Shared Cache Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.directory.name, "cache")
+        self.cache = SharedCache(self.path, slots=8, slot_size=64, ttl=60)
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        """It should return the stored value until the key is invalidated"""
+        self.assertIsNone(self.cache.get(1))
+        self.assertTrue(self.cache.put(1, self.cache.version(1), b"one"))
+        self.assertEqual(self.cache.get(1), b"one")
+        self.cache.invalidate([1])
+        self.assertIsNone(self.cache.get(1))
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["list_cache_hits"], 1)
+        self.assertEqual(counters["list_cache_misses"], 2)
+
+    def test_stale_version_is_not_stored(self):
+        """It should not store a value computed before the key was invalidated"""
+        version = self.cache.version(1)
+        self.cache.invalidate([1])
+        self.assertFalse(self.cache.put(1, version, b"stale"))
+        self.assertIsNone(self.cache.get(1))
+
+    def test_clear(self):
+        """It should make every entry stale"""
+        self.cache.put(1, self.cache.version(1), b"one")
+        self.cache.put(2, self.cache.version(2), b"two")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(1))
+        self.assertIsNone(self.cache.get(2))
+
+    def test_too_large(self):
+        """It should not store values larger than a slot"""
+        self.assertFalse(self.cache.put(1, self.cache.version(1), b"x" * 65))
+        self.assertEqual(metrics.snapshot()["counters"]["list_cache_too_large"], 1)
+
+    def test_eviction(self):
+        """It should evict the oldest entry of a full set"""
+        same_set = self.cache._set_offsets  # pylint: disable=protected-access
+        keys = [key for key in range(1000) if same_set(key) == same_set(0)]
+        for key in keys[:5]:
+            self.cache.put(key, self.cache.version(key), str(key).encode())
+        self.assertIsNone(self.cache.get(keys[0]))
+        for key in keys[1:5]:
+            self.assertEqual(self.cache.get(key), str(key).encode())
+        self.assertEqual(metrics.snapshot()["counters"]["list_cache_evictions"], 1)
+
+    def test_ttl(self):
+        """It should not serve entries older than the ttl"""
+        self.cache.ttl = 0.01
+        self.cache.put(1, self.cache.version(1), b"one")
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get(1))
+
+    def test_shared_between_processes(self):
+        """It should serve values stored by another process"""
+        child = multiprocessing.get_context("fork").Process(target=store_in_child, args=(self.path,))
+        child.start()
+        child.join(10)
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.cache.get(42), b"from the child")
+
+    def test_json_fill(self):
+        """It should store the result of fill and load it back"""
+        self.assertEqual(self.cache.fill(1, lambda: [{"id": 1}]), [{"id": 1}])
+        self.assertEqual(self.cache.load(1), [{"id": 1}])
+
+
+class TestListCacheEndpoint(TestCase):
+    """Shared List Cache Endpoint Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+        cls.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cls.settings = patch.dict(
+            app.config,
+            {"LIST_CACHE": True, "LIST_CACHE_PATH": os.path.join(cls.directory.name, "cache")},
+        )
+        cls.settings.start()
+        shared_cache.init_app(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.settings.stop()
+        shared_cache.init_app(app)
+        cls.directory.cleanup()
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+        self.recommendation = RecommendationFactory(id=None, user_id=5, rating=1)
+        self.recommendation.create()
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _list(self):
+        response = self.client.get(BASE_URL, query_string="user_id=5")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.get_json()
+
+    def test_second_read_is_a_hit(self):
+        """It should serve the second read of a user's list from the cache"""
+        self.assertEqual(self._list(), self._list())
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["list_cache_stores"], 1)
+        self.assertEqual(counters["list_cache_hits"], 1)
+        self.assertEqual(counters["list_cache_misses"], 1)
+
+    def test_update_invalidates(self):
+        """It should serve the new list after one of its recommendations changed"""
+        self._list()
+        self.recommendation.rating = 4
+        self.recommendation.update()
+        self.assertEqual(self._list()[0]["rating"], 4)
+
+    def test_create_and_delete_invalidate(self):
+        """It should serve the new list after a recommendation is added or deleted"""
+        self.assertEqual(len(self._list()), 1)
+        other = RecommendationFactory(id=None, user_id=5, product_id=self.recommendation.product_id + 1)
+        other.create()
+        self.assertEqual(len(self._list()), 2)
+        other.delete()
+        self.assertEqual(len(self._list()), 1)
+
+    def test_bulk_ratings_invalidate(self):
+        """It should serve the new list after a batched rating update"""
+        self._list()
+        Recommendation.update_ratings({self.recommendation.id: 5})
+        db.session.commit()
+        self.assertEqual(self._list()[0]["rating"], 5)
+
+    def test_untracked_write_clears(self):
+        """It should clear the cache after a write whose rows are unknown"""
+        self._list()
+        db.session.query(Recommendation).filter(Recommendation.user_id == 5).delete()
+        db.session.commit()
+        self.assertEqual(self._list(), [])
+        self.assertEqual(metrics.snapshot()["counters"]["list_cache_clears"], 1)
+
+    def test_rollback_publishes_nothing(self):
+        """It should not invalidate for a rolled back write"""
+        self._list()
+        self.recommendation.rating = 3
+        db.session.flush()
+        db.session.rollback()
+        self._list()
+        self.assertNotIn("list_cache_invalidations", metrics.snapshot()["counters"])
+
+    def test_listener_registered_once(self):
+        """It should replace its change listener when initialized again"""
+        shared_cache.init_app(app)
+        cache = app.extensions["list_cache"]
+        self.assertEqual(CHANGE_LISTENERS.count(cache.on_change), 1)
+        caches = [listener for listener in CHANGE_LISTENERS if isinstance(getattr(listener, "__self__", None), SharedCache)]
+        self.assertEqual(len(caches), 1)
@@ -0,0 +1,163 @@
+"""
+Test cases for single-flight request coalescing
+"""
+import logging
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service import app, routes
+from service.common import singleflight, status
+from service.common.metrics import metrics
+from service.common.singleflight import SingleFlight
+from service.models import db
+
+BASE_URL = "/api/recommendations"
+
+
+def wait_for(condition, timeout: float = 5.0):
+    """Polls condition until it is true or timeout seconds have passed"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+class TestSingleFlight(TestCase):
+    """Single-flight Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["SINGLE_FLIGHT"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+        singleflight.init_app(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        app.config["SINGLE_FLIGHT"] = False
+        singleflight.init_app(app)
+
+    def setUp(self):
+        """This runs before each test"""
+        metrics.reset()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.release.set()
+        singleflight.init_app(app)
+
+    def _slow_query(self, result="result"):
+        """Stands in for a query that runs until the test releases it"""
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run_concurrently(self, flight, key, func, count: int):
+        """Starts count callers of flight.do and releases them once all joined"""
+        outcomes = [None] * count
+
+        def call(position):
+            try:
+                outcomes[position] = flight.do(key, func)
+            except Exception as error:  # pylint: disable=broad-except
+                outcomes[position] = error
+
+        threads = [threading.Thread(target=call, args=(position,)) for position in range(count)]
+        threads[0].start()
+        wait_for(lambda: flight.in_flight() == 1)
+        for thread in threads[1:]:
+            thread.start()
+        wait_for(lambda: metrics.snapshot()["counters"].get(f"{flight.name}_coalesced") == count - 1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_query(self):
+        """It should run one query for identical concurrent calls"""
+        flight = SingleFlight("test")
+        outcomes = self._run_concurrently(flight, 1, self._slow_query, 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, ["result"] * 5)
+        self.assertEqual(flight.in_flight(), 0)
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters["test_queries"], 1)
+        self.assertEqual(counters["test_coalesced"], 4)
+
+    def test_error_is_shared(self):
+        """It should raise the error of the query in every waiting call"""
+        flight = SingleFlight("test")
+        error = RuntimeError("database is down")
+        outcomes = self._run_concurrently(flight, 1, lambda: self._slow_query(error), 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [error] * 3)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_per_request_error_is_retried(self):
+        """It should run the query again for the waiting calls after a per_request error"""
+        flight = SingleFlight("test")
+        error = RuntimeError("deadline of the first request")
+        error.per_request = True
+        results = iter([error, "result", "result"])
+        outcomes = self._run_concurrently(flight, 1, lambda: self._slow_query(next(results)), 3)
+        self.assertEqual(outcomes[0], error)
+        self.assertEqual(outcomes[1:], ["result", "result"])
+        self.assertIn(self.calls, (2, 3))
+
+    def test_sequential_calls_are_not_cached(self):
+        """It should run the query again once the previous one returned"""
+        flight = SingleFlight("test")
+        self.release.set()
+        self.assertEqual(flight.do(1, self._slow_query), "result")
+        self.assertEqual(flight.do(1, self._slow_query), "result")
+        self.assertEqual(self.calls, 2)
+        self.assertNotIn("test_coalesced", metrics.snapshot()["counters"])
+
+    def test_different_keys(self):
+        """It should not coalesce calls for different keys"""
+        flight = SingleFlight("test")
+        self.release.set()
+        flight.do(1, self._slow_query)
+        flight.do(2, self._slow_query)
+        self.assertEqual(self.calls, 2)
+
+    def test_disabled(self):
+        """It should call the query directly when SINGLE_FLIGHT is off"""
+        with patch.dict(app.config, {"SINGLE_FLIGHT": False}):
+            self.assertIsNone(singleflight.init_app(app))
+        self.release.set()
+        self.assertEqual(singleflight.coalesce(app, "list", 1, self._slow_query), "result")
+        self.assertNotIn("recommendation_list_queries", metrics.snapshot()["counters"])
+
+    def test_list_endpoint_coalesces(self):
+        """It should share one query between concurrent list requests for a user"""
+        flight = app.extensions["single_flight"]["list"]
+        responses = []
+
+        def list_user():
+            responses.append(app.test_client().get(BASE_URL, query_string="user_id=7"))
+
+        with patch.object(routes, "_list_serialized", lambda user_id: self._slow_query([{"user_id": user_id}])):
+            threads = [threading.Thread(target=list_user) for _ in range(3)]
+            threads[0].start()
+            wait_for(lambda: flight.in_flight() == 1)
+            for thread in threads[1:]:
+                thread.start()
+            wait_for(lambda: metrics.snapshot()["counters"].get("recommendation_list_coalesced") == 2)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_200_OK] * 3)
+        for response in responses:
+            self.assertEqual(response.get_json()[0]["user_id"], 7)
@@ -0,0 +1,145 @@
+"""
+Test cases for request tracing
+"""
+import json
+import logging
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import status, tracing
+from service.common.metrics import metrics
+from service.models import Recommendation, db
+from tests.factories import RecommendationFactory
+
+BASE_URL = "/api/recommendations"
+
+
+class TestTracing(TestCase):
+    """Request Tracing Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+        self.client = app.test_client()
+        self.tracer = self._configure(TRACE_SAMPLE_RATE=1.0)
+        metrics.reset()
+
+    def tearDown(self):
+        """This runs after each test"""
+        tracing.init_app(app)
+        db.session.remove()
+
+    def _configure(self, **settings):
+        with patch.dict(app.config, settings):
+            return tracing.init_app(app)
+
+    def _spans(self, trace):
+        return {item["name"]: item for item in trace["spans"]}
+
+    def test_list_phases(self):
+        """It should record the phases of a list request"""
+        recommendation = RecommendationFactory(id=None)
+        recommendation.create()
+        metrics.reset()
+        response = self.client.get(BASE_URL, headers={"X-Trace-Id": "abc-123"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Trace-Id"], "abc-123")
+        trace = self.tracer.recent()[0]
+        self.assertEqual((trace["trace_id"], trace["method"], trace["status"]), ("abc-123", "GET", 200))
+        spans = self._spans(trace)
+        for name in ("request", "marshal", "handler", "db", "serialize"):
+            self.assertIn(name, spans)
+        self.assertIsNone(spans["request"]["parent"])
+        self.assertEqual(spans["handler"]["parent"], spans["marshal"]["id"])
+        self.assertIn("SELECT", spans["db"]["detail"])
+        for item in trace["spans"]:
+            self.assertGreaterEqual(item["duration"], item["self"])
+        self.assertEqual(metrics.snapshot()["counters"]["traces_recorded"], 1)
+
+    def test_validation_phase(self):
+        """It should record validation, including its failure"""
+        response = self.client.post(BASE_URL, json={"user_id": "one"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        trace = self.tracer.recent()[0]
+        spans = self._spans(trace)
+        self.assertEqual(spans["validate"]["error"], "DataValidationError")
+        self.assertEqual(trace["status"], 400)
+
+    def test_not_sampled(self):
+        """It should only return a trace id for requests that are not sampled"""
+        self._configure(TRACE_SAMPLE_RATE=0)
+        response = self.client.get(BASE_URL, headers={"X-Trace-Id": "not valid!"})
+        self.assertEqual(len(response.headers["X-Trace-Id"]), 32)
+        self.assertEqual(app.extensions["tracer"].recent(), [])
+        self.assertIs(tracing.span("db"), tracing.NO_SPAN)
+
+    def test_forced_sampling(self):
+        """It should trace requests sent with X-Trace-Sampled"""
+        tracer = self._configure(TRACE_SAMPLE_RATE=0)
+        self.client.get(BASE_URL, headers={"X-Trace-Sampled": "1"})
+        self.assertEqual(len(tracer.recent()), 1)
+
+    def test_debug_endpoint(self):
+        """It should serve the recent traces, newest first"""
+        for trace_id in ("first", "second", "third"):
+            self.client.get(f"{BASE_URL}/0", headers={"X-Trace-Id": trace_id})
+        with patch.dict(app.config, {"TRACE_ENDPOINT": True}):
+            response = self.client.get("/debug/traces?limit=2")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            trace_ids = [trace["trace_id"] for trace in response.get_json()["traces"]]
+            self.assertEqual(trace_ids, ["third", "second"])
+            response = self.client.get("/debug/traces?trace_id=first")
+            self.assertEqual(response.get_json()["traces"][0]["status"], 404)
+
+    def test_debug_endpoint_disabled(self):
+        """It should not serve the traces unless TRACE_ENDPOINT is set"""
+        response = self.client.get("/debug/traces")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_debug_endpoint_bad_limit(self):
+        """It should reject a limit outside of 1 to TRACE_BUFFER_SIZE"""
+        settings = {"TRACE_ENDPOINT": True, "TRACE_BUFFER_SIZE": 200}
+        with patch.dict(app.config, settings):
+            for limit in ("-1", "0", "201", "all"):
+                response = self.client.get("/debug/traces", query_string={"limit": limit})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, limit)
+            response = self.client.get("/debug/traces", query_string={"limit": 200})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_ring_buffer(self):
+        """It should keep only the last TRACE_BUFFER_SIZE traces"""
+        tracer = self._configure(TRACE_SAMPLE_RATE=1.0, TRACE_BUFFER_SIZE=2)
+        for _ in range(5):
+            self.client.get("/health")
+        self.assertEqual(len(tracer.recent()), 2)
+
+    def test_trace_file(self):
+        """It should append the traces to TRACE_FILE"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+            self._configure(TRACE_SAMPLE_RATE=1.0, TRACE_FILE=path)
+            self.client.get("/health", headers={"X-Trace-Id": "to-file"})
+            with open(path, encoding="utf-8") as trace_file:
+                traces = [json.loads(line) for line in trace_file]
+        self.assertEqual(traces[0]["trace_id"], "to-file")
+
+    def test_span_outside_request(self):
+        """It should ignore spans outside of a traced request"""
+        with tracing.span("serialize"):
+            pass
+
+        @tracing.traced("handler")
+        def handler():
+            return 42
+
+        self.assertEqual(handler(), 42)
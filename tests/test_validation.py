@@ -0,0 +1,59 @@
+"""
+Test cases for the compiled payload validator
+"""
+from unittest import TestCase
+from service.models import RECOMMENDATION_VALIDATOR, RecommendationType, DataValidationError
+from tests.factories import RecommendationFactory
+
+
+class TestPayloadValidator(TestCase):
+    """Payload Validator Tests"""
+
+    def setUp(self):
+        self.data = RecommendationFactory().serialize()
+
+    def test_validate(self):
+        """It should return the converted values of a valid payload"""
+        self.data["recommendation_type"] = "TRENDING"
+        values = RECOMMENDATION_VALIDATOR.validate(self.data)
+        self.assertEqual(values["user_id"], self.data["user_id"])
+        self.assertEqual(values["recommendation_type"], RecommendationType.TRENDING)
+        self.assertNotIn("id", values)
+
+    def test_collect_every_error(self):
+        """It should report every invalid field at once"""
+        data = {"user_id": True, "product_id": "2", "recommendation_type": "UPSEL", "rating": 9}
+        with self.assertRaises(DataValidationError) as context:
+            RECOMMENDATION_VALIDATOR.validate(data)
+        self.assertEqual(
+            context.exception.errors,
+            [
+                "Invalid type for int [user_id]",
+                "Invalid type for int [product_id]",
+                "Invalid value for [recommendation_type]: UPSEL",
+                "Invalid Recommendation: missing bought_in_last_30_days",
+                "Invalid value for [rating]: must be between 0 and 5",
+            ],
+        )
+
+    def test_bad_body(self):
+        """It should not validate a payload that is not a dictionary"""
+        with self.assertRaises(DataValidationError) as context:
+            RECOMMENDATION_VALIDATOR.validate(["not", "a", "dict"])
+        self.assertIn("bad or no data", str(context.exception))
+
+    def test_partial(self):
+        """It should only validate the fields present in a partial payload"""
+        values = RECOMMENDATION_VALIDATOR.validate({"bought_in_last_30_days": False}, partial=True)
+        self.assertEqual(values, {"bought_in_last_30_days": False})
+        self.assertRaises(
+            DataValidationError, RECOMMENDATION_VALIDATOR.validate, {"recommendation_type": 1}, partial=True
+        )
+
+    def test_validate_many(self):
+        """It should validate a batch and report errors by position"""
+        bad = dict(self.data, bought_in_last_30_days="yes")
+        values, errors = RECOMMENDATION_VALIDATOR.validate_many([self.data, bad, self.data])
+        self.assertEqual(len(values), 2)
+        self.assertEqual(list(errors), [1])
+        self.assertIn("bought_in_last_30_days", errors[1][0])
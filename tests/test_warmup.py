@@ -0,0 +1,96 @@
+"""
+Test cases for the warm-up and readiness endpoint
+"""
+import logging
+import os
+import tempfile
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import lifecycle, shared_cache, status, warmup
+from service.common.metrics import metrics
+from service.common.warmup import WarmUp
+from service.models import Recommendation, db
+from tests.factories import RecommendationFactory
+
+
+class TestWarmUp(TestCase):
+    """Warm-up Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        db.create_all()
+        # so the first request does not start the warm-ups of the tests
+        lifecycle.start(app)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        metrics.reset()
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+        self.warm_up = WarmUp(app, connections=3, users=2, retry_seconds=0)
+        app.extensions["warmup"] = self.warm_up
+
+    def tearDown(self):
+        """This runs after each test"""
+        with patch.dict(app.config, {"WARMUP": False}):
+            warmup.init_app(app)
+        db.session.remove()
+
+    def test_ready_after_warm_up(self):
+        """It should only report ready once the warm-up is done"""
+        response = self.client.get("/ready")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+        self.warm_up.run()
+        response = self.client.get("/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["status"], "ready")
+        self.assertEqual(metrics.snapshot()["timers"]["warmup_seconds"]["count"], 1)
+
+    def test_opens_pooled_connections(self):
+        """It should leave the pool holding the warmed connections"""
+        db.engine.dispose()
+        self.warm_up.run()
+        self.assertGreaterEqual(db.engine.pool.checkedin(), 3)
+
+    def test_retries_until_the_database_answers(self):
+        """It should retry a failed warm-up"""
+        connect = db.engine.connect
+        failures = iter([RuntimeError("database starting up")])
+
+        def flaky_connect():
+            for error in failures:
+                raise error
+            return connect()
+
+        with patch.object(db.engine, "connect", flaky_connect):
+            self.warm_up.run()
+        self.assertTrue(self.warm_up.ready.is_set())
+        self.assertEqual(metrics.snapshot()["counters"]["warmup_errors"], 1)
+
+    def test_primes_list_cache(self):
+        """It should cache the lists of the most active users"""
+        for user_id, day in ((1, 3), (2, 2), (3, 1)):
+            RecommendationFactory(id=None, user_id=user_id, update_date=date(2024, 1, day)).create()
+        with tempfile.TemporaryDirectory() as directory:
+            settings = {"LIST_CACHE": True, "LIST_CACHE_PATH": os.path.join(directory, "cache")}
+            with patch.dict(app.config, settings):
+                cache = shared_cache.init_app(app)
+                try:
+                    self.warm_up.run()
+                    cached = [user_id for user_id in (1, 2, 3) if cache.load(user_id) is not None]
+                finally:
+                    with patch.dict(app.config, {"LIST_CACHE": False}):
+                        shared_cache.init_app(app)
+        self.assertEqual(cached, [1, 2])
+
+    def test_disabled(self):
+        """It should be ready at once when WARMUP is disabled"""
+        with patch.dict(app.config, {"WARMUP": False}):
+            self.assertTrue(warmup.init_app(app).ready.is_set())